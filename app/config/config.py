@@ -9,6 +9,66 @@ TOKEN = os.getenv('TELEGRAM_TOKEN')
 if not TOKEN:
     raise ValueError("No TELEGRAM_TOKEN found in environment variables")
 
+# Update ingestion: 'polling' (getUpdates) or 'webhook' (built-in HTTP listener)
+UPDATE_MODE = os.getenv('UPDATE_MODE', 'polling')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Public URL registered with setWebhook
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # Checked against X-Telegram-Bot-Api-Secret-Token
+POLL_TIMEOUT = int(os.getenv('POLL_TIMEOUT', '10'))  # getUpdates long-polling timeout, seconds
+
+# Worker processes; above 1, a front process ingests updates and routes each chat to one of them
+SHARDS = int(os.getenv('SHARDS', '1'))
+
+# Bot API endpoints (override to point the bot at a local fake Bot API)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # e.g. http://127.0.0.1:8081/bot
+TELEGRAM_FILE_URL = os.getenv('TELEGRAM_FILE_URL')  # e.g. http://127.0.0.1:8081/file/bot
+
+# Dispatcher worker threads; they run the handlers themselves when LANES is off
+DISPATCHER_WORKERS = int(os.getenv('DISPATCHER_WORKERS', '4'))
+
+# Handler execution: 'threaded' (a handler holds its lane or Dispatcher thread until it returns)
+# or 'asyncio' (handlers run as coroutines on one event loop, their blocking calls on an executor)
+RUNTIME_MODE = os.getenv('RUNTIME_MODE', 'threaded')
+ASYNC_IO_WORKERS = int(os.getenv('ASYNC_IO_WORKERS', '32'))  # Executor for blocking DB/state backend calls
+
+# Per-chat lanes: updates of one chat and class run one at a time, in order, while different
+# chats run in parallel. Each class has its own pool; phase transitions use PHASE_WORKERS
+LANES = os.getenv('LANES', 'true').lower() in ('1', 'true', 'yes')
+CALLBACK_WORKERS = int(os.getenv('CALLBACK_WORKERS', '4'))  # vote button presses
+COMMAND_WORKERS = int(os.getenv('COMMAND_WORKERS', '4'))  # commands and other group updates
+SUBMISSION_WORKERS = int(os.getenv('SUBMISSION_WORKERS', '4'))  # private-message task answers
+LANE_BATCH = int(os.getenv('LANE_BATCH', '16'))  # tasks a busy lane runs before yielding its thread
+
+# Outbound message scheduler (Telegram flood limits)
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '30'))  # messages per second, all chats
+OUTBOUND_GROUP_RATE = float(os.getenv('OUTBOUND_GROUP_RATE', str(20 / 60)))  # messages per second, per group
+OUTBOUND_GROUP_BURST = float(os.getenv('OUTBOUND_GROUP_BURST', '10'))
+OUTBOUND_PRIVATE_RATE = float(os.getenv('OUTBOUND_PRIVATE_RATE', '1'))  # messages per second, per user
+OUTBOUND_PRIVATE_BURST = float(os.getenv('OUTBOUND_PRIVATE_BURST', '3'))
+OUTBOUND_WORKERS = int(os.getenv('OUTBOUND_WORKERS', '8'))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '5'))
+
+# Game phase timers
+PHASE_TICK = float(os.getenv('PHASE_TICK', '0.1'))  # timing wheel resolution, seconds
+PHASE_JITTER = float(os.getenv('PHASE_JITTER', '0'))  # up to N random seconds added to each phase
+PHASE_WORKERS = int(os.getenv('PHASE_WORKERS', '4'))  # threads running phase transitions
+
+# Discussion reveal of drawings: 'album' (media groups) or 'collage' (one rendered contact sheet)
+REVEAL_MODE = os.getenv('REVEAL_MODE', 'album')
+COLLAGE_WORKERS = int(os.getenv('COLLAGE_WORKERS', '2'))  # rendering processes
+COLLAGE_TILE_SIZE = int(os.getenv('COLLAGE_TILE_SIZE', '320'))  # pixels per drawing
+COLLAGE_TIMEOUT = float(os.getenv('COLLAGE_TIMEOUT', '15'))  # seconds before falling back to albums
+
+# Local content-addressed cache of submitted photos, prefetched on submission
+PHOTO_CACHE_DIR = os.getenv('PHOTO_CACHE_DIR', 'photo_cache')
+PHOTO_CACHE_MAX_BYTES = int(os.getenv('PHOTO_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+PHOTO_PREFETCH_WORKERS = int(os.getenv('PHOTO_PREFETCH_WORKERS', '4'))
+
+# Log a metrics snapshot every N seconds (0 disables)
+METRICS_LOG_INTERVAL = int(os.getenv('METRICS_LOG_INTERVAL', '0'))
+
 # Game Settings
 MIN_PLAYERS = 3  # Changed from 6 to 3 for easier testing
 MAX_PLAYERS = 20
@@ -18,6 +78,17 @@ DEFAULT_VOTING_TIME = 60  # seconds
 DEFAULT_PREPARATION_TIME = 60  # seconds
 DEFAULT_CREATIVE_TIME = 120  # seconds
 
+# Adaptive phase durations: each chat's creative and voting phases last PHASE_GRACE times
+# the PHASE_PERCENTILE of its players' recent response times, within these bounds
+ADAPTIVE_PHASES = os.getenv('ADAPTIVE_PHASES', 'true').lower() in ('1', 'true', 'yes')
+PHASE_PERCENTILE = float(os.getenv('PHASE_PERCENTILE', '90'))
+PHASE_GRACE = float(os.getenv('PHASE_GRACE', '1.25'))
+PHASE_WINDOW = int(os.getenv('PHASE_WINDOW', '60'))  # latest responses kept per chat and phase
+PHASE_MIN_SAMPLES = int(os.getenv('PHASE_MIN_SAMPLES', '8'))  # fewer than this: use the default
+CREATIVE_TIME_BOUNDS = (45, 300)  # seconds
+DISCUSSION_TIME_BOUNDS = (90, 300)  # seconds
+VOTING_TIME_BOUNDS = (20, 120)  # seconds
+
 # Role Distribution
 SPY_RATIO = 0.25  # Percentage of players who will be spies
 DOUBLE_AGENT_ENABLED = True  # Whether to include double agent role
@@ -25,6 +96,33 @@ DOUBLE_AGENT_PROBABILITY = 0.15  # Chance of having a double agent if enabled
 
 # Database
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///spy_sketch.db')
+STATE_FLUSH_INTERVAL = float(os.getenv('STATE_FLUSH_INTERVAL', '1.0'))  # seconds between write-behind flushes
+
+# Short-lived state (registrations, pending tasks, open ballots): 'memory' for a single process,
+# or 'redis' to share it between bot processes (each chat's game and timers stay with one process)
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+STATE_TTL = int(os.getenv('STATE_TTL', str(6 * 3600)))  # seconds an untouched entry is kept
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+REDIS_PREFIX = os.getenv('REDIS_PREFIX', 'spy:')
+REDIS_POOL_SIZE = int(os.getenv('REDIS_POOL_SIZE', '8'))
+
+# Storage profile: 'default' (driver defaults) or 'production' (WAL, tuned pragmas, sized pool; opt in)
+DB_PROFILE = os.getenv('DB_PROFILE', 'default')
+# One connection per handler thread, plus the job queue and the state flusher
+if RUNTIME_MODE == 'asyncio':
+    HANDLER_THREADS = ASYNC_IO_WORKERS + (PHASE_WORKERS if LANES else 0)
+elif LANES:
+    HANDLER_THREADS = CALLBACK_WORKERS + COMMAND_WORKERS + SUBMISSION_WORKERS + PHASE_WORKERS
+else:
+    HANDLER_THREADS = DISPATCHER_WORKERS
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', str(HANDLER_THREADS + 2)))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '4'))
+DB_BUSY_TIMEOUT = int(os.getenv('DB_BUSY_TIMEOUT', '5000'))  # milliseconds to wait for a SQLite lock
+DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', '-65536'))  # SQLite pages, or KiB when negative
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))  # bytes
+# Sharded storage: spread the per-game tables over this many SQLite files by chat (0 = one file).
+# Users, stats and registrations stay in DATABASE_URL. Keep it fixed once games have been stored
+DB_SHARDS = int(os.getenv('DB_SHARDS', '0'))
 
 # Game States
 GAME_STATES = {
@@ -2,17 +2,25 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext, MessageHandler, Filters, CallbackQueryHandler
 import logging
 import datetime
-from sqlalchemy import and_
+from sqlalchemy import insert
 
-from app.models.database import get_session, Game, GamePlayer, GameRound, CreativeSubmission, User
-from app.config.config import GAME_STATES, DEFAULT_CREATIVE_TIME
-from app.utils.game_logic import generate_task
+from app.models.database import get_session, row_shard, CreativeSubmission
+from app.models.state_store import store
+from app.models.state_backend import state_backend
+from app.models.repository import get_round_submissions
+from app.models.phase_timing import phase_timing, CREATIVE, DISCUSSION
+from app.config.config import GAME_STATES, REVEAL_MODE
+from app.utils.game_logic import generate_task, format_duration
+from app.utils.outbound import outbound, PRIORITY_DM, PRIORITY_REMINDER
+from app.utils.fanout import FanOut, report_undelivered
+from app.utils.phase_scheduler import phase_scheduler
+from app.utils.photo_cache import photo_cache
+from app.utils.reveal import collage_renderer, send_albums, send_text_digests
+from app.utils.runtime import coroutine_handler, run_blocking
+from app.utils.sharding import claim_player
 
 logger = logging.getLogger(__name__)
 
-# Dictionary to store temporary submission data
-pending_submissions = {}
-
 def start_creative_phase(context: CallbackContext, chat_id: int, game_id: int, round_id: int) -> None:
     """
     Start the creative phase of the game.
@@ -23,72 +31,92 @@ def start_creative_phase(context: CallbackContext, chat_id: int, game_id: int, r
         game_id: Game ID
         round_id: Current round ID
     """
-    session = get_session()
+    # Get game and round
+    game = store.game(game_id)
+    if not game or game.round_id != round_id:
+        logger.error(f"Game or round not found: game_id={game_id}, round_id={round_id}")
+        return
+    
+    # Phase transitions are replayed after a restart, so skip one that already happened
+    if game.round_state != GAME_STATES['PREPARATION']:
+        logger.info(f"Skipping creative phase: game_id={game_id} is in state {game.round_state}")
+        return
+    
+    session = get_session(chat_id)
     try:
-        # Get game and round
-        game = session.query(Game).filter(Game.id == game_id).first()
-        game_round = session.query(GameRound).filter(GameRound.id == round_id).first()
-        
-        if not game or not game_round:
-            logger.error(f"Game or round not found: game_id={game_id}, round_id={round_id}")
-            return
-        
         # Update game and round state
-        game.state = GAME_STATES['CREATIVE']
-        game_round.state = GAME_STATES['CREATIVE']
-        session.commit()
+        store.set_state(game_id, GAME_STATES['CREATIVE'])
+        creative_time = phase_timing.duration(chat_id, CREATIVE)
         
         # Send message to group chat
-        context.bot.send_message(
+        outbound.send_message(
+            context.bot,
             chat_id=chat_id,
             text=(
                 "🎨 Творческий этап начался!\n\n"
                 "Все игроки получают задания в личных сообщениях. "
-                f"У вас есть {DEFAULT_CREATIVE_TIME // 60} минут на выполнение задания.\n\n"
+                f"У вас есть {format_duration(creative_time)} на выполнение задания.\n\n"
                 "Внимательно следуйте инструкциям и будьте креативны!"
             )
         )
         
-        # Get all active players
-        players = session.query(GamePlayer).filter(
-            and_(
-                GamePlayer.game_id == game_id,
-                GamePlayer.is_active == True
+        # Create submission records for every active player in one statement
+        players = game.active_players()
+        tasks = {player.player_id: generate_task() for player in players}
+        rows = [
+            {
+                "round_id": round_id,
+                "player_id": player_id,
+                "task": task_text,
+                "submission_type": task_type,
+                "content": None  # Will be filled when player submits
+            }
+            for player_id, (task_type, task_text) in tasks.items()
+        ]
+        submission_ids = {}
+        if rows:
+            result = session.execute(
+                insert(CreativeSubmission).returning(CreativeSubmission.id, CreativeSubmission.player_id),
+                rows
             )
-        ).all()
+            submission_ids = {player_id: submission_id for submission_id, player_id in result}
+        session.commit()
         
-        # Send tasks to each player
-        for player in players:
-            user = session.query(User).filter(User.id == player.user_id).first()
-            if not user:
-                continue
-            
-            # Generate task
-            task_type, task_text = generate_task()
-            
-            # Create submission record
-            submission = CreativeSubmission(
-                round_id=round_id,
-                player_id=player.id,
-                task=task_text,
-                submission_type=task_type,
-                content=None  # Will be filled when player submits
-            )
-            session.add(submission)
-            session.commit()
-            
-            # Store pending submission
-            if user.user_id not in pending_submissions:
-                pending_submissions[user.user_id] = {}
-            
-            pending_submissions[user.user_id] = {
-                "submission_id": submission.id,
+        assignments = [
+            (player.telegram_id, player.first_name, submission_ids[player.player_id]) + tasks[player.player_id]
+            for player in players
+        ]
+        
+        # Store pending tasks and schedule transition to discussion phase before any task goes out,
+        # so the last answer can always end the phase early
+        state_backend.put_tasks(round_id, {
+            telegram_id: {
+                "submission_id": submission_id,
                 "task_type": task_type,
-                "task_text": task_text
+                "task_text": task_text,
+                "game_id": game_id,
+                "round_id": round_id
             }
+            for telegram_id, _, submission_id, task_type, task_text in assignments
+        })
+        
+        phase_scheduler.run_once(
+            context.bot,
+            transition_to_discussion_phase,
+            creative_time,
+            context={"chat_id": chat_id, "game_id": game_id, "round_id": round_id},
+            game_id=game_id
+        )
+        
+        # Task DMs are delivered concurrently, failures are reported in one group message
+        task_messages = FanOut(context.bot)
+        
+        for telegram_id, first_name, submission_id, task_type, task_text in assignments:
+            # When sharded, the player's answer must reach this process
+            claim_player(telegram_id, chat_id)
             
             # Send task to player
-            message_text = f"🎯 Ваше задание для раунда {game_round.round_number}:\n\n*{task_text}*\n\n"
+            message_text = f"🎯 Ваше задание для раунда {game.round_number}:\n\n*{task_text}*\n\n"
             
             if task_type == 'DRAWING':
                 message_text += (
@@ -98,28 +126,22 @@ def start_creative_phase(context: CallbackContext, chat_id: int, game_id: int, r
             else:  # TEXT
                 message_text += "Пожалуйста, напишите и отправьте ваш ответ в ответ на это сообщение."
             
-            try:
-                context.bot.send_message(
-                    chat_id=user.user_id,
-                    text=message_text,
-                    parse_mode='Markdown'
-                )
-            except Exception as e:
-                logger.error(f"Error sending task to user {user.user_id}: {e}")
+            task_messages.send_message(
+                telegram_id,
+                first_name,
+                text=message_text,
+                parse_mode='Markdown'
+            )
         
-        # Schedule transition to discussion phase
-        context.job_queue.run_once(
-            transition_to_discussion_phase,
-            DEFAULT_CREATIVE_TIME,
-            context={"chat_id": chat_id, "game_id": game_id, "round_id": round_id}
-        )
+        task_messages.on_complete(report_undelivered(context.bot, chat_id, "задания"))
         
     except Exception as e:
         logger.error(f"Error starting creative phase: {e}")
     finally:
         session.close()
 
-def handle_text_submission(update: Update, context: CallbackContext) -> None:
+@coroutine_handler
+async def handle_text_submission(update: Update, context: CallbackContext) -> None:
     """
     Handle text submission from player.
     """
@@ -135,48 +157,36 @@ def handle_text_submission(update: Update, context: CallbackContext) -> None:
         return
     
     # Check if this user has a pending submission
-    if user_id not in pending_submissions:
-        update.message.reply_text("У вас нет активного задания или время вышло.")
+    pending = await run_blocking(state_backend.task, user_id)
+    if not pending:
+        reply(context, user_id, "У вас нет активного задания или время вышло.")
         return
     
     # Check if the submission is a text task
-    if pending_submissions[user_id]["task_type"] != "TEXT":
-        update.message.reply_text(
-            "Это задание требует изображение. Пожалуйста, отправьте фото или рисунок."
-        )
+    if pending["task_type"] != "TEXT":
+        reply(context, user_id, "Это задание требует изображение. Пожалуйста, отправьте фото или рисунок.")
         return
     
     # Process text submission
-    submission_id = pending_submissions[user_id]["submission_id"]
-    
-    session = get_session()
     try:
-        submission = session.query(CreativeSubmission).filter(
-            CreativeSubmission.id == submission_id
-        ).first()
-        
-        if not submission:
-            update.message.reply_text("Произошла ошибка. Попробуйте еще раз.")
+        if not await run_blocking(save_submission, pending["submission_id"], content=text):
+            reply(context, user_id, "Произошла ошибка. Попробуйте еще раз.")
             return
         
-        # Update submission
-        submission.content = text
-        session.commit()
-        
         # Remove from pending submissions
-        del pending_submissions[user_id]
+        task, remaining = await run_blocking(state_backend.take_task, user_id)
         
-        update.message.reply_text(
-            "✅ Ваш ответ принят! Ожидайте начала обсуждения."
-        )
+        reply(context, user_id, "✅ Ваш ответ принят! Ожидайте начала обсуждения.")
+        
+        if task:
+            count_submission(task, remaining)
         
     except Exception as e:
         logger.error(f"Error processing text submission: {e}")
-        update.message.reply_text("Произошла ошибка при обработке вашего ответа. Попробуйте еще раз.")
-    finally:
-        session.close()
+        reply(context, user_id, "Произошла ошибка при обработке вашего ответа. Попробуйте еще раз.")
 
-def handle_photo_submission(update: Update, context: CallbackContext) -> None:
+@coroutine_handler
+async def handle_photo_submission(update: Update, context: CallbackContext) -> None:
     """
     Handle photo submission from player.
     """
@@ -192,65 +202,116 @@ def handle_photo_submission(update: Update, context: CallbackContext) -> None:
         return
     
     # Check if this user has a pending submission
-    if user_id not in pending_submissions:
-        update.message.reply_text("У вас нет активного задания или время вышло.")
+    pending = await run_blocking(state_backend.task, user_id)
+    if not pending:
+        reply(context, user_id, "У вас нет активного задания или время вышло.")
         return
     
     # Check if the submission is a drawing task
-    if pending_submissions[user_id]["task_type"] != "DRAWING":
-        update.message.reply_text(
-            "Это задание требует текстовый ответ. Пожалуйста, отправьте сообщение."
-        )
+    if pending["task_type"] != "DRAWING":
+        reply(context, user_id, "Это задание требует текстовый ответ. Пожалуйста, отправьте сообщение.")
         return
     
     # Process photo submission
-    submission_id = pending_submissions[user_id]["submission_id"]
+    try:
+        saved = await run_blocking(
+            save_submission,
+            pending["submission_id"],
+            content=photo.file_id,
+            file_unique_id=photo.file_unique_id
+        )
+        if not saved:
+            reply(context, user_id, "Произошла ошибка. Попробуйте еще раз.")
+            return
+        
+        # Remove from pending submissions
+        task, remaining = await run_blocking(state_backend.take_task, user_id)
+        
+        # Download the drawing for the collage now, so the discussion phase doesn't wait for it
+        if REVEAL_MODE == 'collage':
+            photo_cache.prefetch(context.bot, photo.file_id, photo.file_unique_id)
+        
+        reply(context, user_id, "✅ Ваш рисунок принят! Ожидайте начала обсуждения.")
+        
+        if task:
+            count_submission(task, remaining)
+        
+    except Exception as e:
+        logger.error(f"Error processing photo submission: {e}")
+        reply(context, user_id, "Произошла ошибка при обработке вашего рисунка. Попробуйте еще раз.")
+
+def save_submission(submission_id: int, **fields) -> bool:
+    """
+    Store a player's answer on their submission.
     
-    session = get_session()
+    Args:
+        submission_id: ID of the player's submission
+        **fields: Submission columns to set (content, file_unique_id)
+        
+    Returns:
+        False if the submission no longer exists
+    """
+    session = get_session(shard=row_shard(submission_id))
     try:
         submission = session.query(CreativeSubmission).filter(
             CreativeSubmission.id == submission_id
         ).first()
         
         if not submission:
-            update.message.reply_text("Произошла ошибка. Попробуйте еще раз.")
-            return
+            return False
         
-        # Update submission with file_id
-        submission.content = photo.file_id
+        for name, value in fields.items():
+            setattr(submission, name, value)
+        submission.submitted_at = datetime.datetime.utcnow()
         session.commit()
-        
-        # Remove from pending submissions
-        del pending_submissions[user_id]
-        
-        update.message.reply_text(
-            "✅ Ваш рисунок принят! Ожидайте начала обсуждения."
-        )
-        
-    except Exception as e:
-        logger.error(f"Error processing photo submission: {e}")
-        update.message.reply_text("Произошла ошибка при обработке вашего рисунка. Попробуйте еще раз.")
+        return True
     finally:
         session.close()
 
+def reply(context: CallbackContext, user_id: int, text: str) -> None:
+    """
+    Answer a player's private message without waiting for the Bot API.
+    
+    Args:
+        context: Handler context
+        user_id: Player's Telegram ID (their private chat)
+        text: Message text
+    """
+    outbound.send_message(context.bot, chat_id=user_id, priority=PRIORITY_DM, text=text)
+
+def count_submission(task: dict, remaining: int) -> None:
+    """
+    Count an answered task and start the discussion right away once the whole round has answered.
+    
+    Args:
+        task: The player's pending task
+        remaining: Tasks of the round still unanswered
+    """
+    round_id = task.get("round_id")
+    if round_id is None or remaining:
+        return
+    
+    if phase_scheduler.expedite(task["game_id"], transition_to_discussion_phase):
+        logger.info(f"Everyone submitted, starting discussion early: game_id={task['game_id']}, round_id={round_id}")
+
 def remind_players(context: CallbackContext) -> None:
     """
     Send reminders to players who haven't submitted yet.
     """
-    if not pending_submissions:
+    pending = state_backend.tasks()
+    if not pending:
         return
     
-    for user_id, data in pending_submissions.items():
-        try:
-            context.bot.send_message(
-                chat_id=user_id,
-                text=(
-                    "⏰ Напоминание: у вас осталось мало времени для выполнения задания! "
-                    "Пожалуйста, отправьте ваш ответ как можно скорее."
-                )
+    for user_id in pending:
+        outbound.send_message(
+            context.bot,
+            chat_id=user_id,
+            priority=PRIORITY_REMINDER,
+            text=(
+                "⏰ Напоминание: у вас осталось мало времени для выполнения задания! "
+                "Пожалуйста, отправьте ваш ответ как можно скорее."
             )
-        except Exception as e:
-            logger.error(f"Error sending reminder to user {user_id}: {e}")
+        )
 
 def transition_to_discussion_phase(context: CallbackContext) -> None:
     """
@@ -261,28 +322,36 @@ def transition_to_discussion_phase(context: CallbackContext) -> None:
     game_id = job_data["game_id"]
     round_id = job_data["round_id"]
     
-    session = get_session()
+    # Get game and round
+    game = store.game(game_id)
+    if not game or game.round_id != round_id:
+        logger.error(f"Game or round not found: game_id={game_id}, round_id={round_id}")
+        return
+    
+    # Only move on from the creative phase
+    if game.round_state != GAME_STATES['CREATIVE']:
+        logger.info(f"Skipping discussion phase: game_id={game_id} is in state {game.round_state}")
+        return
+    
+    state_backend.clear_round_tasks(round_id)
+    creative_started_at = game.phase_started_at
+    
+    session = get_session(chat_id)
     try:
-        # Get game and round
-        game = session.query(Game).filter(Game.id == game_id).first()
-        game_round = session.query(GameRound).filter(GameRound.id == round_id).first()
-        
-        if not game or not game_round:
-            logger.error(f"Game or round not found: game_id={game_id}, round_id={round_id}")
-            return
-        
         # Update game and round state
-        game.state = GAME_STATES['DISCUSSION']
-        game_round.state = GAME_STATES['DISCUSSION']
-        session.commit()
+        store.set_state(game_id, GAME_STATES['DISCUSSION'])
         
         # Get all submissions for this round
-        submissions = session.query(CreativeSubmission).filter(
-            CreativeSubmission.round_id == round_id
-        ).all()
+        submissions = get_round_submissions(session, round_id)
+        
+        # Answer times size this chat's next creative phases
+        answered = [submission.submitted_at for submission in submissions if submission.content]
+        phase_timing.record(chat_id, CREATIVE, creative_started_at, answered,
+                            len(submissions) - len(answered), datetime.datetime.utcnow())
         
         # Send message to group chat
-        context.bot.send_message(
+        outbound.send_message(
+            context.bot,
             chat_id=chat_id,
             text=(
                 "🔎 Обсуждение начинается!\n\n"
@@ -291,37 +360,28 @@ def transition_to_discussion_phase(context: CallbackContext) -> None:
             )
         )
         
-        # Display all submissions anonymously
-        for i, submission in enumerate(submissions, 1):
-            if not submission.content:
-                continue  # Skip empty submissions
-                
-            player = session.query(GamePlayer).filter(GamePlayer.id == submission.player_id).first()
-            if not player:
-                continue
-                
-            # Send anonymized submission
-            if submission.submission_type == 'DRAWING':
-                caption = f"🖼 Рисунок #A{i}: *{submission.task}*"
-                context.bot.send_photo(
-                    chat_id=chat_id,
-                    photo=submission.content,
-                    caption=caption,
-                    parse_mode='Markdown'
-                )
-            else:  # TEXT
-                context.bot.send_message(
-                    chat_id=chat_id,
-                    text=(
-                        f"📝 Описание #A{i}:\n"
-                        f"Задание: *{submission.task}*\n\n"
-                        f"Ответ: \"{submission.content}\""
-                    ),
-                    parse_mode='Markdown'
-                )
+        # Number submissions in task order so #A labels stay the same however they are grouped
+        numbered = [
+            (i, submission) for i, submission in enumerate(submissions, 1)
+            if submission.content and submission.player_id in game.players
+        ]
+        
+        drawings = [(i, submission) for i, submission in numbered if submission.submission_type == 'DRAWING']
+        answers = [(i, submission) for i, submission in numbered if submission.submission_type != 'DRAWING']
+        
+        # Drawings go out as one rendered collage or as albums of up to 10 captioned photos;
+        # the collage is waited for so the text answers and the wrap-up come after it
+        if REVEAL_MODE == 'collage' and drawings:
+            collage_renderer.reveal(context.bot, chat_id, drawings)
+        else:
+            send_albums(context.bot, chat_id, drawings)
+        
+        # Text answers are merged into as few messages as the length limit allows
+        send_text_digests(context.bot, chat_id, answers)
         
         # Send final discussion message
-        context.bot.send_message(
+        outbound.send_message(
+            context.bot,
             chat_id=chat_id,
             text=(
                 "Обсудите представленные материалы и попытайтесь определить, кто может быть шпионом.\n"
@@ -329,16 +389,15 @@ def transition_to_discussion_phase(context: CallbackContext) -> None:
             )
         )
         
-        # Schedule transition to voting phase
-        # This will be implemented in discussion.py handler
-        # For now, we'll just announce that voting will start soon
-        context.job_queue.run_once(
-            lambda c: c.bot.send_message(
-                chat_id=chat_id,
-                text="🗳 Голосование скоро начнется! Приготовьтесь сделать свой выбор."
-            ),
-            240,  # Discussion time in seconds
-            context=None
+        # Schedule transition to voting phase (imported here: voting -> registration -> creative)
+        from app.handlers.voting import transition_to_voting_phase
+        
+        phase_scheduler.run_once(
+            context.bot,
+            transition_to_voting_phase,
+            phase_timing.duration(chat_id, DISCUSSION),
+            context={"chat_id": chat_id, "game_id": game_id, "round_id": round_id},
+            game_id=game_id
         )
         
     except Exception as e:
@@ -0,0 +1,211 @@
+import datetime
+import logging
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from telegram import Bot
+
+from app.models.database import get_session, storage_shards, row_shard, CreativeSubmission, Registration, Vote
+from app.models.state_store import store
+from app.models.state_backend import state_backend
+from app.models.vote_ledger import vote_ledger
+from app.config.config import GAME_STATES, DEFAULT_PREPARATION_TIME
+from app.models.phase_timing import phase_timing, CREATIVE, DISCUSSION, VOTING
+from app.handlers.registration import transition_to_creative_phase
+from app.handlers.creative import transition_to_discussion_phase
+from app.handlers.voting import transition_to_voting_phase, end_voting_phase, transition_to_next_round
+from app.utils.phase_scheduler import phase_scheduler, PhaseTimer
+from app.utils.sharding import claim_player
+
+logger = logging.getLogger(__name__)
+
+# Phase transitions that are persisted and resumed after a restart, by name
+PHASE_CALLBACKS = {
+    callback.__name__: callback
+    for callback in (
+        transition_to_creative_phase,
+        transition_to_discussion_phase,
+        transition_to_voting_phase,
+        end_voting_phase,
+        transition_to_next_round,
+    )
+}
+
+# The transition that ends each round state
+NEXT_PHASES = {
+    GAME_STATES['PREPARATION']: transition_to_creative_phase,
+    GAME_STATES['CREATIVE']: transition_to_discussion_phase,
+    GAME_STATES['DISCUSSION']: transition_to_voting_phase,
+    GAME_STATES['VOTING']: end_voting_phase,
+    GAME_STATES['RESULTS']: transition_to_next_round,
+}
+
+def phase_length(chat_id: int, round_state: int) -> float:
+    """Full length of the phase a round is in (0 once it is settled)."""
+    if round_state == GAME_STATES['PREPARATION']:
+        return DEFAULT_PREPARATION_TIME
+    if round_state == GAME_STATES['CREATIVE']:
+        return phase_timing.duration(chat_id, CREATIVE)
+    if round_state == GAME_STATES['DISCUSSION']:
+        return phase_timing.duration(chat_id, DISCUSSION)
+    if round_state == GAME_STATES['VOTING']:
+        return phase_timing.duration(chat_id, VOTING)
+    return 0.0
+
+def remember_phase(timer: PhaseTimer) -> None:
+    """Schedule hook storing a game's next phase deadline (written behind by the state store)."""
+    if timer.game_id is None or timer.name not in PHASE_CALLBACKS:
+        return
+    remaining = max(0.0, timer.due - time.monotonic())
+    deadline = datetime.datetime.utcnow() + datetime.timedelta(seconds=remaining)
+    store.set_phase(timer.game_id, timer.name, deadline)
+
+phase_scheduler.add_schedule_hook(remember_phase)
+
+def recover(bot: Bot, owns: Optional[Callable[[int], bool]] = None) -> Dict[str, int]:
+    """
+    Rebuild in-memory game state and phase timers after a restart.
+    
+    Expects `store.load()` to have run. Running games claim their chats in
+    the state backend again; registrations, unanswered tasks and the
+    votes of open ballots are loaded with one query each (per storage shard);
+    every unfinished game gets its phase timer back, and deadlines that passed
+    while the bot was down fire right away. A game whose stored next phase does
+    not match its round (the write was lost in the crash) gets the transition
+    that ends the round's phase, due after the rest of that phase.
+    
+    Args:
+        bot: Bot used by the resumed phase transitions
+        owns: Only restore registrations of the chats this returns True for
+            (games are already filtered by `store.load`)
+        
+    Returns:
+        Counts of what was restored
+    """
+    games = store.games()
+    creative_rounds = {
+        game.round_id: game for game in games
+        if game.round_id is not None and game.round_state == GAME_STATES['CREATIVE']
+    }
+    voting_rounds = {
+        game.round_id: game for game in games
+        if game.round_id is not None and game.round_state == GAME_STATES['VOTING']
+    }
+    restored = {"games": len(games), "registrations": 0, "pending_submissions": 0,
+                "ballots": len(voting_rounds), "timers": 0, "overdue": 0}
+    
+    # Running games hold their chats again (already so if a shared backend outlived the restart)
+    for game in games:
+        if not state_backend.claim_chat(game.chat_id, game.game_id):
+            logger.error(f"Chat {game.chat_id} is held by game {state_backend.chat_game(game.chat_id)}, "
+                         f"not by restored game {game.game_id}")
+    
+    session = get_session()
+    try:
+        # Open registrations
+        consumed = set()
+        for registration in session.query(Registration).order_by(Registration.id):
+            if owns is not None and not owns(registration.chat_id):
+                continue
+            # A game started but the crash came before its registration was cleared (see startgame_command)
+            running = store.game_for_chat(registration.chat_id)
+            if running and running.state != GAME_STATES['IDLE']:
+                consumed.add(registration.chat_id)
+                continue
+            # Already present if a shared backend outlived the restart
+            state_backend.register(registration.chat_id, {
+                "id": registration.user_id,
+                "first_name": registration.first_name,
+                "is_bot": False,
+                "username": registration.username,
+                "last_name": registration.last_name
+            })
+            restored["registrations"] += 1
+        if consumed:
+            session.query(Registration).filter(Registration.chat_id.in_(consumed)).delete(synchronize_session=False)
+            session.commit()
+    finally:
+        session.close()
+    
+    # Tasks and votes live with their games, in each storage shard
+    for shard in storage_shards():
+        shard_creative = {round_id: game for round_id, game in creative_rounds.items() if row_shard(round_id) == shard}
+        shard_voting = {round_id: game for round_id, game in voting_rounds.items() if row_shard(round_id) == shard}
+        if not shard_creative and not shard_voting:
+            continue
+        
+        session = get_session(shard=shard)
+        try:
+            # Tasks not answered yet
+            if shard_creative:
+                submissions = session.query(CreativeSubmission).filter(
+                    CreativeSubmission.round_id.in_(list(shard_creative)),
+                    CreativeSubmission.content.is_(None)
+                )
+                unanswered: Dict[int, Dict[int, Dict[str, Any]]] = {}
+                for submission in submissions:
+                    game = shard_creative[submission.round_id]
+                    player = game.players.get(submission.player_id)
+                    if player:
+                        unanswered.setdefault(submission.round_id, {})[player.telegram_id] = {
+                            "submission_id": submission.id,
+                            "task_type": submission.submission_type,
+                            "task_text": submission.task,
+                            "game_id": game.game_id,
+                            "round_id": submission.round_id
+                        }
+                        claim_player(player.telegram_id, game.chat_id)
+                        restored["pending_submissions"] += 1
+                for round_id, tasks in unanswered.items():
+                    state_backend.put_tasks(round_id, tasks)
+            
+            # Ballots still open, with the votes already cast
+            if shard_voting:
+                votes: Dict[int, Dict[int, Tuple[int, datetime.datetime]]] = {round_id: {} for round_id in shard_voting}
+                rows = session.query(Vote.round_id, Vote.voter_id, Vote.target_id, Vote.voted_at) \
+                    .filter(Vote.round_id.in_(list(shard_voting)))
+                for round_id, voter_id, target_id, voted_at in rows:
+                    votes[round_id][voter_id] = (target_id, voted_at)
+                for round_id, game in shard_voting.items():
+                    vote_ledger.open_round(round_id, game.game_id, game.active_players(), votes[round_id])
+        finally:
+            session.close()
+    
+    # Ballot answers arrive as private callbacks: route them to this worker (a discussion
+    # round's ballots go out when its timer fires)
+    for game in games:
+        if game.round_state in (GAME_STATES['DISCUSSION'], GAME_STATES['VOTING']):
+            for player in game.active_players():
+                claim_player(player.telegram_id, game.chat_id)
+    
+    # Phase timers
+    now = datetime.datetime.utcnow()
+    for game in games:
+        callback = PHASE_CALLBACKS.get(game.next_phase)
+        expected = NEXT_PHASES.get(game.round_state)
+        if expected and (callback is not expected or game.phase_deadline is None):
+            # The stored next phase lags the round (written behind, lost in the crash):
+            # reschedule from the round state, counting time already spent in the phase
+            callback = expected
+            elapsed = (now - (game.phase_started_at or now)).total_seconds()
+            delay = phase_length(game.chat_id, game.round_state) - elapsed
+            logger.warning(f"Game {game.game_id} has no stored next phase for round state {game.round_state}, "
+                           f"rescheduling {callback.__name__}")
+        elif not callback or game.phase_deadline is None:
+            logger.warning(f"Game {game.game_id} has no pending phase to resume (state {game.state})")
+            continue
+        else:
+            delay = (game.phase_deadline - now).total_seconds()
+        if delay <= 0:
+            restored["overdue"] += 1
+        
+        phase_scheduler.run_once(
+            bot,
+            callback,
+            max(0.0, delay),
+            context={"chat_id": game.chat_id, "game_id": game.game_id, "round_id": game.round_id},
+            game_id=game.game_id
+        )
+        restored["timers"] += 1
+    
+    return restored
@@ -1,21 +1,28 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, User as TelegramUser
 from telegram.ext import CallbackContext, CommandHandler, CallbackQueryHandler, Filters, MessageHandler
 import logging
 import datetime
 
-from app.models.database import get_session, User, Game, GamePlayer, GameRound
-from app.config.config import GAME_STATES, MIN_PLAYERS, MAX_PLAYERS, ROLES
+from app.models.database import get_session, Game, GameRound, Registration
+from app.models.state_store import store, LiveGame, LivePlayer
+from app.models.state_backend import state_backend
+from app.models.repository import create_game_players, save_users
+from app.config.config import GAME_STATES, MIN_PLAYERS, MAX_PLAYERS, ROLES, DEFAULT_PREPARATION_TIME
+from app.handlers.creative import start_creative_phase
 from app.utils.game_logic import assign_roles
+from app.utils.fanout import FanOut, report_undelivered
+from app.utils.outbound import outbound
+from app.utils.phase_scheduler import phase_scheduler
+from app.utils.runtime import coroutine_handler, run_blocking
 
 logger = logging.getLogger(__name__)
 
-# Dictionary to store temporary game registration data
-active_registrations = {}
-
 def start_command(update: Update, context: CallbackContext) -> None:
     """
     Start the bot and display welcome message.
     """
+    chat_id = update.effective_chat.id
+    
     message = (
         "👋 Добро пожаловать в игру Spy Sketch!\n\n"
         "Это групповая игра-дедукция с творческими заданиями для 6-20 игроков.\n\n"
@@ -23,12 +30,18 @@ def start_command(update: Update, context: CallbackContext) -> None:
         "Когда все будут готовы, используйте /startgame чтобы начать игру.\n"
         "Для получения справки используйте /help."
     )
-    update.message.reply_text(message)
+    outbound.send_message(
+        context.bot,
+        chat_id=chat_id,
+        text=message
+    )
 
 def help_command(update: Update, context: CallbackContext) -> None:
     """
     Display help information.
     """
+    chat_id = update.effective_chat.id
+    
     help_text = (
         "📋 Список команд:\n\n"
         "/start - Начать работу с ботом\n"
@@ -44,12 +57,18 @@ def help_command(update: Update, context: CallbackContext) -> None:
         "3. Каждый игрок получит секретную роль в личном сообщении\n"
         "4. Следуйте инструкциям от бота в течение игровых этапов\n"
     )
-    update.message.reply_text(help_text)
+    outbound.send_message(
+        context.bot,
+        chat_id=chat_id,
+        text=help_text
+    )
 
 def rules_command(update: Update, context: CallbackContext) -> None:
     """
     Display game rules.
     """
+    chat_id = update.effective_chat.id
+    
     rules_text = (
         "📌 Правила игры Spy Sketch:\n\n"
         "1. Игра предназначена для 6-20 игроков.\n"
@@ -65,9 +84,14 @@ def rules_command(update: Update, context: CallbackContext) -> None:
         "4. После голосования 'устраняется' один игрок, и игра продолжается.\n"
         "5. Игра заканчивается, когда все шпионы устранены (победа лояльных) или когда шпионов становится больше или столько же, сколько лояльных (победа шпионов).\n"
     )
-    update.message.reply_text(rules_text)
+    outbound.send_message(
+        context.bot,
+        chat_id=chat_id,
+        text=rules_text
+    )
 
-def join_command(update: Update, context: CallbackContext) -> None:
+@coroutine_handler
+async def join_command(update: Update, context: CallbackContext) -> None:
     """
     Register a player for the game.
     """
@@ -76,41 +100,66 @@ def join_command(update: Update, context: CallbackContext) -> None:
     
     # Check if we're in a group chat
     if update.effective_chat.type not in ['group', 'supergroup']:
-        update.message.reply_text("Эта игра доступна только в групповых чатах!")
+        outbound.send_message(
+            context.bot,
+            chat_id=chat_id,
+            text="Эта игра доступна только в групповых чатах!"
+        )
         return
     
-    # Initialize registration for this chat if it doesn't exist
-    if chat_id not in active_registrations:
-        active_registrations[chat_id] = []
+    # Check if there's a game in progress, on whichever node runs it
+    if await run_blocking(state_backend.chat_game, chat_id) is not None:
+        outbound.send_message(
+            context.bot,
+            chat_id=chat_id,
+            text="В этом чате уже идет игра! Дождитесь ее завершения."
+        )
+        return
     
-    # Check if user already registered
-    if any(reg_user.id == user.id for reg_user in active_registrations[chat_id]):
-        update.message.reply_text(f"{user.first_name}, вы уже зарегистрированы для игры!")
+    # Add user to registration; the check for a repeated /join is part of the same atomic step
+    player_count = await run_blocking(state_backend.register, chat_id, user.to_dict())
+    if player_count is None:
+        outbound.send_message(
+            context.bot,
+            chat_id=chat_id,
+            text=f"{user.first_name}, вы уже зарегистрированы для игры!"
+        )
         return
     
-    # Check if there's a game in progress
-    session = get_session()
-    try:
-        existing_game = session.query(Game).filter(
-            Game.chat_id == chat_id,
-            Game.finished_at.is_(None)
-        ).first()
-        
-        if existing_game and existing_game.state != GAME_STATES['IDLE']:
-            update.message.reply_text("В этом чате уже идет игра! Дождитесь ее завершения.")
-            return
-        
-        # Add user to registration
-        active_registrations[chat_id].append(user)
-        
-        # Get current player count
-        player_count = len(active_registrations[chat_id])
-        
-        update.message.reply_text(
+    # Persist the registration so it survives a restart
+    await run_blocking(save_registration, chat_id, user)
+    
+    outbound.send_message(
+        context.bot,
+        chat_id=chat_id,
+        text=(
             f"{user.first_name} присоединился к игре! "
             f"Зарегистрировано игроков: {player_count}/{MIN_PLAYERS} мин. | {MAX_PLAYERS} макс.\n"
             f"Когда все будут готовы, введите /startgame"
         )
+    )
+
+def save_registration(chat_id: int, user: TelegramUser) -> None:
+    """
+    Persist a player's registration.
+    
+    Args:
+        chat_id: Group chat the player joined in
+        user: Joining Telegram user
+    """
+    session = get_session()
+    try:
+        session.add(Registration(
+            chat_id=chat_id,
+            user_id=user.id,
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name
+        ))
+        session.commit()
+    except Exception as e:
+        logger.error(f"Error saving registration: {e}")
+        session.rollback()
     finally:
         session.close()
 
@@ -122,50 +171,77 @@ def startgame_command(update: Update, context: CallbackContext) -> None:
     
     # Check if we're in a group chat
     if update.effective_chat.type not in ['group', 'supergroup']:
-        update.message.reply_text("Эта игра доступна только в групповых чатах!")
+        outbound.send_message(
+            context.bot,
+            chat_id=chat_id,
+            text="Эта игра доступна только в групповых чатах!"
+        )
         return
     
     # Check if there's an active registration
-    if chat_id not in active_registrations or not active_registrations[chat_id]:
-        update.message.reply_text("Сначала игроки должны зарегистрироваться с помощью команды /join!")
+    telegram_users = [TelegramUser.de_json(user, context.bot) for user in state_backend.registrations(chat_id)]
+    if not telegram_users:
+        outbound.send_message(
+            context.bot,
+            chat_id=chat_id,
+            text="Сначала игроки должны зарегистрироваться с помощью команды /join!"
+        )
         return
     
     # Check if we have enough players
-    player_count = len(active_registrations[chat_id])
+    player_count = len(telegram_users)
     if player_count < MIN_PLAYERS:
-        update.message.reply_text(
-            f"Недостаточно игроков! Требуется минимум {MIN_PLAYERS}, "
-            f"сейчас зарегистрировано {player_count}."
+        outbound.send_message(
+            context.bot,
+            chat_id=chat_id,
+            text=(
+                f"Недостаточно игроков! Требуется минимум {MIN_PLAYERS}, "
+                f"сейчас зарегистрировано {player_count}."
+            )
         )
         return
     
     # Check if we have too many players
     if player_count > MAX_PLAYERS:
-        update.message.reply_text(
-            f"Слишком много игроков! Максимум {MAX_PLAYERS}, "
-            f"сейчас зарегистрировано {player_count}."
+        outbound.send_message(
+            context.bot,
+            chat_id=chat_id,
+            text=(
+                f"Слишком много игроков! Максимум {MAX_PLAYERS}, "
+                f"сейчас зарегистрировано {player_count}."
+            )
         )
         return
     
-    session = get_session()
+    # Check if there's a game in progress, on whichever node runs it
+    existing_game = store.game_for_chat(chat_id)
+    if state_backend.chat_game(chat_id) is not None or (existing_game and existing_game.state != GAME_STATES['IDLE']):
+        outbound.send_message(
+            context.bot,
+            chat_id=chat_id,
+            text="В этом чате уже идет игра! Дождитесь ее завершения."
+        )
+        return
+    
+    # Users live in the global database and games in the chat's shard file, whose
+    # commits are atomic per file only (WAL), so each file gets its own transaction,
+    # ordered so a crash between them is harmless: users first (unused if no game
+    # follows), then the game, then the consumed registration (left behind, it is
+    # dropped by recovery once the chat has a running game).
+    users_session = get_session()
+    session = get_session(chat_id)
+    claimed = None
     try:
-        # Check if there's a game in progress
-        existing_game = session.query(Game).filter(
-            Game.chat_id == chat_id,
-            Game.finished_at.is_(None)
-        ).first()
-        
-        if existing_game and existing_game.state != GAME_STATES['IDLE']:
-            update.message.reply_text("В этом чате уже идет игра! Дождитесь ее завершения.")
-            return
+        user_ids = save_users(users_session, telegram_users)
+        users_session.commit()
         
         # Create new game or reuse existing one
         if not existing_game:
             game = Game(chat_id=chat_id, state=GAME_STATES['REGISTRATION'])
             session.add(game)
-            session.commit()
+            session.flush()
         else:
-            game = existing_game
+            game = session.get(Game, existing_game.game_id)
             game.state = GAME_STATES['REGISTRATION']
             game.started_at = datetime.datetime.utcnow()
             game.finished_at = None
@@ -173,44 +249,8 @@ def startgame_command(update: Update, context: CallbackContext) -> None:
         # Generate roles
         roles = assign_roles(player_count)
         
-        # Register all players and send them their roles
-        update.message.reply_text("🎮 Игра начинается! Каждый игрок получит свою роль в личном сообщении.")
-        
-        for i, telegram_user in enumerate(active_registrations[chat_id]):
-            # Get or create user in database
-            user = session.query(User).filter(User.user_id == telegram_user.id).first()
-            if not user:
-                user = User(
-                    user_id=telegram_user.id,
-                    username=telegram_user.username,
-                    first_name=telegram_user.first_name,
-                    last_name=telegram_user.last_name
-                )
-                session.add(user)
-                session.commit()
-            
-            # Create game player
-            game_player = GamePlayer(
-                game_id=game.id,
-                user_id=user.id,
-                role=roles[i]
-            )
-            session.add(game_player)
-            
-            # Send role information to player
-            role_info = get_role_description(roles[i])
-            try:
-                context.bot.send_message(
-                    chat_id=telegram_user.id,
-                    text=f"🔒 Ваша роль в игре Spy Sketch: *{roles[i]}*\n\n{role_info}",
-                    parse_mode='Markdown'
-                )
-            except Exception as e:
-                logger.error(f"Error sending role to user {telegram_user.id}: {e}")
-                update.message.reply_text(
-                    f"⚠️ Не удалось отправить роль игроку {telegram_user.first_name}. "
-                    f"Убедитесь, что бот не заблокирован и вы начали с ним диалог."
-                )
+        # Register all players in bulk
+        player_ids = create_game_players(session, game.id, telegram_users, roles, user_ids)
         
         # Create first round
         game_round = GameRound(
@@ -222,31 +262,98 @@ def startgame_command(update: Update, context: CallbackContext) -> None:
         
         # Update game state
         game.state = GAME_STATES['PREPARATION']
+        session.flush()
+        
+        # Claim the chat before committing; a /startgame that got there first on another node wins
+        if not state_backend.claim_chat(chat_id, game.id):
+            session.rollback()
+            outbound.send_message(
+                context.bot,
+                chat_id=chat_id,
+                text="В этом чате уже идет игра! Дождитесь ее завершения."
+            )
+            return
+        claimed = game.id
+        
+        live_game = LiveGame(
+            game_id=game.id,
+            chat_id=chat_id,
+            state=game.state,
+            current_round=1,
+            round_id=game_round.id,
+            round_number=1,
+            round_state=game_round.state,
+            players=[
+                LivePlayer(player_id, user_id, telegram_user.id, telegram_user.first_name, role)
+                for (player_id, user_id), telegram_user, role in zip(player_ids, telegram_users, roles)
+            ]
+        )
         session.commit()
+        store.put_game(live_game)
+        
+        # The registration is consumed by the game
+        try:
+            users_session.query(Registration).filter(Registration.chat_id == chat_id).delete(synchronize_session=False)
+            users_session.commit()
+        except Exception as e:
+            logger.error(f"Error clearing registration of chat {chat_id}: {e}")
+            users_session.rollback()
+        
+        # Send roles; DMs are delivered concurrently, failures are reported in one group message
+        outbound.send_message(
+            context.bot,
+            chat_id=chat_id,
+            text="🎮 Игра начинается! Каждый игрок получит свою роль в личном сообщении."
+        )
+        
+        role_messages = FanOut(context.bot)
+        for telegram_user, role in zip(telegram_users, roles):
+            role_messages.send_message(
+                telegram_user.id,
+                telegram_user.first_name,
+                text=f"🔒 Ваша роль в игре Spy Sketch: *{role}*\n\n{get_role_description(role)}",
+                parse_mode='Markdown'
+            )
+        role_messages.on_complete(report_undelivered(context.bot, chat_id, "роли"))
         
         # Clear active registrations for this chat
-        active_registrations[chat_id] = []
+        state_backend.clear_registrations(chat_id)
         
         # Move to preparation stage
-        update.message.reply_text(
-            "🔍 Фаза подготовки началась!\n\n"
-            "Все игроки получили свои роли. У вас есть время, чтобы ознакомиться с ними.\n"
-            "Скоро начнется творческий этап игры!"
+        outbound.send_message(
+            context.bot,
+            chat_id=chat_id,
+            text=(
+                "🔍 Фаза подготовки началась!\n\n"
+                "Все игроки получили свои роли. У вас есть время, чтобы ознакомиться с ними.\n"
+                "Скоро начнется творческий этап игры!"
+            )
         )
         
         # Schedule transition to creative phase
-        context.job_queue.run_once(
+        phase_scheduler.run_once(
+            context.bot,
             transition_to_creative_phase,
-            60,  # Preparation time in seconds
-            context={"chat_id": chat_id, "game_id": game.id, "round_id": game_round.id}
+            DEFAULT_PREPARATION_TIME,
+            context={"chat_id": chat_id, "game_id": live_game.game_id, "round_id": live_game.round_id},
+            game_id=live_game.game_id
         )
         
     except Exception as e:
         logger.error(f"Error starting game: {e}")
-        update.message.reply_text("Произошла ошибка при запуске игры. Пожалуйста, попробуйте еще раз.")
+        outbound.send_message(
+            context.bot,
+            chat_id=chat_id,
+            text="Произошла ошибка при запуске игры. Пожалуйста, попробуйте еще раз."
+        )
         session.rollback()
+        users_session.rollback()
+        if claimed is not None and store.game(claimed) is None:
+            # The game was never started
+            state_backend.release_chat(chat_id, claimed)
     finally:
         session.close()
+        users_session.close()
 
 def get_role_description(role: str) -> str:
     """
@@ -288,16 +395,7 @@ def transition_to_creative_phase(context: CallbackContext) -> None:
     game_id = job_data["game_id"]
     round_id = job_data["round_id"]
     
-    # This function will be implemented in creative.py handler
-    # It will update the game state and start the creative phase
-    # For now, we'll just announce the transition
-    context.bot.send_message(
-        chat_id=chat_id,
-        text="🎨 Творческий этап начинается!\n\nВсе игроки получат задания в личных сообщениях."
-    )
-    
-    # Here we would call a function from the creative phase handler
-    # For example: start_creative_phase(context, chat_id, game_id, round_id)
+    start_creative_phase(context, chat_id, game_id, round_id)
 
 def welcome_bot(update: Update, context: CallbackContext) -> None:
     """
@@ -307,19 +405,24 @@ def welcome_bot(update: Update, context: CallbackContext) -> None:
     if not update.message or not update.message.new_chat_members:
         return
     
+    chat_id = update.effective_chat.id
     bot_user = context.bot.get_me()
     for member in update.message.new_chat_members:
         if member.id == bot_user.id:
             # Bot was added to a group chat, send welcome message
-            update.message.reply_text(
-                "👋 Привет всем! Я бот для игры Spy Sketch!\n\n"
-                "Это групповая игра-дедукция с творческими заданиями.\n\n"
-                "Используйте следующие команды:\n"
-                "/start - Начать работу с ботом\n"
-                "/join - Присоединиться к регистрации\n"
-                "/startgame - Начать игру после регистрации\n"
-                "/rules - Показать правила игры\n"
-                "/help - Показать все доступные команды"
+            outbound.send_message(
+                context.bot,
+                chat_id=chat_id,
+                text=(
+                    "👋 Привет всем! Я бот для игры Spy Sketch!\n\n"
+                    "Это групповая игра-дедукция с творческими заданиями.\n\n"
+                    "Используйте следующие команды:\n"
+                    "/start - Начать работу с ботом\n"
+                    "/join - Присоединиться к регистрации\n"
+                    "/startgame - Начать игру после регистрации\n"
+                    "/rules - Показать правила игры\n"
+                    "/help - Показать все доступные команды"
+                )
             )
             break
 
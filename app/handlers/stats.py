@@ -2,9 +2,13 @@ from telegram import Update
 from telegram.ext import CallbackContext, CommandHandler
 import logging
 import datetime
-from sqlalchemy import desc, func
 
-from app.models.database import get_session, User, GamePlayer, Game
+from app.models.database import get_session, User, UserRoleStats
+from app.models.state_store import store
+from app.models.state_backend import state_backend
+from app.models.vote_ledger import vote_ledger
+from app.models.leaderboard import leaderboard, MIN_GAMES
+from app.utils.phase_scheduler import phase_scheduler
 from app.config.config import GAME_STATES
 
 logger = logging.getLogger(__name__)
@@ -17,31 +21,34 @@ def stats_command(update: Update, context: CallbackContext) -> None:
     
     session = get_session()
     try:
-        # Get user
-        user = session.query(User).filter(User.user_id == user_id).first()
+        # Get user and per-role counters in one query
+        rows = session.query(User, UserRoleStats) \
+            .outerjoin(UserRoleStats, UserRoleStats.user_id == User.id) \
+            .filter(User.user_id == user_id) \
+            .order_by(UserRoleStats.games.desc()) \
+            .all()
         
-        if not user:
+        if not rows:
             update.message.reply_text(
                 "У вас пока нет статистики. Сыграйте свою первую игру!"
             )
             return
         
+        user = rows[0][0]
+        
         # Calculate win rate
         win_rate = 0
         if user.games_played > 0:
             win_rate = (user.wins / user.games_played) * 100
         
-        # Get roles played
-        roles_played = session.query(GamePlayer.role, func.count(GamePlayer.role).label('count')) \
-            .join(User, User.id == GamePlayer.user_id) \
-            .filter(User.user_id == user_id) \
-            .group_by(GamePlayer.role) \
-            .all()
-        
         # Format roles statistics
         roles_stats = ""
-        for role, count in roles_played:
-            roles_stats += f"• {role}: {count} раз\n"
+        for _, role_stats in rows:
+            if role_stats:
+                roles_stats += (
+                    f"• {role_stats.role}: {role_stats.games} раз "
+                    f"(побед: {role_stats.wins}, устранений: {role_stats.eliminations})\n"
+                )
         
         if not roles_stats:
             roles_stats = "Нет данных"
@@ -65,18 +72,9 @@ def leaderboard_command(update: Update, context: CallbackContext) -> None:
     """
     Display the leaderboard.
     """
-    session = get_session()
     try:
-        # Get top 10 users by win rate (minimum 3 games)
-        top_users = session.query(
-            User,
-            (User.wins * 100 / User.games_played).label('win_rate')
-        ).filter(
-            User.games_played >= 3
-        ).order_by(
-            desc('win_rate'),
-            desc(User.wins)
-        ).limit(10).all()
+        # Top 10 users by win rate, served from memory
+        top_users = leaderboard.top()
         
         if not top_users:
             update.message.reply_text(
@@ -85,12 +83,12 @@ def leaderboard_command(update: Update, context: CallbackContext) -> None:
             return
         
         # Format leaderboard message
-        leaderboard_text = "🏆 Таблица лидеров (мин. 3 игры):\n\n"
+        leaderboard_text = f"🏆 Таблица лидеров (мин. {MIN_GAMES} игры):\n\n"
         
-        for i, (user, win_rate) in enumerate(top_users, 1):
+        for i, user in enumerate(top_users, 1):
             leaderboard_text += (
                 f"{i}. {user.first_name} - "
-                f"{win_rate:.1f}% побед ({user.wins}/{user.games_played} игр)\n"
+                f"{user.win_rate:.1f}% побед ({user.wins}/{user.games_played} игр)\n"
             )
         
         update.message.reply_text(leaderboard_text)
@@ -98,8 +96,6 @@ def leaderboard_command(update: Update, context: CallbackContext) -> None:
     except Exception as e:
         logger.error(f"Error getting leaderboard: {e}")
         update.message.reply_text("Произошла ошибка при получении таблицы лидеров.")
-    finally:
-        session.close()
 
 def endgame_command(update: Update, context: CallbackContext) -> None:
     """
@@ -112,22 +108,20 @@ def endgame_command(update: Update, context: CallbackContext) -> None:
         update.message.reply_text("Эта команда доступна только в групповых чатах!")
         return
     
-    session = get_session()
     try:
         # Check if there's a game in progress
-        game = session.query(Game).filter(
-            Game.chat_id == chat_id,
-            Game.finished_at.is_(None)
-        ).first()
+        game = store.game_for_chat(chat_id)
         
         if not game:
             update.message.reply_text("В этом чате нет активной игры.")
             return
         
-        # End the game
-        game.finished_at = datetime.datetime.utcnow()
-        game.state = GAME_STATES['IDLE']
-        session.commit()
+        # End the game: drop its pending phase transitions and unanswered tasks, keep any votes already cast
+        phase_scheduler.cancel_game(game.game_id)
+        if game.round_id is not None:
+            state_backend.clear_round_tasks(game.round_id)
+            vote_ledger.discard_round(game.round_id)
+        store.finish_game(game.game_id, GAME_STATES['IDLE'], datetime.datetime.utcnow())
         
         update.message.reply_text(
             "Игра была принудительно завершена. Для начала новой игры используйте /join."
@@ -136,8 +130,6 @@ def endgame_command(update: Update, context: CallbackContext) -> None:
     except Exception as e:
         logger.error(f"Error ending game: {e}")
         update.message.reply_text("Произошла ошибка при завершении игры.")
-    finally:
-        session.close()
 
 def register_handlers(dispatcher):
     """Register all handlers for stats."""
@@ -2,17 +2,34 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext, CallbackQueryHandler
 import logging
 import datetime
-from sqlalchemy import and_
-from typing import Dict
+from sqlalchemy import update
 
-from app.models.database import get_session, Game, GamePlayer, GameRound, Vote, User
-from app.config.config import GAME_STATES, DEFAULT_VOTING_TIME
-from app.utils.game_logic import calculate_votes, calculate_scores, check_game_end
+from app.models.database import get_session, Game, GamePlayer, GameRound, Vote, UserRoleStats
+from app.models.state_store import store
+from app.models.vote_ledger import (
+    vote_ledger, Tally, VOTE_CLOSED, VOTE_NOT_A_VOTER, VOTE_BAD_TARGET, VOTE_SELF
+)
+from app.models.repository import add_scores, settle_game_users, get_scoreboard, upsert
+from app.models.leaderboard import leaderboard
+from app.models.phase_timing import phase_timing, VOTING
+from app.config.config import GAME_STATES, DEFAULT_PREPARATION_TIME, ROLES
+from app.handlers.registration import transition_to_creative_phase
+from app.utils.game_logic import calculate_votes, calculate_scores, check_game_end, format_duration
+from app.utils.outbound import outbound
+from app.utils.fanout import FanOut, report_undelivered
+from app.utils.sharding import claim_player
+from app.utils.phase_scheduler import phase_scheduler
+from app.utils.runtime import coroutine_handler, run_blocking
 
 logger = logging.getLogger(__name__)
 
-# Dictionary to store votes for each round
-active_votes = {}  # Format: {round_id: {user_id: target_player_id}}
+# Answers to votes the ledger rejected
+VOTE_REJECTIONS = {
+    VOTE_CLOSED: "Голосование для этого раунда уже завершено или еще не началось.",
+    VOTE_NOT_A_VOTER: "Вы не являетесь активным игроком в этой игре.",
+    VOTE_BAD_TARGET: "Выбранный игрок не найден или не активен.",
+    VOTE_SELF: "Вы не можете голосовать за себя.",
+}
 
 def start_voting_phase(context: CallbackContext, chat_id: int, game_id: int, round_id: int) -> None:
     """
@@ -24,56 +41,49 @@ def start_voting_phase(context: CallbackContext, chat_id: int, game_id: int, rou
         game_id: Game ID
         round_id: Current round ID
     """
-    session = get_session()
+    # Get game and round
+    game = store.game(game_id)
+    if not game or game.round_id != round_id:
+        logger.error(f"Game or round not found: game_id={game_id}, round_id={round_id}")
+        return
+    
+    # Only move on from the discussion phase
+    if game.round_state != GAME_STATES['DISCUSSION']:
+        logger.info(f"Skipping voting phase: game_id={game_id} is in state {game.round_state}")
+        return
+    
     try:
-        # Get game and round
-        game = session.query(Game).filter(Game.id == game_id).first()
-        game_round = session.query(GameRound).filter(GameRound.id == round_id).first()
-        
-        if not game or not game_round:
-            logger.error(f"Game or round not found: game_id={game_id}, round_id={round_id}")
-            return
-        
         # Update game and round state
-        game.state = GAME_STATES['VOTING']
-        game_round.state = GAME_STATES['VOTING']
-        session.commit()
+        store.set_state(game_id, GAME_STATES['VOTING'])
+        voting_time = phase_timing.duration(chat_id, VOTING)
         
         # Send message to group chat
-        context.bot.send_message(
+        outbound.send_message(
+            context.bot,
             chat_id=chat_id,
             text=(
                 "🗳 Голосование началось!\n\n"
-                f"У вас есть {DEFAULT_VOTING_TIME // 60} минут, чтобы проголосовать за игрока, "
+                f"У вас есть {format_duration(voting_time)}, чтобы проголосовать за игрока, "
                 "которого вы считаете шпионом.\n\n"
                 "Каждый игрок получит кнопки для голосования в личном сообщении."
             )
         )
         
         # Get all active players
-        players = session.query(GamePlayer).filter(
-            and_(
-                GamePlayer.game_id == game_id,
-                GamePlayer.is_active == True
-            )
-        ).all()
+        players = game.active_players()
         
         # Create voting keyboard with all players
         keyboard = []
         row = []
         
-        # Initialize active votes for this round
-        active_votes[round_id] = {}
+        # Open the in-memory ballot for this round
+        vote_ledger.open_round(round_id, game_id, players)
         
         for i, player in enumerate(players):
-            user = session.query(User).filter(User.id == player.user_id).first()
-            if not user:
-                continue
-                
             # Add player to keyboard
             button = InlineKeyboardButton(
-                text=user.first_name,
-                callback_data=f"vote_{round_id}_{player.id}"
+                text=player.first_name,
+                callback_data=f"vote_{round_id}_{player.player_id}"
             )
             
             # Create new row every 2 buttons
@@ -89,37 +99,45 @@ def start_voting_phase(context: CallbackContext, chat_id: int, game_id: int, rou
             
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        # Send voting message to each player
-        for player in players:
-            user = session.query(User).filter(User.id == player.user_id).first()
-            if not user:
-                continue
-                
-            try:
-                context.bot.send_message(
-                    chat_id=user.user_id,
-                    text=(
-                        "🗳 Время голосования!\n\n"
-                        "Выберите игрока, которого вы считаете шпионом:"
-                    ),
-                    reply_markup=reply_markup
-                )
-            except Exception as e:
-                logger.error(f"Error sending voting keyboard to user {user.user_id}: {e}")
-        
-        # Schedule end of voting
-        context.job_queue.run_once(
+        # Schedule end of voting before any ballot goes out, so early completion can cancel it
+        phase_scheduler.run_once(
+            context.bot,
             end_voting_phase,
-            DEFAULT_VOTING_TIME,
-            context={"chat_id": chat_id, "game_id": game_id, "round_id": round_id}
+            voting_time,
+            context={"chat_id": chat_id, "game_id": game_id, "round_id": round_id},
+            game_id=game_id
         )
         
+        # Ballots are delivered concurrently, failures are reported in one group message
+        ballot_messages = FanOut(context.bot)
+        
+        for player in players:
+            # Ballot answers come back as private callbacks, routed to this chat's worker
+            claim_player(player.telegram_id, chat_id)
+            ballot_messages.send_message(
+                player.telegram_id,
+                player.first_name,
+                text=(
+                    "🗳 Время голосования!\n\n"
+                    "Выберите игрока, которого вы считаете шпионом:"
+                ),
+                reply_markup=reply_markup
+            )
+        
+        ballot_messages.on_complete(report_undelivered(context.bot, chat_id, "бюллетени"))
+        
     except Exception as e:
         logger.error(f"Error starting voting phase: {e}")
-    finally:
-        session.close()
 
-def handle_vote(update: Update, context: CallbackContext) -> None:
+def transition_to_voting_phase(context: CallbackContext) -> None:
+    """
+    Transition from discussion to voting phase.
+    """
+    job_data = context.job.context
+    start_voting_phase(context, job_data["chat_id"], job_data["game_id"], job_data["round_id"])
+
+@coroutine_handler
+async def handle_vote(update: Update, context: CallbackContext) -> None:
     """
     Handle vote callback from player.
     """
@@ -136,100 +154,28 @@ def handle_vote(update: Update, context: CallbackContext) -> None:
         round_id = int(round_id)
         target_player_id = int(target_player_id)
     except (ValueError, IndexError):
-        query.answer("Неверный формат данных. Попробуйте еще раз.")
-        return
-    
-    # Check if this round is in voting state
-    if round_id not in active_votes:
-        query.answer("Голосование для этого раунда уже завершено или еще не началось.")
+        await run_blocking(query.answer, "Неверный формат данных. Попробуйте еще раз.")
         return
     
-    session = get_session()
     try:
-        # Get user
-        user = session.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            query.answer("Пользователь не найден.")
-            return
-        
-        # Get the game round
-        game_round = session.query(GameRound).filter(GameRound.id == round_id).first()
-        if not game_round:
-            query.answer("Раунд не найден.")
-            return
-        
-        # Check if round is in voting state
-        if game_round.state != GAME_STATES['VOTING']:
-            query.answer("Голосование для этого раунда уже завершено.")
-            return
-        
-        # Get the voter's player record
-        voter = session.query(GamePlayer).filter(
-            and_(
-                GamePlayer.user_id == user.id,
-                GamePlayer.game_id == game_round.game_id,
-                GamePlayer.is_active == True
-            )
-        ).first()
+        # Validate and record the vote in memory; it is persisted in the background
+        status, target_name = await run_blocking(vote_ledger.cast, round_id, user_id, target_player_id)
         
-        if not voter:
-            query.answer("Вы не являетесь активным игроком в этой игре.")
+        if target_name is None:
+            await run_blocking(query.answer, VOTE_REJECTIONS[status])
             return
         
-        # Get the target player
-        target = session.query(GamePlayer).filter(
-            and_(
-                GamePlayer.id == target_player_id,
-                GamePlayer.game_id == game_round.game_id,
-                GamePlayer.is_active == True
-            )
-        ).first()
-        
-        if not target:
-            query.answer("Выбранный игрок не найден или не активен.")
-            return
-        
-        # Check if player is voting for themselves
-        if voter.id == target.id:
-            query.answer("Вы не можете голосовать за себя.")
-            return
-        
-        # Check if player already voted
-        existing_vote = session.query(Vote).filter(
-            and_(
-                Vote.round_id == round_id,
-                Vote.voter_id == voter.id
-            )
-        ).first()
-        
-        if existing_vote:
-            # Update existing vote
-            existing_vote.target_id = target.id
-            existing_vote.voted_at = datetime.datetime.utcnow()
-        else:
-            # Create new vote
-            vote = Vote(
-                round_id=round_id,
-                voter_id=voter.id,
-                target_id=target.id
-            )
-            session.add(vote)
-        
-        # Record vote in memory
-        active_votes[round_id][voter.id] = target.id
-        
-        # Commit changes
-        session.commit()
-        
-        # Get target user name
-        target_user = session.query(User).filter(User.id == target.user_id).first()
-        target_name = target_user.first_name if target_user else "Unknown"
-        
         # Confirm vote
-        query.answer(f"Ваш голос против {target_name} учтен!")
+        await run_blocking(query.answer, f"Ваш голос против {target_name} учтен!")
+        
+        # Every active player has voted: end voting now instead of at the deadline
+        game_id = vote_ledger.completed(round_id)
+        if game_id is not None and phase_scheduler.expedite(game_id, end_voting_phase):
+            logger.info(f"Everyone voted, ending voting early: game_id={game_id}, round_id={round_id}")
         
         # Update message
-        query.edit_message_text(
+        await run_blocking(
+            query.edit_message_text,
             text=f"🗳 Вы проголосовали против игрока: {target_name}\n\n"
                  "Вы можете изменить свой голос до окончания голосования.",
             reply_markup=query.message.reply_markup
@@ -237,9 +183,7 @@ def handle_vote(update: Update, context: CallbackContext) -> None:
         
     except Exception as e:
         logger.error(f"Error processing vote: {e}")
-        query.answer("Произошла ошибка при обработке вашего голоса. Попробуйте еще раз.")
-    finally:
-        session.close()
+        await run_blocking(query.answer, "Произошла ошибка при обработке вашего голоса. Попробуйте еще раз.")
 
 def end_voting_phase(context: CallbackContext) -> None:
     """
@@ -250,37 +194,117 @@ def end_voting_phase(context: CallbackContext) -> None:
     game_id = job_data["game_id"]
     round_id = job_data["round_id"]
     
-    session = get_session()
+    # Get game and round
+    game = store.game(game_id)
+    if not game or game.round_id != round_id:
+        logger.error(f"Game or round not found: game_id={game_id}, round_id={round_id}")
+        vote_ledger.discard_round(round_id)
+        return
+    
+    # Never settle a round twice
+    if game.round_state != GAME_STATES['VOTING']:
+        logger.info(f"Skipping end of voting: game_id={game_id} is in state {game.round_state}")
+        return
+    
+    voting_started_at = game.phase_started_at
+    
+    session = get_session(chat_id)
     try:
-        # Get game and round
-        game = session.query(Game).filter(Game.id == game_id).first()
-        game_round = session.query(GameRound).filter(GameRound.id == round_id).first()
-        
-        if not game or not game_round:
-            logger.error(f"Game or round not found: game_id={game_id}, round_id={round_id}")
+        now = datetime.datetime.utcnow()
+        
+        # Close the ballot; its votes are persisted before the tally is returned
+        tally = vote_ledger.close_round(round_id)
+        
+        if tally is None:
+            # Ballot isn't in memory, count the stored votes instead
+            tally = Tally({}, [])
+            for vote in session.query(Vote).filter(Vote.round_id == round_id).all():
+                tally.counts[vote.target_id] = tally.counts.get(vote.target_id, 0) + 1
+                tally.voted_at.append(vote.voted_at)
+        vote_counts = tally.counts
+        
+        # Claim the round in the database, in the settlement's transaction: state changes are
+        # otherwise written behind, and a replay after a crash must find the round settled
+        claimed = session.execute(
+            update(GameRound)
+            .where(GameRound.id == round_id, GameRound.state != GAME_STATES['RESULTS'])
+            .values(state=GAME_STATES['RESULTS'], finished_at=now)
+        ).rowcount
+        if not claimed:
+            logger.info(f"Skipping end of voting: round_id={round_id} is already settled in the database")
+            session.rollback()
             return
+        session.execute(
+            update(Game).where(Game.id == game_id)
+            .values(state=GAME_STATES['RESULTS'], next_phase=None, phase_deadline=None)
+        )
         
-        # Update game and round state
-        game.state = GAME_STATES['RESULTS']
-        game_round.state = GAME_STATES['RESULTS']
-        game_round.finished_at = datetime.datetime.utcnow()
-        session.commit()
+        # Find the player with the most votes
+        voters = len(game.active_players())
+        eliminated_player_id = calculate_votes(vote_counts)
+        eliminated_player = game.players.get(eliminated_player_id) if eliminated_player_id else None
+        if eliminated_player_id and not eliminated_player:
+            logger.error(f"Eliminated player not found: player_id={eliminated_player_id}")
         
-        # Get all votes for this round
-        votes = session.query(Vote).filter(Vote.round_id == round_id).all()
+        game_over = False
+        if eliminated_player:
+            # Mark player as eliminated
+            session.execute(update(GamePlayer).where(GamePlayer.id == eliminated_player_id).values(is_active=False))
+            
+            # Create role mapping for score calculation
+            player_roles = {
+                player.player_id: player.role for player in game.active_players()
+                if player.player_id != eliminated_player_id
+            }
+            
+            # Calculate scores
+            scores = calculate_scores(eliminated_player.role, player_roles)
+            
+            # Check if game should end
+            game_over, winner_team = check_game_end(player_roles)
+            
+            # Settle the round, and the game if it is over, in one transaction
+            add_scores(session, scores)
         
-        # Count votes for each player
-        vote_counts: Dict[int, int] = {}
-        for vote in votes:
-            if vote.target_id not in vote_counts:
-                vote_counts[vote.target_id] = 0
-            vote_counts[vote.target_id] += 1
+        if game_over:
+            winning_roles = [ROLES['LOYAL'], ROLES['DOUBLE']] if winner_team == "loyal" else [ROLES['SPY']]
+            users = settle_game_users(session, game_id, winning_roles)
+            
+            # Per-role counters
+            role_stats = [
+                {
+                    "user_id": player.user_id,
+                    "role": player.role,
+                    "games": 1,
+                    "wins": 1 if player.role in winning_roles else 0,
+                    "eliminations": 0 if player.is_active and player.player_id != eliminated_player_id else 1
+                }
+                for player in game.players.values()
+            ]
+            upsert(session, UserRoleStats, role_stats, key=['user_id', 'role'],
+                   increment_columns=['games', 'wins', 'eliminations'])
+            
+            # Materialized leaderboard
+            ranked, leaderboard_version = leaderboard.write(session, users)
+            player_scores = get_scoreboard(session, game_id)
+            
+            finished_at = datetime.datetime.utcnow()
+            session.execute(update(Game).where(Game.id == game_id).values(finished_at=finished_at))
         
-        # Find the player with the most votes
-        eliminated_player_id = calculate_votes(vote_counts)
+        session.commit()
         
-        if not eliminated_player_id:
-            context.bot.send_message(
+        # Only a committed settlement changes the live game; vote times size this chat's next voting phases
+        store.set_state(game_id, GAME_STATES['RESULTS'])
+        store.finish_round(game_id, now)
+        store.set_phase(game_id, None, None)
+        if eliminated_player:
+            store.deactivate_player(game_id, eliminated_player_id)
+        phase_timing.record(chat_id, VOTING, voting_started_at, tally.voted_at,
+                            max(0, voters - len(tally.voted_at)), now)
+        
+        if not eliminated_player:
+            outbound.send_message(
+                context.bot,
                 chat_id=chat_id,
                 text="🤔 Странно... Никто не проголосовал. Раунд продолжается без устранения."
             )
@@ -288,80 +312,27 @@ def end_voting_phase(context: CallbackContext) -> None:
             start_new_round(context, chat_id, game_id)
             return
         
-        # Get the eliminated player
-        eliminated_player = session.query(GamePlayer).filter(GamePlayer.id == eliminated_player_id).first()
-        if not eliminated_player:
-            logger.error(f"Eliminated player not found: player_id={eliminated_player_id}")
-            return
-        
-        # Get the eliminated player's user
-        eliminated_user = session.query(User).filter(User.id == eliminated_player.user_id).first()
-        if not eliminated_user:
-            logger.error(f"Eliminated user not found: user_id={eliminated_player.user_id}")
-            return
-        
-        # Mark player as eliminated
-        eliminated_player.is_active = False
-        session.commit()
-        
-        # Get all active players and their roles
-        active_players = session.query(GamePlayer).filter(
-            and_(
-                GamePlayer.game_id == game_id,
-                GamePlayer.is_active == True
-            )
-        ).all()
-        
-        # Create role mapping for score calculation
-        player_roles = {player.id: player.role for player in active_players}
-        
-        # Calculate scores
-        scores = calculate_scores(eliminated_player.role, player_roles)
-        
-        # Update player scores
-        for player_id, score in scores.items():
-            player = session.query(GamePlayer).filter(GamePlayer.id == player_id).first()
-            if player:
-                player.score += score
-        
-        session.commit()
-        
         # Announce elimination
-        context.bot.send_message(
+        outbound.send_message(
+            context.bot,
             chat_id=chat_id,
             text=(
-                f"🚨 Агент {eliminated_user.first_name} был устранен!\n\n"
+                f"🚨 Агент {eliminated_player.first_name} был устранен!\n\n"
                 f"Роль: *{eliminated_player.role}*\n"
                 f"Количество голосов: {vote_counts.get(eliminated_player_id, 0)}"
             ),
             parse_mode='Markdown'
         )
         
-        # Check if game should end
-        game_over, winner_team = check_game_end(player_roles)
-        
         if game_over:
             # End the game
-            game.finished_at = datetime.datetime.utcnow()
-            session.commit()
-            
-            # Get all players for final scoring
-            all_players = session.query(GamePlayer).filter(GamePlayer.game_id == game_id).all()
-            
-            # Update user stats
-            for player in all_players:
-                user = session.query(User).filter(User.id == player.user_id).first()
-                if user:
-                    user.games_played += 1
-                    if (winner_team == "loyal" and player.role in ["Лояльный агент", "Двойной агент"]) or \
-                       (winner_team == "spy" and player.role == "Шпион"):
-                        user.wins += 1
-            
-            session.commit()
+            store.finish_game(game_id, GAME_STATES['RESULTS'], finished_at)
+            leaderboard.update(ranked, leaderboard_version)
             
             # Announce winner
             if winner_team == "loyal":
-                context.bot.send_message(
+                outbound.send_message(
+                    context.bot,
                     chat_id=chat_id,
                     text=(
                         "🎉 Игра окончена! Победа Лояльных Агентов!\n\n"
@@ -369,7 +340,8 @@ def end_voting_phase(context: CallbackContext) -> None:
                     )
                 )
             else:  # spy
-                context.bot.send_message(
+                outbound.send_message(
+                    context.bot,
                     chat_id=chat_id,
                     text=(
                         "🎭 Игра окончена! Победа Шпионов!\n\n"
@@ -377,29 +349,21 @@ def end_voting_phase(context: CallbackContext) -> None:
                     )
                 )
             
-            # Show final scores
-            player_scores = []
-            for player in all_players:
-                user = session.query(User).filter(User.id == player.user_id).first()
-                if user:
-                    player_scores.append((user.first_name, player.score, player.role))
-            
-            # Sort by score (highest first)
-            player_scores.sort(key=lambda x: x[1], reverse=True)
-            
-            # Format scores message
+            # Show final scores (highest first)
             scores_message = "📊 Финальные результаты:\n\n"
             for name, score, role in player_scores:
                 scores_message += f"{name}: {score} очков - *{role}*\n"
             
-            context.bot.send_message(
+            outbound.send_message(
+                context.bot,
                 chat_id=chat_id,
                 text=scores_message,
                 parse_mode='Markdown'
             )
             
             # Invite to play again
-            context.bot.send_message(
+            outbound.send_message(
+                context.bot,
                 chat_id=chat_id,
                 text=(
                     "Спасибо за игру! Для начала новой игры, "
@@ -413,11 +377,8 @@ def end_voting_phase(context: CallbackContext) -> None:
         
     except Exception as e:
         logger.error(f"Error ending voting phase: {e}")
+        session.rollback()
     finally:
-        # Clear active votes for this round
-        if round_id in active_votes:
-            del active_votes[round_id]
-        
         session.close()
 
 def start_new_round(context: CallbackContext, chat_id: int, game_id: int) -> None:
@@ -429,23 +390,23 @@ def start_new_round(context: CallbackContext, chat_id: int, game_id: int) -> Non
         chat_id: Chat ID of the game
         game_id: Game ID
     """
-    session = get_session()
+    # Get game
+    game = store.game(game_id)
+    if not game:
+        logger.error(f"Game not found: game_id={game_id}")
+        return
+    
+    session = get_session(chat_id)
     try:
-        # Get game
-        game = session.query(Game).filter(Game.id == game_id).first()
-        if not game:
-            logger.error(f"Game not found: game_id={game_id}")
-            return
-        
         # Increment round
-        game.current_round += 1
-        session.commit()
+        round_number = game.current_round + 1
         
         # Announce new round
-        context.bot.send_message(
+        outbound.send_message(
+            context.bot,
             chat_id=chat_id,
             text=(
-                f"🔄 Начинается раунд {game.current_round}!\n\n"
+                f"🔄 Начинается раунд {round_number}!\n\n"
                 "Подготовьтесь к новому испытанию. "
                 "Творческий этап начнется через минуту."
             )
@@ -453,35 +414,41 @@ def start_new_round(context: CallbackContext, chat_id: int, game_id: int) -> Non
         
         # Create new round
         game_round = GameRound(
-            game_id=game.id,
-            round_number=game.current_round,
+            game_id=game_id,
+            round_number=round_number,
             state=GAME_STATES['PREPARATION']
         )
         session.add(game_round)
+        session.commit()
         
         # Update game state
-        game.state = GAME_STATES['PREPARATION']
-        session.commit()
+        store.start_round(game_id, game_round.id, round_number, GAME_STATES['PREPARATION'])
         
         # Schedule transition to creative phase
-        context.job_queue.run_once(
-            lambda c: c.bot.send_message(
-                chat_id=chat_id,
-                text="🎨 Творческий этап начинается! Все игроки получат новые задания."
-            ),
-            60,  # Preparation time in seconds
-            context=None
+        phase_scheduler.run_once(
+            context.bot,
+            transition_to_creative_phase,
+            DEFAULT_PREPARATION_TIME,
+            context={"chat_id": chat_id, "game_id": game_id, "round_id": game_round.id},
+            game_id=game_id
         )
         
-        # This would call the creative phase handler in a real implementation
-        # For now, just a placeholder
-        # start_creative_phase(context, chat_id, game_id, game_round.id)
-        
     except Exception as e:
         logger.error(f"Error starting new round: {e}")
     finally:
         session.close()
 
+def transition_to_next_round(context: CallbackContext) -> None:
+    """
+    Start the next round of a game whose last round is settled (resumed after a restart).
+    """
+    job_data = context.job.context
+    game = store.game(job_data["game_id"])
+    if not game or game.round_id != job_data["round_id"] or game.round_state != GAME_STATES['RESULTS']:
+        logger.info(f"Skipping next round: game_id={job_data['game_id']} has moved on")
+        return
+    start_new_round(context, job_data["chat_id"], job_data["game_id"])
+
 def register_handlers(dispatcher):
     """Register all handlers for the voting phase."""
     dispatcher.add_handler(CallbackQueryHandler(handle_vote, pattern="^vote_")) 
\ No newline at end of file
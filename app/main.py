@@ -1,13 +1,35 @@
 import os
+import signal
+import threading
 import logging
+import time
+from multiprocessing.connection import Connection
+from typing import Optional
+from telegram import Bot, Update, TelegramError
 from telegram.ext import Updater
 
-from app.config.config import TOKEN
+from app.config.config import TOKEN, UPDATE_MODE, TELEGRAM_API_URL, TELEGRAM_FILE_URL, METRICS_LOG_INTERVAL
+from app.config.config import RUNTIME_MODE, DISPATCHER_WORKERS, LANES, LANE_BATCH
+from app.config.config import CALLBACK_WORKERS, COMMAND_WORKERS, SUBMISSION_WORKERS, PHASE_WORKERS
+from app.config.config import SHARDS, POLL_TIMEOUT, OUTBOUND_GLOBAL_RATE, PHOTO_CACHE_DIR, PHOTO_CACHE_MAX_BYTES
+from app.config.config import WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET
 from app.models.database import init_db
+from app.models.state_store import store
 from app.handlers.registration import register_handlers as register_registration_handlers
 from app.handlers.creative import register_handlers as register_creative_handlers
 from app.handlers.voting import register_handlers as register_voting_handlers
 from app.handlers.stats import register_handlers as register_stats_handlers
+from app.handlers.recovery import recover
+from app.utils import metrics
+from app.utils.lanes import LaneExecutor, LaneDispatcher, LaneGroup, CALLBACKS, COMMANDS, SUBMISSIONS, JOBS
+from app.utils.metrics import log_metrics
+from app.utils.outbound import outbound
+from app.utils.phase_scheduler import phase_scheduler
+from app.utils.photo_cache import photo_cache
+from app.utils.reveal import collage_renderer
+from app.utils.runtime import AsyncDispatcher, runtime
+from app.utils.sharding import ShardRouter, ShardLink, join_shard
+from app.utils.webhook import WebhookServer
 
 # Setup logging
 logging.basicConfig(
@@ -16,31 +38,255 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def main():
-    """Main function to start the bot."""
+def update_lane(update: Update) -> Optional[int]:
+    """
+    Lane an update runs on: its chat, except that a private message from a
+    player of a live game runs on the lane of the game's group chat.
+    
+    Args:
+        update: Incoming update
+        
+    Returns:
+        Chat ID of the lane, or None to run the update directly
+    """
+    chat = update.effective_chat
+    if chat is None:
+        return None
+    
+    if chat.type == 'private' and update.effective_user:
+        # A local lookup: routing must not cost a state backend round trip per update
+        game = store.game_for_user(update.effective_user.id)
+        if game:
+            return game.chat_id
+    
+    return chat.id
+
+def run_webhook(updater: Updater, server: WebhookServer) -> None:
+    """
+    Serve updates through the built-in webhook listener until SIGINT/SIGTERM.
+    
+    Args:
+        updater: Updater whose dispatcher and job queue process the updates
+        server: Listener feeding the dispatcher's update queue
+    """
+    dispatcher = updater.dispatcher
+    
+    # Start processing before Telegram starts delivering
+    threading.Thread(target=dispatcher.start, name='dispatcher', daemon=True).start()
+    updater.job_queue.start()
+    server.start()
+    
+    if WEBHOOK_URL:
+        updater.bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+    
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop_event.set())
+    stop_event.wait()
+    
+    server.stop()
+    updater.stop()
+
+def run_shard_worker(updater: Updater, link: ShardLink) -> None:
+    """
+    Process the updates the front routes to this shard until it stops the worker.
+    
+    Args:
+        updater: Updater whose dispatcher and job queue process the updates
+        link: Pipe to the front process
+    """
+    dispatcher = updater.dispatcher
+    threading.Thread(target=dispatcher.start, name='dispatcher', daemon=True).start()
+    updater.job_queue.start()
+    
+    link.receive(updater.bot, dispatcher.update_queue)
+    
+    updater.stop()
+
+def run_shard(shard: int, shards: int, connection: Connection) -> None:
+    """
+    Entry point of a shard worker process started by `run_front`.
+    
+    Args:
+        shard: Index of this worker
+        shards: Number of workers
+        connection: Worker end of the pipe to the front
+    """
+    # The front handles the signals and stops its workers through their pipes
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    main(ShardLink(shard, shards, connection))
+
+def run_front() -> None:
+    """
+    Ingest updates in this process (polling or webhook) and route each one to
+    the worker process owning its chat, until SIGINT/SIGTERM.
+    """
+    # Migrate once, before the workers open the database
+    init_db()
+    
+    router = ShardRouter(SHARDS, run_shard, environ=lambda shard: {
+        # The bot-wide Bot API limit is shared by all workers
+        'OUTBOUND_GLOBAL_RATE': str(OUTBOUND_GLOBAL_RATE / SHARDS),
+        # Each worker indexes its own photo cache, in a directory of its own and a share of the budget
+        'PHOTO_CACHE_DIR': os.path.join(PHOTO_CACHE_DIR, f'shard{shard}'),
+        'PHOTO_CACHE_MAX_BYTES': str(PHOTO_CACHE_MAX_BYTES // SHARDS)
+    })
+    router.start()
+    logger.info(f"Started {SHARDS} shard workers")
+    
+    bot = Bot(TOKEN, base_url=TELEGRAM_API_URL, base_file_url=TELEGRAM_FILE_URL)
+    
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop_event.set())
+    
+    if UPDATE_MODE == 'webhook':
+        # The router stands in for the dispatcher's update queue
+        server = WebhookServer(
+            bot=bot,
+            update_queue=router,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret=WEBHOOK_SECRET
+        )
+        server.start()
+        if WEBHOOK_URL:
+            bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+        stop_event.wait()
+        server.stop()
+    else:
+        bot.delete_webhook()
+        offset = None
+        while not stop_event.is_set():
+            try:
+                updates = bot.get_updates(offset=offset, timeout=POLL_TIMEOUT)
+            except TelegramError as e:
+                logger.error(f"Error polling updates: {e}")
+                stop_event.wait(1)
+                continue
+            for update in updates:
+                router.put(update)
+                offset = update.update_id + 1
+    
+    router.stop()
+    logger.info("Bot stopped")
+
+def main(link: Optional[ShardLink] = None):
+    """
+    Main function to start the bot.
+    
+    Args:
+        link: Pipe to the front when running as a shard worker; without one the
+            bot runs in this process, or as the front if SHARDS > 1
+    """
+    if link is None and SHARDS > 1:
+        run_front()
+        return
+    
+    started_at = time.monotonic()
+    owns = None
+    if link:
+        join_shard(link)
+        owns = link.owns
+        logger.info(f"Shard worker {link.shard + 1}/{link.shards}")
     
     # Initialize database
     logger.info("Initializing database...")
     init_db()
     
+    # Load unfinished games into the in-memory state store
+    logger.info(f"Loaded {store.load(owns)} unfinished games")
+    store.start()
+    
     # Create updater and pass it bot token
     logger.info("Starting bot...")
-    updater = Updater(TOKEN)
+    updater = Updater(
+        TOKEN,
+        base_url=TELEGRAM_API_URL,
+        base_file_url=TELEGRAM_FILE_URL,
+        workers=DISPATCHER_WORKERS
+    )
     
     # Get the dispatcher to register handlers
     dispatcher = updater.dispatcher
     
+    # Updates and phase timers of a chat run in order on its lane, chats in parallel,
+    # with separately sized pools so vote callbacks never queue behind phase fan-outs.
+    # The pools share one lane per chat: a command never overtakes a phase transition
+    pools = {}
+    if LANES:
+        lanes = LaneGroup()
+        pools = {
+            CALLBACKS: LaneExecutor(CALLBACKS, workers=CALLBACK_WORKERS, batch=LANE_BATCH, group=lanes),
+            COMMANDS: LaneExecutor(COMMANDS, workers=COMMAND_WORKERS, batch=LANE_BATCH, group=lanes),
+            SUBMISSIONS: LaneExecutor(SUBMISSIONS, workers=SUBMISSION_WORKERS, batch=LANE_BATCH, group=lanes),
+            JOBS: LaneExecutor(JOBS, workers=PHASE_WORKERS, batch=LANE_BATCH, group=lanes)
+        }
+        dispatcher = LaneDispatcher(dispatcher, pools, update_lane)
+        phase_scheduler.run_in_lanes(pools[JOBS])
+    
+    # Webhook updates are timed from ingestion until their handler returns on its lane
+    webhook = None
+    if not link and UPDATE_MODE == 'webhook':
+        webhook = WebhookServer(
+            bot=updater.bot,
+            update_queue=updater.dispatcher.update_queue,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret=WEBHOOK_SECRET
+        )
+        dispatcher = webhook.attach(dispatcher)
+    
+    # In asyncio mode handlers run as coroutines on one event loop: a handler waiting on
+    # the database keeps its chat's lane but no thread
+    if RUNTIME_MODE == 'asyncio':
+        runtime.start()
+        dispatcher = AsyncDispatcher(dispatcher, runtime)
+    
     # Register all handlers
     register_registration_handlers(dispatcher)
     register_creative_handlers(dispatcher)
     register_voting_handlers(dispatcher)
     register_stats_handlers(dispatcher)
     
+    # Resume registrations, tasks, ballots and phase timers of unfinished games
+    restored = recover(updater.bot, owns)
+    time_to_ready = time.monotonic() - started_at
+    metrics.gauge('startup.time_to_ready', lambda: time_to_ready)
+    logger.info(
+        f"Ready in {time_to_ready:.2f}s: resumed {restored['timers']} phase timers "
+        f"({restored['overdue']} overdue), {restored['ballots']} ballots, "
+        f"{restored['pending_submissions']} pending tasks, {restored['registrations']} registrations"
+    )
+    
+    # Periodically log latency and queue metrics
+    if METRICS_LOG_INTERVAL > 0:
+        updater.job_queue.run_repeating(log_metrics, METRICS_LOG_INTERVAL)
+    
     # Start the Bot
-    updater.start_polling()
+    if link:
+        run_shard_worker(updater, link)
+    elif webhook:
+        run_webhook(updater, webhook)
+    else:
+        updater.start_polling()
+        
+        # Run the bot until you press Ctrl-C or the process is stopped
+        updater.idle()
+    
+    phase_scheduler.stop()
+    for pool in pools.values():
+        pool.stop()
+    runtime.stop()
+    collage_renderer.stop()
+    photo_cache.stop()
     
-    # Run the bot until you press Ctrl-C or the process is stopped
-    updater.idle()
+    # Deliver whatever is still queued and persist pending state before exiting
+    outbound.stop()
+    store.stop()
     
     logger.info("Bot stopped")
 
@@ -1,13 +1,133 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Boolean, DateTime, Text
+from sqlalchemy import create_engine, event, text, Column, Integer, String, ForeignKey, Boolean, DateTime, Text, Float, Index, MetaData
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from typing import List, Optional
 import datetime
+import os
 
-from app.config.config import DATABASE_URL
+from app.config.config import (
+    DATABASE_URL, DB_PROFILE, DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_BUSY_TIMEOUT, DB_CACHE_SIZE, DB_MMAP_SIZE, DB_SHARDS
+)
+from app.models.migrations import migrate, stamp
+from app.utils.sharding import shard_of
+
+# Tables of a game, spread over the shard files by chat when storage is sharded
+GAME_TABLES = ('games', 'game_players', 'game_rounds', 'votes', 'creative_submissions')
+# Row IDs of shard N start above N * SHARD_ID_SPAN, so the ID of a game row tells its shard
+SHARD_ID_SPAN = 10 ** 12
+
+def create_db_engine(url: str, profile: str = DB_PROFILE) -> Engine:
+    """
+    Create the engine for a storage profile.
+    
+    The 'production' profile keeps a pool sized to the threads that use the
+    database and, on SQLite, switches to WAL (readers no longer block the
+    writer) with synchronous=NORMAL, a larger page cache, memory-mapped reads
+    and a busy timeout instead of failing fast on a locked database.
+    'default' uses the driver defaults.
+    
+    Args:
+        url: Database URL
+        profile: 'production' or 'default'
+        
+    Returns:
+        Configured engine
+    """
+    if profile != 'production':
+        return create_engine(url)
+    
+    in_memory = url.startswith('sqlite') and (':memory:' in url or url.rstrip('/') == 'sqlite:')
+    if in_memory:
+        # A private in-memory database per connection can't be pooled or put in WAL mode
+        return create_engine(url)
+    
+    engine = create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=not url.startswith('sqlite')
+    )
+    
+    if engine.dialect.name == 'sqlite':
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+            cursor.execute(f"PRAGMA cache_size={DB_CACHE_SIZE}")
+            cursor.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.close()
+    
+    return engine
+
+def shard_url(url: str, shard: int) -> str:
+    """URL of a shard file next to the global database (spy_sketch.db -> spy_sketch.shard1.db)."""
+    root, extension = os.path.splitext(url)
+    return f"{root}.shard{shard}{extension or '.db'}"
+
+def create_shard_engine(url: str, global_path: str) -> Engine:
+    """
+    Create the engine of a shard file.
+    
+    The global database is attached to every connection. SQLite resolves a
+    table name missing from the shard (users, stats, registrations) in the
+    attached file, so queries joining game tables with users work unchanged.
+    A transaction writing both files commits each file atomically, but not
+    both together.
+    
+    Args:
+        url: Shard database URL
+        global_path: File of the global database
+        
+    Returns:
+        Configured engine
+    """
+    shard_engine = create_db_engine(url)
+    
+    @event.listens_for(shard_engine, 'connect')
+    def attach_global(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("ATTACH DATABASE ? AS global_db", (global_path,))
+        cursor.close()
+    
+    return shard_engine
+
+def create_migration_engine(url: str, shard_urls: List[str]) -> Engine:
+    """
+    Create an engine of the global database for migrations, with every shard
+    file attached as shard<N>, so backfills reading game tables see all games.
+    
+    Args:
+        url: Global database URL
+        shard_urls: Shard database URLs, in shard order
+        
+    Returns:
+        Engine; the caller disposes of it
+    """
+    migration_engine = create_engine(url)
+    
+    @event.listens_for(migration_engine, 'connect')
+    def attach_shards(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for shard, url_of_shard in enumerate(shard_urls):
+            cursor.execute(f"ATTACH DATABASE ? AS shard{shard}", (make_url(url_of_shard).database,))
+        cursor.close()
+    
+    return migration_engine
+
+_global_path = make_url(DATABASE_URL).database
+if DB_SHARDS and (not DATABASE_URL.startswith('sqlite') or not _global_path or _global_path == ':memory:'):
+    raise ValueError("DB_SHARDS needs DATABASE_URL to point to a SQLite file")
 
 Base = declarative_base()
-engine = create_engine(DATABASE_URL)
+engine = create_db_engine(DATABASE_URL)
 Session = sessionmaker(bind=engine)
+shard_engines = [create_shard_engine(shard_url(DATABASE_URL, shard), _global_path) for shard in range(DB_SHARDS)]
+shard_sessions = [sessionmaker(bind=shard_engine) for shard_engine in shard_engines]
 
 class User(Base):
     __tablename__ = 'users'
@@ -28,6 +148,10 @@ class User(Base):
     
 class Game(Base):
     __tablename__ = 'games'
+    __table_args__ = (
+        # Live game of a chat (finished_at IS NULL)
+        Index('ix_games_chat_id_finished_at', 'chat_id', 'finished_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     chat_id = Column(Integer)
@@ -36,6 +160,8 @@ class Game(Base):
     max_rounds = Column(Integer, default=3)
     started_at = Column(DateTime, default=datetime.datetime.utcnow)
     finished_at = Column(DateTime, nullable=True)
+    next_phase = Column(String, nullable=True)  # Name of the pending phase transition
+    phase_deadline = Column(DateTime, nullable=True)  # When it is due (UTC)
     
     players = relationship("GamePlayer", back_populates="game")
     rounds = relationship("GameRound", back_populates="game")
@@ -45,6 +171,10 @@ class Game(Base):
 
 class GamePlayer(Base):
     __tablename__ = 'game_players'
+    __table_args__ = (
+        Index('ix_game_players_game_id_is_active', 'game_id', 'is_active'),
+        Index('ix_game_players_user_id', 'user_id'),
+    )
     
     id = Column(Integer, primary_key=True)
     game_id = Column(Integer, ForeignKey('games.id'))
@@ -64,6 +194,9 @@ class GamePlayer(Base):
 
 class GameRound(Base):
     __tablename__ = 'game_rounds'
+    __table_args__ = (
+        Index('ix_game_rounds_game_id', 'game_id'),
+    )
     
     id = Column(Integer, primary_key=True)
     game_id = Column(Integer, ForeignKey('games.id'))
@@ -71,6 +204,8 @@ class GameRound(Base):
     state = Column(Integer)
     started_at = Column(DateTime, default=datetime.datetime.utcnow)
     finished_at = Column(DateTime, nullable=True)
+    creative_started_at = Column(DateTime, nullable=True)  # Start of the creative phase
+    voting_started_at = Column(DateTime, nullable=True)  # Start of the voting phase
     
     game = relationship("Game", back_populates="rounds")
     submissions = relationship("CreativeSubmission", back_populates="round")
@@ -81,6 +216,9 @@ class GameRound(Base):
 
 class CreativeSubmission(Base):
     __tablename__ = 'creative_submissions'
+    __table_args__ = (
+        Index('ix_creative_submissions_round_id', 'round_id'),
+    )
     
     id = Column(Integer, primary_key=True)
     round_id = Column(Integer, ForeignKey('game_rounds.id'))
@@ -88,6 +226,7 @@ class CreativeSubmission(Base):
     task = Column(Text)
     submission_type = Column(String)  # DRAWING or TEXT
     content = Column(Text)  # File ID for images, or text content
+    file_unique_id = Column(String)  # Content key of a submitted photo in the photo cache
     submitted_at = Column(DateTime, default=datetime.datetime.utcnow)
     
     round = relationship("GameRound", back_populates="submissions")
@@ -98,6 +237,10 @@ class CreativeSubmission(Base):
 
 class Vote(Base):
     __tablename__ = 'votes'
+    __table_args__ = (
+        # One vote per player per round; changing a vote updates the row
+        Index('ux_votes_round_id_voter_id', 'round_id', 'voter_id', unique=True),
+    )
     
     id = Column(Integer, primary_key=True)
     round_id = Column(Integer, ForeignKey('game_rounds.id'))
@@ -112,10 +255,134 @@ class Vote(Base):
     def __repr__(self):
         return f"<Vote(id={self.id}, voter_id={self.voter_id}, target_id={self.target_id})>"
 
+class Registration(Base):
+    __tablename__ = 'registrations'
+    __table_args__ = (
+        Index('ux_registrations_chat_id_user_id', 'chat_id', 'user_id', unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(Integer)
+    user_id = Column(Integer)  # Telegram user ID
+    username = Column(String, nullable=True)
+    first_name = Column(String)
+    last_name = Column(String, nullable=True)
+    joined_at = Column(DateTime, default=datetime.datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<Registration(chat_id={self.chat_id}, user_id={self.user_id})>"
+
+class UserRoleStats(Base):
+    """Per-user, per-role totals of settled games, updated with the game's settlement."""
+    __tablename__ = 'user_role_stats'
+    
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    role = Column(String, primary_key=True)
+    games = Column(Integer, default=0)
+    wins = Column(Integer, default=0)
+    eliminations = Column(Integer, default=0)
+    
+    def __repr__(self):
+        return f"<UserRoleStats(user_id={self.user_id}, role={self.role}, games={self.games})>"
+
+class LeaderboardEntry(Base):
+    """Materialized leaderboard: users with enough games, kept up to date at game end."""
+    __tablename__ = 'leaderboard'
+    __table_args__ = (
+        Index('ix_leaderboard_win_rate_wins', 'win_rate', 'wins'),
+    )
+    
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    first_name = Column(String)
+    games_played = Column(Integer)
+    wins = Column(Integer)
+    win_rate = Column(Float)  # Percent
+    
+    def __repr__(self):
+        return f"<LeaderboardEntry(user_id={self.user_id}, win_rate={self.win_rate})>"
+
+class LeaderboardVersion(Base):
+    """Single-row counter bumped with every leaderboard change, so other processes notice it."""
+    __tablename__ = 'leaderboard_version'
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0)
+    
+    def __repr__(self):
+        return f"<LeaderboardVersion(version={self.version})>"
+
 def init_db():
-    """Initialize the database by creating all tables."""
+    """Initialize the database by creating all tables and applying pending migrations."""
     Base.metadata.create_all(engine)
+    for shard in range(DB_SHARDS):
+        init_shard(shard)
+    if not DB_SHARDS:
+        migrate(engine)
+        return
+    
+    migration_engine = create_migration_engine(DATABASE_URL, [shard_url(DATABASE_URL, shard) for shard in range(DB_SHARDS)])
+    try:
+        migrate(migration_engine)
+    finally:
+        migration_engine.dispose()
 
-def get_session():
-    """Get a new database session."""
-    return Session() 
\ No newline at end of file
+def init_shard(shard: int) -> None:
+    """
+    Create a shard file's game tables and seed their ID sequences.
+    
+    The tables are created with AUTOINCREMENT, whose sequences start at
+    shard * SHARD_ID_SPAN, so game rows keep IDs that are unique across shards.
+    The global database isn't attached here, so its tables don't hide missing
+    ones in the shard.
+    """
+    metadata = MetaData()
+    for table in Base.metadata.sorted_tables:
+        copy = table.to_metadata(metadata)
+        if table.name in GAME_TABLES:
+            copy.dialect_options['sqlite']['autoincrement'] = True
+    
+    shard_engine = create_engine(shard_url(DATABASE_URL, shard))
+    try:
+        metadata.create_all(shard_engine, tables=[metadata.tables[name] for name in GAME_TABLES])
+        if shard:
+            with shard_engine.begin() as connection:
+                for name in GAME_TABLES:
+                    connection.execute(text(
+                        "INSERT INTO sqlite_sequence (name, seq) SELECT :name, :seq "
+                        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"
+                    ), {"name": name, "seq": shard * SHARD_ID_SPAN})
+        stamp(shard_engine)
+        migrate(shard_engine)
+    finally:
+        shard_engine.dispose()
+
+def storage_shards() -> List[Optional[int]]:
+    """Shards to visit for work spanning every chat: [None] (the single file) unless sharded."""
+    return list(range(DB_SHARDS)) or [None]
+
+def chat_shard(chat_id: int) -> Optional[int]:
+    """Shard holding a chat's games (None unless sharded)."""
+    return shard_of(chat_id, DB_SHARDS) if DB_SHARDS else None
+
+def row_shard(row_id: int) -> Optional[int]:
+    """Shard holding a game table row (a game, player, round, vote or submission) by its ID."""
+    return row_id // SHARD_ID_SPAN if DB_SHARDS else None
+
+def get_session(chat_id: Optional[int] = None, shard: Optional[int] = None):
+    """
+    Get a new database session.
+    
+    With sharded storage, a session for a chat (or a shard) works on the file
+    holding the chat's games, with the global tables reachable under their
+    usual names; without either it sees the global tables only (users, stats,
+    registrations). With a single file, every session sees everything.
+    
+    Args:
+        chat_id: Chat whose games the session works on
+        shard: Shard to work on, for work that isn't about a single chat
+    """
+    if chat_id is not None:
+        shard = chat_shard(chat_id)
+    if shard is None:
+        return Session()
+    return shard_sessions[shard]()
\ No newline at end of file
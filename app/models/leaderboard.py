@@ -0,0 +1,169 @@
+import bisect
+import threading
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.config.config import SHARDS
+from app.models.database import get_session, LeaderboardEntry, LeaderboardVersion, User
+from app.models.repository import upsert
+from app.utils import metrics
+
+# Users need this many games to appear on the leaderboard
+MIN_GAMES = 3
+
+class RankedUser(NamedTuple):
+    user_id: int  # users.id
+    first_name: str
+    games_played: int
+    wins: int
+    win_rate: float  # Percent
+
+    @property
+    def rank_key(self) -> Tuple[float, int, int]:
+        """Sort key, smaller ranks higher: win rate, then wins, then the older account."""
+        return (-self.win_rate, -self.wins, self.user_id)
+
+class Leaderboard:
+    """
+    Ordered in-memory top-N backed by the materialized `leaderboard` table.
+
+    Game results update the table (in the game's transaction) and then the
+    in-memory list. The list stays exact without touching the database unless
+    a user who was in it drops below everyone it still holds while users
+    outside it may now rank higher; only then is it reloaded, with one indexed
+    query, on the next read. Reading the top costs O(N).
+
+    When several processes share the database (`shared`), each change also
+    bumps a counter row, and a read first checks it with a primary-key lookup:
+    a list built before another process's change is reloaded.
+    """
+
+    def __init__(self, size: int = 10, shared: bool = False):
+        self._size = size
+        self._shared = shared
+        self._top: List[RankedUser] = []
+        self._keys: List[Tuple[float, int, int]] = []
+        self._loaded = False
+        self._version = 0  # bumped by every update, so a load racing with one isn't kept
+        self._shared_version = 0  # counter row value the list reflects
+        self._lock = threading.Lock()
+
+    def top(self, session: Optional[Session] = None) -> List[RankedUser]:
+        """
+        The best users, best first.
+
+        Args:
+            session: Session used if the database has to be read
+        """
+        own_session = session is None
+        try:
+            shared_version = 0
+            if self._shared:
+                session = session or get_session()
+                shared_version = self._read_shared_version(session)
+            with self._lock:
+                if self._loaded and self._shared_version == shared_version:
+                    metrics.counter('leaderboard.hits').inc()
+                    return list(self._top)
+                version = self._version
+
+            metrics.counter('leaderboard.loads').inc()
+            session = session or get_session()
+            rows = session.query(LeaderboardEntry) \
+                .order_by(LeaderboardEntry.win_rate.desc(), LeaderboardEntry.wins.desc(),
+                          LeaderboardEntry.user_id) \
+                .limit(self._size) \
+                .all()
+        finally:
+            if own_session and session is not None:
+                session.close()
+
+        top = [RankedUser(row.user_id, row.first_name, row.games_played, row.wins, row.win_rate) for row in rows]
+        with self._lock:
+            if self._version == version:
+                self._top = top
+                self._keys = [user.rank_key for user in top]
+                self._loaded = True
+                self._shared_version = shared_version
+            return top
+
+    def write(self, session: Session, users: Iterable[User]) -> Tuple[List[RankedUser], int]:
+        """
+        Stage updated user stats in the materialized table (the caller commits).
+
+        Returns:
+            The eligible users and the new counter row value (0 unless shared),
+            to pass to `update` once the transaction is committed
+        """
+        ranked = [
+            RankedUser(user.id, user.first_name, user.games_played, user.wins,
+                       user.wins * 100.0 / user.games_played)
+            for user in users if user.games_played >= MIN_GAMES
+        ]
+        upsert(
+            session,
+            LeaderboardEntry,
+            [user._asdict() for user in ranked],
+            key=['user_id'],
+            update_columns=['first_name', 'games_played', 'wins', 'win_rate']
+        )
+        shared_version = 0
+        if self._shared and ranked:
+            (shared_version,), = upsert(session, LeaderboardVersion, [{'id': 1, 'version': 1}], key=['id'],
+                                        increment_columns=['version'], returning=[LeaderboardVersion.version])
+        return ranked, shared_version
+
+    def update(self, users: Iterable[RankedUser], shared_version: int = 0) -> None:
+        """Apply committed stats (and the counter value `write` returned) to the in-memory top-N."""
+        users = list(users)
+        with self._lock:
+            self._version += 1
+            if not self._loaded or not users:
+                return
+            if self._shared:
+                if shared_version != self._shared_version + 1:
+                    # Another process changed the table since the list was read
+                    self._loaded = False
+                    return
+                self._shared_version = shared_version
+            for user in users:
+                self._apply(user)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._loaded = False
+
+    def _read_shared_version(self, session: Session) -> int:
+        row = session.get(LeaderboardVersion, 1, populate_existing=True)
+        return row.version if row else 0
+
+    def _apply(self, user: RankedUser) -> None:
+        # Everyone outside the list ranks below its last entry, unless the list holds every eligible user
+        full = len(self._top) >= self._size
+        floor = self._keys[-1] if self._keys else None
+
+        for i, ranked in enumerate(self._top):
+            if ranked.user_id == user.user_id:
+                if ranked.games_played > user.games_played:
+                    # A concurrently finished game already applied newer totals
+                    return
+                del self._top[i]
+                del self._keys[i]
+                break
+
+        key = user.rank_key
+        if full and floor is not None and key > floor:
+            if len(self._top) < self._size:
+                # The user fell out of the list; the next best user is not known here
+                self._loaded = False
+            return
+
+        index = bisect.bisect_left(self._keys, key)
+        self._keys.insert(index, key)
+        self._top.insert(index, user)
+        del self._top[self._size:]
+        del self._keys[self._size:]
+
+# Process-wide leaderboard; worker processes share the database when SHARDS > 1
+leaderboard = Leaderboard(shared=SHARDS > 1)
@@ -0,0 +1,145 @@
+import logging
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+def _statements(*sql: str) -> Callable[[Connection], None]:
+    def apply(connection: Connection) -> None:
+        for statement in sql:
+            connection.execute(text(statement))
+    return apply
+
+def _add_columns(table: str, *columns: Tuple[str, str]) -> Callable[[Connection], None]:
+    def apply(connection: Connection) -> None:
+        existing = {column['name'] for column in inspect(connection).get_columns(table)}
+        for name, ddl_type in columns:
+            if name not in existing:
+                connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl_type}"))
+    return apply
+
+def _attached_shards(connection: Connection) -> List[str]:
+    """Schemas of the shard files attached to the connection (shard0, shard1, ...)."""
+    return [row[1] for row in connection.execute(text("PRAGMA database_list")) if row[1].startswith('shard')]
+
+def _backfill_role_stats(connection: Connection) -> None:
+    """
+    Rebuild user_role_stats from the games that ended by vote (state 6, RESULTS),
+    the only ones the bot records role statistics for: won by the spies if any
+    spy was still active, otherwise by the loyal side. Games stopped with
+    /endgame are left out.
+
+    Games are read from the database itself and from every attached shard
+    file. Row IDs of the global file and shard 0 can overlap, so rows are
+    matched within their own file.
+    """
+    schemas = ['main'] + _attached_shards(connection)
+    players = " UNION ALL ".join(
+        f"SELECT '{schema}' AS db, game_id, user_id, role, is_active FROM {schema}.game_players" for schema in schemas
+    )
+    games = " UNION ALL ".join(
+        f"SELECT '{schema}' AS db, id, state, finished_at FROM {schema}.games" for schema in schemas
+    )
+    connection.execute(text("DELETE FROM user_role_stats"))
+    connection.execute(text(
+        "INSERT INTO user_role_stats (user_id, role, games, wins, eliminations) "
+        "SELECT gp.user_id, gp.role, COUNT(*), "
+        "SUM(CASE WHEN (gp.role = 'Шпион' AND s.active_spies > 0) "
+        "OR (gp.role <> 'Шпион' AND s.active_spies = 0) THEN 1 ELSE 0 END), "
+        "SUM(CASE WHEN gp.is_active THEN 0 ELSE 1 END) "
+        f"FROM ({players}) gp "
+        f"JOIN ({games}) g ON g.db = gp.db AND g.id = gp.game_id "
+        "JOIN (SELECT db, game_id, SUM(CASE WHEN role = 'Шпион' AND is_active THEN 1 ELSE 0 END) AS active_spies "
+        f"FROM ({players}) GROUP BY db, game_id) s ON s.db = gp.db AND s.game_id = gp.game_id "
+        "WHERE g.finished_at IS NOT NULL AND g.state = 6 AND gp.user_id IS NOT NULL AND gp.role IS NOT NULL "
+        "GROUP BY gp.user_id, gp.role"
+    ))
+
+# Ordered schema migrations: (version, description, apply).
+# Every step must also be safe on a database freshly created by create_all,
+# which already has the current schema, so DDL is conditional. With sharded
+# storage, the global database is migrated with the shard files attached, for
+# steps that read game tables; steps after 6 also run on every shard file,
+# which holds only the game tables.
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "indexes for the hot queries", _statements(
+        "CREATE INDEX IF NOT EXISTS ix_games_chat_id_finished_at ON games (chat_id, finished_at)",
+        "CREATE INDEX IF NOT EXISTS ix_game_players_game_id_is_active ON game_players (game_id, is_active)",
+        "CREATE INDEX IF NOT EXISTS ix_game_players_user_id ON game_players (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_game_rounds_game_id ON game_rounds (game_id)",
+        "CREATE INDEX IF NOT EXISTS ix_creative_submissions_round_id ON creative_submissions (round_id)",
+        # Older versions could store several votes per player and round; keep the latest
+        "DELETE FROM votes WHERE id NOT IN (SELECT MAX(id) FROM votes GROUP BY round_id, voter_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_votes_round_id_voter_id ON votes (round_id, voter_id)",
+    )),
+    # New tables (registrations, leaderboard, user_role_stats) are created by create_all
+    (2, "durable phase deadlines", _add_columns(
+        'games', ('next_phase', 'VARCHAR'), ('phase_deadline', 'DATETIME'),
+    )),
+    (3, "materialized leaderboard", _statements(
+        "CREATE INDEX IF NOT EXISTS ix_leaderboard_win_rate_wins ON leaderboard (win_rate, wins)",
+        "DELETE FROM leaderboard",
+        "INSERT INTO leaderboard (user_id, first_name, games_played, wins, win_rate) "
+        "SELECT id, first_name, games_played, wins, wins * 100.0 / games_played "
+        "FROM users WHERE games_played >= 3",
+    )),
+    (4, "per-user role statistics", _backfill_role_stats),
+    (5, "photo cache keys of submissions", _add_columns(
+        'creative_submissions', ('file_unique_id', 'VARCHAR'),
+    )),
+    (6, "phase start times for adaptive durations", _add_columns(
+        'game_rounds', ('creative_started_at', 'DATETIME'), ('voting_started_at', 'DATETIME'),
+    )),
+]
+
+def schema_version(connection: Connection) -> int:
+    """Return the version recorded in schema_version (0 for an unversioned database)."""
+    connection.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    version = connection.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+    return version or 0
+
+def stamp(engine: Engine) -> int:
+    """
+    Record a database freshly created by create_all as up to date, without
+    running the migrations (shard files lack the tables older steps touch).
+    
+    Returns:
+        Schema version of the database
+    """
+    with engine.begin() as connection:
+        version = schema_version(connection)
+        if version == 0:
+            version = MIGRATIONS[-1][0]
+            connection.execute(text("INSERT INTO schema_version (version) VALUES (:version)"),
+                               {"version": version})
+    return version
+
+def migrate(engine: Engine) -> int:
+    """
+    Apply every migration newer than the database's schema version.
+    
+    Each migration runs in its own transaction together with the version bump,
+    so an interrupted upgrade resumes from the first unapplied step.
+    
+    Args:
+        engine: Engine of the database to upgrade
+        
+    Returns:
+        Schema version after the upgrade
+    """
+    with engine.begin() as connection:
+        version = schema_version(connection)
+    
+    for target, description, apply in MIGRATIONS:
+        if target <= version:
+            continue
+        logger.info(f"Applying migration {target}: {description}")
+        with engine.begin() as connection:
+            apply(connection)
+            connection.execute(text("INSERT INTO schema_version (version) VALUES (:version)"),
+                               {"version": target})
+        version = target
+    
+    return version
@@ -0,0 +1,156 @@
+import collections
+import datetime
+import math
+import threading
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from app.config.config import ADAPTIVE_PHASES, PHASE_PERCENTILE, PHASE_GRACE, PHASE_WINDOW, PHASE_MIN_SAMPLES
+from app.config.config import DEFAULT_CREATIVE_TIME, DEFAULT_DISCUSSION_TIME, DEFAULT_VOTING_TIME
+from app.config.config import CREATIVE_TIME_BOUNDS, DISCUSSION_TIME_BOUNDS, VOTING_TIME_BOUNDS
+from app.models.database import get_session, CreativeSubmission, Game, GameRound, Vote
+from app.utils import metrics
+
+CREATIVE = 'creative'
+DISCUSSION = 'discussion'
+VOTING = 'voting'
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+class PhaseTiming:
+    """
+    Per-chat phase durations sized from how fast the chat's players respond.
+
+    Every player's response time in the creative and voting phases (from the
+    phase start to `submitted_at` / `voted_at`) goes into a rolling window per
+    chat and phase. Players who never responded count with the time the phase
+    actually lasted, so a chat that keeps running out of time gets longer
+    phases. A phase lasts `grace` times the window's percentile, clamped to
+    its bounds, and the discussion is scaled like the voting. Chats with too
+    few observations get the defaults. Windows are seeded from the chat's
+    recent rounds in the database the first time the chat is seen.
+    """
+
+    def __init__(self, enabled: bool = True, percentile: float = 90, grace: float = 1.25,
+                 window: int = 60, min_samples: int = 8,
+                 defaults: Optional[Dict[str, float]] = None,
+                 bounds: Optional[Dict[str, Tuple[float, float]]] = None):
+        self._enabled = enabled
+        self._percentile = percentile
+        self._grace = grace
+        self._window = window
+        self._min_samples = min_samples
+        self._defaults = defaults or {}
+        self._bounds = bounds or {}
+        self._samples: Dict[Tuple[int, str], Deque[float]] = {}
+        self._loaded = set()
+        self._lock = threading.Lock()
+
+    def duration(self, chat_id: int, phase: str) -> float:
+        """
+        Seconds the next `phase` of a chat should last.
+
+        Args:
+            chat_id: Chat of the game
+            phase: CREATIVE, DISCUSSION or VOTING
+
+        Returns:
+            Duration in seconds
+        """
+        default = self._defaults[phase]
+        if not self._enabled:
+            return default
+
+        if phase == DISCUSSION:
+            seconds = default * self.duration(chat_id, VOTING) / self._defaults[VOTING]
+        else:
+            self._load(chat_id)
+            with self._lock:
+                samples = list(self._samples.get((chat_id, phase), ()))
+            if len(samples) < self._min_samples:
+                return default
+            seconds = self._grace * percentile(samples, self._percentile)
+
+        low, high = self._bounds.get(phase, (default, default))
+        seconds = round(min(high, max(low, seconds)))
+        metrics.latency(f'phases.{phase}_duration').observe(seconds)
+        return seconds
+
+    def record(self, chat_id: int, phase: str, started_at: Optional[datetime.datetime],
+               responded_at: Iterable[Optional[datetime.datetime]], missing: int,
+               ended_at: datetime.datetime) -> None:
+        """
+        Record the response times of a finished phase.
+
+        Args:
+            chat_id: Chat of the game
+            phase: CREATIVE or VOTING
+            started_at: When the phase started (nothing is recorded if unknown)
+            responded_at: When each responding player submitted or voted
+            missing: Number of players who didn't respond
+            ended_at: When the phase ended
+        """
+        if not self._enabled or started_at is None:
+            return
+        latencies = [
+            max(0.0, (moment - started_at).total_seconds())
+            for moment in responded_at if moment is not None
+        ]
+        latencies += [max(0.0, (ended_at - started_at).total_seconds())] * missing
+        self._load(chat_id)
+        self._extend(chat_id, phase, latencies)
+
+    def _extend(self, chat_id: int, phase: str, latencies: Iterable[float]) -> None:
+        with self._lock:
+            samples = self._samples.get((chat_id, phase))
+            if samples is None:
+                samples = self._samples[(chat_id, phase)] = collections.deque(maxlen=self._window)
+            samples.extend(latencies)
+
+    def _load(self, chat_id: int) -> None:
+        """Seed a chat's windows with its latest responses in the database."""
+        with self._lock:
+            if chat_id in self._loaded:
+                return
+            self._loaded.add(chat_id)
+
+        session = get_session(chat_id)
+        try:
+            submissions = session.query(CreativeSubmission.submitted_at, GameRound.creative_started_at) \
+                .join(GameRound, GameRound.id == CreativeSubmission.round_id) \
+                .join(Game, Game.id == GameRound.game_id) \
+                .filter(Game.chat_id == chat_id,
+                        GameRound.creative_started_at.isnot(None),
+                        CreativeSubmission.content.isnot(None)) \
+                .order_by(CreativeSubmission.id.desc()) \
+                .limit(self._window) \
+                .all()
+            votes = session.query(Vote.voted_at, GameRound.voting_started_at) \
+                .join(GameRound, GameRound.id == Vote.round_id) \
+                .join(Game, Game.id == GameRound.game_id) \
+                .filter(Game.chat_id == chat_id, GameRound.voting_started_at.isnot(None)) \
+                .order_by(Vote.id.desc()) \
+                .limit(self._window) \
+                .all()
+        finally:
+            session.close()
+
+        for phase, rows in ((CREATIVE, submissions), (VOTING, votes)):
+            # Oldest first, so live observations push them out of the window
+            self._extend(chat_id, phase, [
+                max(0.0, (responded_at - started_at).total_seconds())
+                for responded_at, started_at in reversed(rows)
+            ])
+
+# Process-wide model used by the phase handlers
+phase_timing = PhaseTiming(
+    enabled=ADAPTIVE_PHASES,
+    percentile=PHASE_PERCENTILE,
+    grace=PHASE_GRACE,
+    window=PHASE_WINDOW,
+    min_samples=PHASE_MIN_SAMPLES,
+    defaults={CREATIVE: DEFAULT_CREATIVE_TIME, DISCUSSION: DEFAULT_DISCUSSION_TIME, VOTING: DEFAULT_VOTING_TIME},
+    bounds={CREATIVE: CREATIVE_TIME_BOUNDS, DISCUSSION: DISCUSSION_TIME_BOUNDS, VOTING: VOTING_TIME_BOUNDS}
+)
@@ -0,0 +1,266 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, joinedload
+
+from app.models.database import GamePlayer, CreativeSubmission, User
+
+class NameCache:
+    """
+    Small thread-safe LRU of display names keyed by User.id.
+    """
+
+    def __init__(self, capacity: int = 4096):
+        self._capacity = capacity
+        self._names = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[str]:
+        with self._lock:
+            name = self._names.get(user_id)
+            if name is not None:
+                self._names.move_to_end(user_id)
+            return name
+
+    def put(self, user_id: int, name: str) -> None:
+        with self._lock:
+            self._names[user_id] = name
+            self._names.move_to_end(user_id)
+            while len(self._names) > self._capacity:
+                self._names.popitem(last=False)
+
+# Display names of recently seen users
+display_names = NameCache()
+
+def _remember(users: Iterable[User]) -> None:
+    for user in users:
+        display_names.put(user.id, user.first_name)
+
+def get_game_players(session: Session, game_id: int, active_only: bool = False) -> List[GamePlayer]:
+    """
+    Load the players of a game together with their User rows in one query.
+
+    Args:
+        session: Database session
+        game_id: Game ID
+        active_only: Only return players that have not been eliminated
+
+    Returns:
+        Players ordered by id, with `player.user` already loaded
+    """
+    query = session.query(GamePlayer) \
+        .options(joinedload(GamePlayer.user)) \
+        .filter(GamePlayer.game_id == game_id)
+    if active_only:
+        query = query.filter(GamePlayer.is_active == True)
+    players = query.order_by(GamePlayer.id).all()
+    _remember(player.user for player in players if player.user)
+    return players
+
+def get_players_for_games(session: Session, game_ids: List[int]) -> Dict[int, List[GamePlayer]]:
+    """
+    Load the players of several games, with their User rows, in one query.
+
+    Returns:
+        Dictionary mapping game_id to its players ordered by id
+    """
+    players: Dict[int, List[GamePlayer]] = {game_id: [] for game_id in game_ids}
+    if not game_ids:
+        return players
+
+    rows = session.query(GamePlayer) \
+        .options(joinedload(GamePlayer.user)) \
+        .filter(GamePlayer.game_id.in_(game_ids)) \
+        .order_by(GamePlayer.id) \
+        .all()
+    for player in rows:
+        players[player.game_id].append(player)
+    _remember(player.user for player in rows if player.user)
+    return players
+
+def get_round_submissions(session: Session, round_id: int) -> List[CreativeSubmission]:
+    """
+    Load all submissions of a round in a stable order, with their players.
+
+    The order (by id) is the anonymous numbering shown during discussion.
+    """
+    return session.query(CreativeSubmission) \
+        .options(joinedload(CreativeSubmission.player)) \
+        .filter(CreativeSubmission.round_id == round_id) \
+        .order_by(CreativeSubmission.id) \
+        .all()
+
+def get_display_names(session: Session, user_ids: Iterable[int]) -> Dict[int, str]:
+    """
+    Resolve display names by User.id, querying only the ones not cached.
+
+    Returns:
+        Dictionary mapping User.id to first name (unknown ids are omitted)
+    """
+    names: Dict[int, str] = {}
+    missing = []
+    for user_id in set(user_ids):
+        name = display_names.get(user_id)
+        if name is None:
+            missing.append(user_id)
+        else:
+            names[user_id] = name
+
+    if missing:
+        users = session.query(User).filter(User.id.in_(missing)).all()
+        _remember(users)
+        names.update({user.id: user.first_name for user in users})
+
+    return names
+
+def upsert(session: Session, model: type, rows: List[Dict[str, object]], key: List[str],
+           update_columns: Iterable[str] = (), increment_columns: Iterable[str] = (),
+           returning: Sequence = (), newer_column: Optional[str] = None) -> List[tuple]:
+    """
+    Insert rows; where the `key` columns already exist, overwrite `update_columns`
+    and add the new values of `increment_columns` to the stored ones. With
+    `newer_column`, a stored row is only updated if the incoming value of that
+    column is at least as new.
+
+    Issued as one INSERT ... ON CONFLICT DO UPDATE statement (SQLite and PostgreSQL).
+
+    Returns:
+        The `returning` columns of every inserted or updated row (empty if none requested)
+    """
+    if not rows:
+        return []
+    dialect = postgresql if session.get_bind().dialect.name == 'postgresql' else sqlite
+    statement = dialect.insert(model).values(rows)
+    changes = {column: statement.excluded[column] for column in update_columns}
+    changes.update({
+        column: getattr(model, column) + statement.excluded[column] for column in increment_columns
+    })
+    where = None
+    if newer_column:
+        where = getattr(model, newer_column) <= statement.excluded[newer_column]
+    statement = statement.on_conflict_do_update(index_elements=key, set_=changes, where=where)
+    if not returning:
+        session.execute(statement)
+        return []
+    return session.execute(statement.returning(*returning)).all()
+
+def save_users(session: Session, telegram_users: Sequence) -> Dict[int, int]:
+    """
+    Create or refresh users by Telegram id (refreshing username and names) in one statement.
+
+    Args:
+        session: Database session (the caller commits)
+        telegram_users: Telegram users to save
+
+    Returns:
+        Telegram id -> User.id
+    """
+    user_rows = [
+        {
+            "user_id": telegram_user.id,
+            "username": telegram_user.username,
+            "first_name": telegram_user.first_name,
+            "last_name": telegram_user.last_name
+        }
+        for telegram_user in telegram_users
+    ]
+    users = upsert(
+        session,
+        User,
+        user_rows,
+        key=['user_id'],
+        update_columns=['username', 'first_name', 'last_name'],
+        returning=[User.id, User.user_id]
+    )
+    user_ids = {telegram_id: user_id for user_id, telegram_id in users}
+    for telegram_user in telegram_users:
+        display_names.put(user_ids[telegram_user.id], telegram_user.first_name)
+    return user_ids
+
+def create_game_players(session: Session, game_id: int, telegram_users: Sequence,
+                        roles: Sequence[str], user_ids: Optional[Dict[int, int]] = None) -> List[Tuple[int, int]]:
+    """
+    Create or refresh the users of a new game and add them as players, in two statements.
+
+    Users are upserted with `save_users` unless `user_ids` says they already
+    were, then all GamePlayer rows are inserted at once. The caller commits.
+
+    Args:
+        session: Database session
+        game_id: Game ID
+        telegram_users: Registered Telegram users, in join order
+        roles: Role of each user, in the same order
+        user_ids: Telegram id -> User.id of users saved beforehand
+
+    Returns:
+        (GamePlayer.id, User.id) for each Telegram user, in the same order
+    """
+    if user_ids is None:
+        user_ids = save_users(session, telegram_users)
+
+    players = session.execute(
+        insert(GamePlayer).returning(GamePlayer.id, GamePlayer.user_id),
+        [
+            {"game_id": game_id, "user_id": user_ids[telegram_user.id], "role": role}
+            for telegram_user, role in zip(telegram_users, roles)
+        ]
+    ).all()
+    player_ids = {user_id: player_id for player_id, user_id in players}
+
+    return [
+        (player_ids[user_ids[telegram_user.id]], user_ids[telegram_user.id])
+        for telegram_user in telegram_users
+    ]
+
+def add_scores(session: Session, scores: Dict[int, int]) -> None:
+    """Add round scores to players (GamePlayer.id -> points) in one UPDATE."""
+    if not scores:
+        return
+    session.execute(
+        update(GamePlayer)
+        .where(GamePlayer.id.in_(list(scores)))
+        .values(score=GamePlayer.score + case(scores, value=GamePlayer.id, else_=0))
+        .execution_options(synchronize_session=False)
+    )
+
+def settle_game_users(session: Session, game_id: int, winning_roles: Iterable[str]) -> List[tuple]:
+    """
+    Count a finished game in its players' user totals with two set-based UPDATEs.
+
+    Increments are done in SQL, so games finishing concurrently with shared
+    players don't overwrite each other's totals.
+
+    Returns:
+        (id, first_name, games_played, wins) rows of the updated users
+    """
+    players = select(GamePlayer.user_id).where(GamePlayer.game_id == game_id)
+    winners = players.where(GamePlayer.role.in_(list(winning_roles)))
+    session.execute(
+        update(User)
+        .where(User.id.in_(winners))
+        .values(wins=User.wins + 1)
+        .execution_options(synchronize_session=False)
+    )
+    return session.execute(
+        update(User)
+        .where(User.id.in_(players))
+        .values(games_played=User.games_played + 1)
+        .returning(User.id, User.first_name, User.games_played, User.wins)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+def get_scoreboard(session: Session, game_id: int) -> List[Tuple[str, int, str]]:
+    """
+    Final scores of a game in one joined query.
+
+    Returns:
+        (first name, score, role) per player, highest score first
+    """
+    return session.query(User.first_name, GamePlayer.score, GamePlayer.role) \
+        .join(User, User.id == GamePlayer.user_id) \
+        .filter(GamePlayer.game_id == game_id) \
+        .order_by(GamePlayer.score.desc(), GamePlayer.id) \
+        .all()
@@ -0,0 +1,426 @@
+from abc import ABC, abstractmethod
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config.config import STATE_BACKEND, STATE_TTL, REDIS_URL, REDIS_PREFIX, REDIS_POOL_SIZE
+from app.utils.resp import RespClient
+
+# A vote as kept by the backends: (target player id, UTC timestamp)
+StoredVote = Tuple[int, float]
+
+class StateBackend(ABC):
+    """
+    Short-lived game state shared by every process serving the bot.
+
+    Holds the three structures that used to be module-level dicts: the
+    registration list of each chat, the pending task of each player (grouped
+    by round, so the last answer of a round can be detected) and the votes of
+    each open ballot; plus the game running in each chat, so a node that
+    doesn't hold a game in memory still refuses a second one. Every operation that checks and changes state is atomic,
+    and every key expires `ttl` seconds after its last write, so state left
+    behind by a crashed process doesn't live forever.
+    """
+
+    # Registration lists
+
+    @abstractmethod
+    def register(self, chat_id: int, user: Dict[str, Any]) -> Optional[int]:
+        """
+        Add a Telegram user (as a dict) to a chat's registration list.
+
+        Returns:
+            Number of registered users, or None if the user was already registered
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def registrations(self, chat_id: int) -> List[Dict[str, Any]]:
+        """Registered users of a chat in join order."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear_registrations(self, chat_id: int) -> None:
+        raise NotImplementedError
+
+    # Running games
+
+    @abstractmethod
+    def claim_chat(self, chat_id: int, game_id: int) -> bool:
+        """
+        Record that a game runs in a chat.
+
+        Returns:
+            False if another game already runs there (the chat is left to it)
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def chat_game(self, chat_id: int) -> Optional[int]:
+        """ID of the game running in a chat, if any."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def release_chat(self, chat_id: int, game_id: int) -> None:
+        """Forget a finished game; a chat claimed by another game is left alone."""
+        raise NotImplementedError
+
+    # Pending tasks
+
+    @abstractmethod
+    def put_tasks(self, round_id: int, tasks: Dict[int, Dict[str, Any]]) -> None:
+        """Store the tasks of a round (Telegram user id -> task), replacing the users' older tasks."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def task(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """A player's pending task."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def take_task(self, user_id: int) -> Tuple[Optional[Dict[str, Any]], int]:
+        """
+        Remove a player's pending task; only one caller gets it.
+
+        Returns:
+            Tuple of (task or None, tasks of its round still pending); exactly
+            one caller sees 0 for the round's last task
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear_round_tasks(self, round_id: int) -> None:
+        """Drop the unanswered tasks of a round."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def tasks(self) -> Dict[int, Dict[str, Any]]:
+        """Every pending task by Telegram user id."""
+        raise NotImplementedError
+
+    # Ballots
+
+    @abstractmethod
+    def open_ballot(self, round_id: int, ballot: Dict[str, Any], votes: Dict[int, StoredVote]) -> None:
+        """
+        Open a round's ballot.
+
+        Args:
+            round_id: Round ID
+            ballot: Voter and target indexes of the round
+            votes: Votes already cast (voter -> vote); votes in the backend win
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def ballot(self, round_id: int) -> Optional[Dict[str, Any]]:
+        """Indexes of an open ballot, or None if it is closed or unknown."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def cast_vote(self, round_id: int, voter_id: int, target_id: int, voted_at: float) -> Optional[int]:
+        """
+        Record (or change) a vote on an open ballot.
+
+        Returns:
+            Number of voters who have voted, or None if the ballot is closed
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def close_ballot(self, round_id: int) -> Optional[Dict[int, StoredVote]]:
+        """
+        Close a ballot; only one caller gets its votes.
+
+        Returns:
+            Votes by voter, or None if the ballot was already closed or unknown
+        """
+        raise NotImplementedError
+
+class MemoryBackend(StateBackend):
+    """State in this process's memory: the default for a single bot process."""
+
+    def __init__(self, ttl: float = 6 * 3600):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # table -> key -> [expires at (monotonic), value]
+        self._tables: Dict[str, Dict[int, list]] = {
+            'registrations': {}, 'chats': {}, 'tasks': {}, 'round_tasks': {}, 'ballots': {}
+        }
+
+    def _get(self, table: str, key: int) -> Any:
+        """Live value of a key, dropping it if expired. Caller holds the lock."""
+        entry = self._tables[table].get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._tables[table][key]
+            return None
+        return entry[1]
+
+    def _set(self, table: str, key: int, value: Any) -> Any:
+        """Store a value with a fresh TTL. Caller holds the lock."""
+        self._tables[table][key] = [time.monotonic() + self._ttl, value]
+        return value
+
+    def _pop(self, table: str, key: int) -> Any:
+        value = self._get(table, key)
+        self._tables[table].pop(key, None)
+        return value
+
+    def register(self, chat_id: int, user: Dict[str, Any]) -> Optional[int]:
+        with self._lock:
+            users = self._set('registrations', chat_id, self._get('registrations', chat_id) or {})
+            if user['id'] in users:
+                return None
+            users[user['id']] = user
+            return len(users)
+
+    def registrations(self, chat_id: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list((self._get('registrations', chat_id) or {}).values())
+
+    def clear_registrations(self, chat_id: int) -> None:
+        with self._lock:
+            self._pop('registrations', chat_id)
+
+    def claim_chat(self, chat_id: int, game_id: int) -> bool:
+        with self._lock:
+            running = self._get('chats', chat_id)
+            if running is not None and running != game_id:
+                return False
+            self._set('chats', chat_id, game_id)
+            return True
+
+    def chat_game(self, chat_id: int) -> Optional[int]:
+        with self._lock:
+            return self._get('chats', chat_id)
+
+    def release_chat(self, chat_id: int, game_id: int) -> None:
+        with self._lock:
+            if self._get('chats', chat_id) == game_id:
+                self._pop('chats', chat_id)
+
+    def put_tasks(self, round_id: int, tasks: Dict[int, Dict[str, Any]]) -> None:
+        with self._lock:
+            for user_id, task in tasks.items():
+                self._set('tasks', user_id, task)
+            pending = self._get('round_tasks', round_id) or set()
+            self._set('round_tasks', round_id, pending | set(tasks))
+
+    def task(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._get('tasks', user_id)
+
+    def take_task(self, user_id: int) -> Tuple[Optional[Dict[str, Any]], int]:
+        with self._lock:
+            task = self._pop('tasks', user_id)
+            if task is None:
+                return None, 0
+            pending = self._get('round_tasks', task['round_id']) or set()
+            pending.discard(user_id)
+            return task, len(pending)
+
+    def clear_round_tasks(self, round_id: int) -> None:
+        with self._lock:
+            for user_id in self._pop('round_tasks', round_id) or ():
+                task = self._get('tasks', user_id)
+                if task is not None and task['round_id'] == round_id:
+                    self._pop('tasks', user_id)
+
+    def tasks(self) -> Dict[int, Dict[str, Any]]:
+        with self._lock:
+            tasks = {user_id: self._get('tasks', user_id) for user_id in list(self._tables['tasks'])}
+        return {user_id: task for user_id, task in tasks.items() if task is not None}
+
+    def open_ballot(self, round_id: int, ballot: Dict[str, Any], votes: Dict[int, StoredVote]) -> None:
+        with self._lock:
+            stored = (self._get('ballots', round_id) or {}).get('votes', {})
+            self._set('ballots', round_id, {'ballot': ballot, 'votes': {**votes, **stored}})
+
+    def ballot(self, round_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._get('ballots', round_id)
+            return entry['ballot'] if entry else None
+
+    def cast_vote(self, round_id: int, voter_id: int, target_id: int, voted_at: float) -> Optional[int]:
+        with self._lock:
+            entry = self._get('ballots', round_id)
+            if entry is None:
+                return None
+            entry['votes'][voter_id] = (target_id, voted_at)
+            self._set('ballots', round_id, entry)
+            return len(entry['votes'])
+
+    def close_ballot(self, round_id: int) -> Optional[Dict[int, StoredVote]]:
+        with self._lock:
+            entry = self._pop('ballots', round_id)
+            return entry['votes'] if entry else None
+
+class RedisBackend(StateBackend):
+    """
+    State on a Redis-protocol server, shared by several bot processes.
+
+    Layout (all keys under `prefix`):
+        reg:<chat>             hash  user id -> user JSON (with a join timestamp)
+        chat:<chat>            ID of the game running in the chat
+        task:<user>            JSON of the player's pending task
+        round_tasks:<round>    set   users whose task of the round is pending
+        tasks                  set   every user with a pending task
+        ballot:<round>         JSON of an open ballot's indexes
+        votes:<round>          hash  voter -> "target:timestamp"
+
+    Checks and changes of one operation go to the server in a single MULTI/EXEC
+    pipeline, so they are atomic and cost one round trip. Changes that depend
+    on a value read first (which round a taken task belongs to, who holds a
+    chat) use WATCH and are retried if the value changes meanwhile.
+    """
+
+    def __init__(self, client: RespClient, prefix: str = 'spy:', ttl: float = 6 * 3600):
+        self._client = client
+        self._prefix = prefix
+        self._ttl = int(ttl)
+
+    def _key(self, *parts) -> str:
+        return self._prefix + ':'.join(str(part) for part in parts)
+
+    def register(self, chat_id: int, user: Dict[str, Any]) -> Optional[int]:
+        key = self._key('reg', chat_id)
+        value = json.dumps(dict(user, joined_at=time.time()))
+        added, count, _ = self._client.pipeline([
+            ('HSETNX', key, user['id'], value),
+            ('HLEN', key),
+            ('EXPIRE', key, self._ttl),
+        ], transaction=True)
+        return count if added else None
+
+    def registrations(self, chat_id: int) -> List[Dict[str, Any]]:
+        reply = self._client.execute('HGETALL', self._key('reg', chat_id))
+        users = [json.loads(value) for value in reply[1::2]]
+        users.sort(key=lambda user: user.pop('joined_at', 0))
+        return users
+
+    def clear_registrations(self, chat_id: int) -> None:
+        self._client.execute('DEL', self._key('reg', chat_id))
+
+    def claim_chat(self, chat_id: int, game_id: int) -> bool:
+        key = self._key('chat', chat_id)
+        _, running = self._client.pipeline([
+            ('SET', key, game_id, 'NX', 'EX', self._ttl),
+            ('GET', key),
+        ], transaction=True)
+        return int(running) == game_id
+
+    def chat_game(self, chat_id: int) -> Optional[int]:
+        value = self._client.execute('GET', self._key('chat', chat_id))
+        return int(value) if value is not None else None
+
+    def release_chat(self, chat_id: int, game_id: int) -> None:
+        key = self._key('chat', chat_id)
+        self._client.check_and_set(
+            [key], [('GET', key)],
+            lambda replies: [('DEL', key)] if replies[0] is not None and int(replies[0]) == game_id else None
+        )
+
+    def put_tasks(self, round_id: int, tasks: Dict[int, Dict[str, Any]]) -> None:
+        if not tasks:
+            return
+        commands = [('SET', self._key('task', user_id), json.dumps(task), 'EX', self._ttl)
+                    for user_id, task in tasks.items()]
+        commands += [
+            ('SADD', self._key('round_tasks', round_id), *tasks),
+            ('EXPIRE', self._key('round_tasks', round_id), self._ttl),
+            ('SADD', self._key('tasks'), *tasks),
+            ('EXPIRE', self._key('tasks'), self._ttl),
+        ]
+        self._client.pipeline(commands, transaction=True)
+
+    def task(self, user_id: int) -> Optional[Dict[str, Any]]:
+        value = self._client.execute('GET', self._key('task', user_id))
+        return json.loads(value) if value is not None else None
+
+    def take_task(self, user_id: int) -> Tuple[Optional[Dict[str, Any]], int]:
+        key = self._key('task', user_id)
+
+        def remove(replies: list) -> Optional[list]:
+            if replies[0] is None:
+                return None
+            round_tasks = self._key('round_tasks', json.loads(replies[0])['round_id'])
+            return [
+                ('DEL', key),
+                ('SREM', round_tasks, user_id),
+                ('SREM', self._key('tasks'), user_id),
+                ('SCARD', round_tasks),
+            ]
+
+        # The task leaves every index in the same transaction, so no other caller sees it half removed
+        (value,), removed = self._client.check_and_set([key], [('GET', key)], remove)
+        if removed is None:
+            return None, 0
+        return json.loads(value), removed[-1]
+
+    def clear_round_tasks(self, round_id: int) -> None:
+        users = self._client.execute('SMEMBERS', self._key('round_tasks', round_id))
+        commands = [('DEL', self._key('round_tasks', round_id))]
+        if users:
+            commands += [('DEL', *(self._key('task', int(user_id)) for user_id in users)),
+                         ('SREM', self._key('tasks'), *users)]
+        self._client.pipeline(commands, transaction=True)
+
+    def tasks(self) -> Dict[int, Dict[str, Any]]:
+        users = [int(user_id) for user_id in self._client.execute('SMEMBERS', self._key('tasks'))]
+        if not users:
+            return {}
+        values = self._client.execute('MGET', *(self._key('task', user_id) for user_id in users))
+        return {user_id: json.loads(value) for user_id, value in zip(users, values) if value is not None}
+
+    def open_ballot(self, round_id: int, ballot: Dict[str, Any], votes: Dict[int, StoredVote]) -> None:
+        key = self._key('votes', round_id)
+        commands = [('SET', self._key('ballot', round_id), json.dumps(ballot), 'EX', self._ttl)]
+        commands += [('HSETNX', key, voter_id, f'{target_id}:{voted_at}')
+                     for voter_id, (target_id, voted_at) in votes.items()]
+        commands.append(('EXPIRE', key, self._ttl))
+        self._client.pipeline(commands, transaction=True)
+
+    def ballot(self, round_id: int) -> Optional[Dict[str, Any]]:
+        value = self._client.execute('GET', self._key('ballot', round_id))
+        return json.loads(value) if value is not None else None
+
+    def cast_vote(self, round_id: int, voter_id: int, target_id: int, voted_at: float) -> Optional[int]:
+        key = self._key('votes', round_id)
+        is_open, _, count, _ = self._client.pipeline([
+            ('EXISTS', self._key('ballot', round_id)),
+            ('HSET', key, voter_id, f'{target_id}:{voted_at}'),
+            ('HLEN', key),
+            ('EXPIRE', key, self._ttl),
+        ], transaction=True)
+        if not is_open:
+            # The ballot closed before this vote; drop what it recreated
+            self._client.execute('DEL', key)
+            return None
+        return count
+
+    def close_ballot(self, round_id: int) -> Optional[Dict[int, StoredVote]]:
+        ballot_key, votes_key = self._key('ballot', round_id), self._key('votes', round_id)
+        is_open, votes, _ = self._client.pipeline([
+            ('EXISTS', ballot_key),
+            ('HGETALL', votes_key),
+            ('DEL', ballot_key, votes_key),
+        ], transaction=True)
+        if not is_open:
+            return None
+        result = {}
+        for voter_id, value in zip(votes[::2], votes[1::2]):
+            target_id, voted_at = value.split(b':', 1)
+            result[int(voter_id)] = (int(target_id), float(voted_at))
+        return result
+
+def create_backend() -> StateBackend:
+    """The backend selected by STATE_BACKEND ('memory' or 'redis')."""
+    if STATE_BACKEND == 'redis':
+        return RedisBackend(RespClient(REDIS_URL, pool_size=REDIS_POOL_SIZE), prefix=REDIS_PREFIX, ttl=STATE_TTL)
+    return MemoryBackend(ttl=STATE_TTL)
+
+# Process-wide backend used by the handlers and the vote ledger
+state_backend = create_backend()
@@ -0,0 +1,344 @@
+import atexit
+import datetime
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, update
+
+from app.config.config import STATE_FLUSH_INTERVAL, GAME_STATES
+from app.models.database import get_session, storage_shards, row_shard, Game, GamePlayer, GameRound
+from app.models.repository import get_players_for_games
+from app.models.state_backend import state_backend
+from app.utils import metrics
+from app.utils.sharding import claim_player
+
+logger = logging.getLogger(__name__)
+
+class LivePlayer:
+    """In-memory view of a GamePlayer and the User behind it."""
+
+    __slots__ = ('player_id', 'user_id', 'telegram_id', 'first_name', 'role', 'is_active')
+
+    def __init__(self, player_id: int, user_id: int, telegram_id: int, first_name: str,
+                 role: str, is_active: bool = True):
+        self.player_id = player_id
+        self.user_id = user_id  # users.id
+        self.telegram_id = telegram_id  # users.user_id
+        self.first_name = first_name
+        self.role = role
+        self.is_active = is_active
+
+class LiveGame:
+    """In-memory view of an unfinished Game, its current GameRound and its players."""
+
+    def __init__(self, game_id: int, chat_id: int, state: int, current_round: int,
+                 round_id: Optional[int] = None, round_number: Optional[int] = None,
+                 round_state: Optional[int] = None, players: Iterable[LivePlayer] = (),
+                 next_phase: Optional[str] = None, phase_deadline: Optional[datetime.datetime] = None,
+                 phase_started_at: Optional[datetime.datetime] = None):
+        self.game_id = game_id
+        self.chat_id = chat_id
+        self.state = state
+        self.current_round = current_round
+        self.round_id = round_id
+        self.round_number = round_number
+        self.round_state = round_state
+        self.next_phase = next_phase
+        self.phase_deadline = phase_deadline
+        self.phase_started_at = phase_started_at  # When the round entered round_state (UTC)
+        self.players: Dict[int, LivePlayer] = {player.player_id: player for player in players}
+        self.players_by_telegram_id: Dict[int, LivePlayer] = {
+            player.telegram_id: player for player in self.players.values()
+        }
+
+    def active_players(self) -> List[LivePlayer]:
+        """Players still in the game, in join order."""
+        return [player for player in self.players.values() if player.is_active]
+
+    def player_for_telegram_id(self, telegram_id: int) -> Optional[LivePlayer]:
+        return self.players_by_telegram_id.get(telegram_id)
+
+class GameStateStore:
+    """
+    Process-local, authoritative state of every live game.
+
+    Lookups by chat, game, round and player are dictionary hits. Inserts that need
+    a primary key still go to the database synchronously, but state changes
+    (game/round state, eliminations, round counters, finish times) are applied in
+    memory and written behind in batches by a background thread. `stop` flushes
+    everything, so pending writes survive a clean shutdown.
+    """
+
+    def __init__(self, flush_interval: float = 1.0):
+        self._flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._by_chat: Dict[int, LiveGame] = {}
+        self._by_game: Dict[int, LiveGame] = {}
+        self._by_round: Dict[int, LiveGame] = {}
+        self._by_user: Dict[int, LiveGame] = {}
+
+        # (model, primary key) -> column values waiting to be written
+        self._pending: Dict[Tuple[type, int], Dict[str, object]] = {}
+        self._flush_lock = threading.Lock()
+        self._flush_hooks: List[Callable[[], None]] = []
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._running = False
+
+        metrics.gauge('state_store.live_games', lambda: len(self._by_game))
+        metrics.gauge('state_store.pending_writes', lambda: len(self._pending))
+
+    # Lookups
+
+    def game_for_chat(self, chat_id: int) -> Optional[LiveGame]:
+        return self._by_chat.get(chat_id)
+
+    def game(self, game_id: int) -> Optional[LiveGame]:
+        return self._by_game.get(game_id)
+
+    def game_for_round(self, round_id: int) -> Optional[LiveGame]:
+        return self._by_round.get(round_id)
+
+    def game_for_user(self, telegram_id: int) -> Optional[LiveGame]:
+        """The live game a Telegram user is playing in, if any."""
+        return self._by_user.get(telegram_id)
+
+    def games(self) -> List[LiveGame]:
+        with self._lock:
+            return list(self._by_game.values())
+
+    # Mutations
+
+    def put_game(self, game: LiveGame) -> None:
+        """Register a game that has just been written to the database."""
+        with self._lock:
+            self._by_chat[game.chat_id] = game
+            self._by_game[game.game_id] = game
+            if game.round_id is not None:
+                self._by_round[game.round_id] = game
+            for player in game.players.values():
+                self._by_user[player.telegram_id] = game
+
+    def set_state(self, game_id: int, state: int) -> None:
+        """Move a game and its current round to `state`."""
+        now = datetime.datetime.utcnow()
+        with self._lock:
+            game = self._by_game.get(game_id)
+            if not game:
+                return
+            game.state = state
+            game.round_state = state
+            game.phase_started_at = now
+            self._write(Game, game_id, state=state)
+            if game.round_id is not None:
+                self._write(GameRound, game.round_id, state=state)
+                # Phases whose player latency is measured keep their start time
+                if state == GAME_STATES['CREATIVE']:
+                    self._write(GameRound, game.round_id, creative_started_at=now)
+                elif state == GAME_STATES['VOTING']:
+                    self._write(GameRound, game.round_id, voting_started_at=now)
+
+    def start_round(self, game_id: int, round_id: int, round_number: int, state: int) -> None:
+        """Make a freshly inserted GameRound the game's current round."""
+        with self._lock:
+            game = self._by_game.get(game_id)
+            if not game:
+                return
+            if game.round_id is not None:
+                self._by_round.pop(game.round_id, None)
+            game.round_id = round_id
+            game.round_number = round_number
+            game.round_state = state
+            game.current_round = round_number
+            game.state = state
+            game.phase_started_at = datetime.datetime.utcnow()
+            self._by_round[round_id] = game
+            self._write(Game, game_id, current_round=round_number, state=state)
+
+    def set_phase(self, game_id: int, phase: Optional[str], deadline: Optional[datetime.datetime]) -> None:
+        """Record the game's pending phase transition so it survives a restart."""
+        with self._lock:
+            game = self._by_game.get(game_id)
+            if not game:
+                return
+            game.next_phase = phase
+            game.phase_deadline = deadline
+            self._write(Game, game_id, next_phase=phase, phase_deadline=deadline)
+
+    def finish_round(self, game_id: int, finished_at: datetime.datetime) -> None:
+        with self._lock:
+            game = self._by_game.get(game_id)
+            if game and game.round_id is not None:
+                self._write(GameRound, game.round_id, finished_at=finished_at)
+
+    def deactivate_player(self, game_id: int, player_id: int) -> None:
+        """Mark a player as eliminated."""
+        with self._lock:
+            game = self._by_game.get(game_id)
+            if not game or player_id not in game.players:
+                return
+            game.players[player_id].is_active = False
+            self._write(GamePlayer, player_id, is_active=False)
+
+    def finish_game(self, game_id: int, state: int, finished_at: datetime.datetime) -> None:
+        """Drop a game from the live indexes and persist its final state."""
+        with self._lock:
+            game = self._by_game.pop(game_id, None)
+            if not game:
+                return
+            if self._by_chat.get(game.chat_id) is game:
+                del self._by_chat[game.chat_id]
+            if game.round_id is not None:
+                self._by_round.pop(game.round_id, None)
+            released = []
+            for player in game.players.values():
+                if self._by_user.get(player.telegram_id) is game:
+                    del self._by_user[player.telegram_id]
+                    released.append(player.telegram_id)
+            self._write(Game, game_id, state=state, finished_at=finished_at, next_phase=None, phase_deadline=None)
+
+        # Their DMs no longer belong to this chat's worker, nor the chat to this game
+        for telegram_id in released:
+            claim_player(telegram_id, None)
+        state_backend.release_chat(game.chat_id, game_id)
+
+    def _write(self, model: type, pk: int, **values) -> None:
+        self._pending.setdefault((model, pk), {}).update(values)
+
+    # Persistence
+
+    def load(self, owns: Optional[Callable[[int], bool]] = None) -> int:
+        """
+        Rebuild the live indexes from all unfinished games in the database.
+
+        Args:
+            owns: Only load games of the chats this returns True for (the
+                chats of this process's shard)
+
+        Returns:
+            Number of games loaded
+        """
+        return sum(self._load_shard(shard, owns) for shard in storage_shards())
+
+    def _load_shard(self, shard: Optional[int], owns: Optional[Callable[[int], bool]]) -> int:
+        session = get_session(shard=shard)
+        try:
+            games = session.query(Game).filter(Game.finished_at.is_(None)).all()
+            if owns is not None:
+                games = [game for game in games if owns(game.chat_id)]
+            game_ids = [game.id for game in games]
+            if not game_ids:
+                return 0
+
+            latest_round_ids = session.query(func.max(GameRound.id)) \
+                .filter(GameRound.game_id.in_(game_ids)) \
+                .group_by(GameRound.game_id)
+            rounds = {
+                game_round.game_id: game_round
+                for game_round in session.query(GameRound).filter(GameRound.id.in_(latest_round_ids)).all()
+            }
+
+            players = {
+                game_id: [
+                    LivePlayer(player.id, player.user.id, player.user.user_id, player.user.first_name,
+                               player.role, player.is_active)
+                    for player in game_players if player.user
+                ]
+                for game_id, game_players in get_players_for_games(session, game_ids).items()
+            }
+
+            for game in games:
+                game_round = rounds.get(game.id)
+                phase_started_at = None
+                if game_round and game_round.state == GAME_STATES['CREATIVE']:
+                    phase_started_at = game_round.creative_started_at
+                elif game_round and game_round.state == GAME_STATES['VOTING']:
+                    phase_started_at = game_round.voting_started_at
+                self.put_game(LiveGame(
+                    game_id=game.id,
+                    chat_id=game.chat_id,
+                    state=game.state,
+                    current_round=game.current_round,
+                    round_id=game_round.id if game_round else None,
+                    round_number=game_round.round_number if game_round else None,
+                    round_state=game_round.state if game_round else None,
+                    players=players.get(game.id, []),
+                    next_phase=game.next_phase,
+                    phase_deadline=game.phase_deadline,
+                    phase_started_at=phase_started_at
+                ))
+            return len(games)
+        finally:
+            session.close()
+
+    def add_flush_hook(self, hook: Callable[[], None]) -> None:
+        """Run `hook` after every write-behind flush (used by other write-behind buffers)."""
+        self._flush_hooks.append(hook)
+
+    def flush(self) -> None:
+        """Write all pending changes in one transaction (one per shard file when storage is sharded)."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+
+            # With sharded storage each shard file gets its own transaction
+            shards: Dict[Optional[int], Dict[Tuple[type, int], Dict[str, object]]] = {}
+            for (model, pk), values in pending.items():
+                shards.setdefault(row_shard(pk), {})[(model, pk)] = values
+            for shard, shard_pending in shards.items():
+                self._flush_shard(shard, shard_pending)
+
+        for hook in self._flush_hooks:
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"Error in flush hook: {e}")
+
+    def _flush_shard(self, shard: Optional[int], pending: Dict[Tuple[type, int], Dict[str, object]]) -> None:
+        # Group rows by model and column set so each group is one executemany
+        batches: Dict[Tuple[type, frozenset], List[Dict[str, object]]] = {}
+        for (model, pk), values in pending.items():
+            batches.setdefault((model, frozenset(values)), []).append(dict(values, id=pk))
+
+        session = get_session(shard=shard)
+        try:
+            for (model, _), rows in batches.items():
+                session.execute(update(model), rows)
+            session.commit()
+            metrics.counter('state_store.flushed_rows').inc(len(pending))
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error flushing game state: {e}")
+            # Put the batch back underneath anything written since
+            with self._lock:
+                for key, values in pending.items():
+                    self._pending[key] = dict(values, **self._pending.get(key, {}))
+        finally:
+            session.close()
+
+    def start(self) -> None:
+        """Start the background flusher."""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='state-store-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """Stop the flusher and write out everything still pending."""
+        if self._running:
+            self._running = False
+            self._wakeup.set()
+            self._thread.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while self._running:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+# Process-wide store shared by all handlers
+store = GameStateStore(flush_interval=STATE_FLUSH_INTERVAL)
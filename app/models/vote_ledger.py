@@ -0,0 +1,232 @@
+import datetime
+import logging
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from app.models.database import get_session, row_shard, Vote
+from app.models.repository import upsert
+from app.models.state_backend import StateBackend, state_backend
+from app.models.state_store import store, LivePlayer
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Results of VoteLedger.cast
+VOTE_RECORDED = 'recorded'
+VOTE_CLOSED = 'closed'
+VOTE_NOT_A_VOTER = 'not_a_voter'
+VOTE_BAD_TARGET = 'bad_target'
+VOTE_SELF = 'self'
+
+class Tally(NamedTuple):
+    counts: Dict[int, int]  # target player id -> votes
+    voted_at: List[datetime.datetime]  # when each vote was cast
+
+def to_timestamp(moment: datetime.datetime) -> float:
+    """UTC timestamp of a naive UTC datetime."""
+    return moment.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+def from_timestamp(timestamp: float) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).replace(tzinfo=None)
+
+class RoundBallot:
+    """Voter/target indexes of one round, kept in the state backend and cached per process."""
+
+    def __init__(self, round_id: int, game_id: int, voters: Dict[int, int], targets: Dict[int, str]):
+        self.round_id = round_id
+        self.game_id = game_id
+        self.voters = voters  # telegram id -> player id
+        self.targets = targets  # player id -> display name
+
+    @classmethod
+    def for_players(cls, round_id: int, game_id: int, players: Iterable[LivePlayer]) -> 'RoundBallot':
+        players = list(players)
+        return cls(round_id, game_id,
+                   {player.telegram_id: player.player_id for player in players},
+                   {player.player_id: player.first_name for player in players})
+
+    def to_dict(self) -> dict:
+        return {'game_id': self.game_id, 'voters': self.voters, 'targets': self.targets}
+
+    @classmethod
+    def from_dict(cls, round_id: int, data: dict) -> 'RoundBallot':
+        # JSON object keys come back as strings
+        return cls(round_id, data['game_id'],
+                   {int(telegram_id): player_id for telegram_id, player_id in data['voters'].items()},
+                   {int(player_id): name for player_id, name in data['targets'].items()})
+
+class VoteLedger:
+    """
+    Per-round vote ledger for the vote callback hot path.
+
+    Votes live in the state backend, so any process serving the bot can take
+    them. `cast` validates voter, target and round against the ballot's
+    indexes (cached after the first lookup) and records the vote with one
+    atomic backend call, without touching the database. Votes cast by this
+    process are persisted in batches by `flush` (run after every state store
+    flush), and `close_round` persists the whole round before returning its
+    tally.
+    """
+
+    def __init__(self, backend: StateBackend):
+        self._backend = backend
+        self._ballots: Dict[int, RoundBallot] = {}
+        self._counts: Dict[int, int] = {}  # round id -> votes cast as of the last vote seen here
+        self._dirty: Dict[Tuple[int, int], Tuple[int, datetime.datetime]] = {}  # (round, voter) -> vote
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        metrics.gauge('votes.open_rounds', lambda: len(self._ballots))
+
+    def open_round(self, round_id: int, game_id: int, players: Iterable[LivePlayer],
+                   votes: Optional[Dict[int, Tuple[int, datetime.datetime]]] = None) -> None:
+        """
+        Start accepting votes for a round.
+
+        Args:
+            round_id: Round ID
+            game_id: Game ID
+            players: Active players, who are both the voters and the possible targets
+            votes: Votes already stored in the database (voter -> (target, voted_at)), e.g. after a restart
+        """
+        ballot = RoundBallot.for_players(round_id, game_id, players)
+        self._backend.open_ballot(round_id, ballot.to_dict(), {
+            voter_id: (target_id, to_timestamp(voted_at)) for voter_id, (target_id, voted_at) in (votes or {}).items()
+        })
+        with self._lock:
+            self._ballots[round_id] = ballot
+            self._counts[round_id] = len(votes or {})
+
+    def _ballot(self, round_id: int) -> Optional[RoundBallot]:
+        ballot = self._ballots.get(round_id)
+        if ballot is None:
+            data = self._backend.ballot(round_id)
+            if data is None:
+                return None
+            ballot = RoundBallot.from_dict(round_id, data)
+            with self._lock:
+                self._ballots[round_id] = ballot
+        return ballot
+
+    def _forget(self, round_id: int) -> None:
+        with self._lock:
+            self._ballots.pop(round_id, None)
+            self._counts.pop(round_id, None)
+
+    def cast(self, round_id: int, telegram_id: int, target_id: int) -> Tuple[str, Optional[str]]:
+        """
+        Record (or change) a vote.
+
+        Returns:
+            Tuple of (VOTE_* status, target display name)
+        """
+        ballot = self._ballot(round_id)
+        if ballot is None:
+            return VOTE_CLOSED, None
+
+        voter_id = ballot.voters.get(telegram_id)
+        if voter_id is None:
+            return VOTE_NOT_A_VOTER, None
+
+        target_name = ballot.targets.get(target_id)
+        if target_name is None:
+            return VOTE_BAD_TARGET, None
+
+        if voter_id == target_id:
+            return VOTE_SELF, None
+
+        voted_at = datetime.datetime.utcnow()
+        count = self._backend.cast_vote(round_id, voter_id, target_id, to_timestamp(voted_at))
+        if count is None:
+            self._forget(round_id)
+            return VOTE_CLOSED, None
+
+        with self._lock:
+            self._dirty[(round_id, voter_id)] = (target_id, voted_at)
+            self._counts[round_id] = count
+
+        metrics.counter('votes.cast').inc()
+        return VOTE_RECORDED, target_name
+
+    def completed(self, round_id: int) -> Optional[int]:
+        """Game ID of the round if every voter had voted as of the last vote seen here, otherwise None."""
+        ballot = self._ballots.get(round_id)
+        if ballot is None or self._counts.get(round_id, 0) < len(ballot.voters):
+            return None
+        return ballot.game_id
+
+    def close_round(self, round_id: int) -> Optional[Tally]:
+        """
+        Stop accepting votes, persist the round and return its tally.
+
+        Returns:
+            Vote count per target player id and the vote times, or None if the
+            round has no open ballot
+        """
+        votes = self._close(round_id)
+        if votes is None:
+            return None
+
+        tally = Tally({}, [])
+        for target_id, voted_at in votes.values():
+            tally.counts[target_id] = tally.counts.get(target_id, 0) + 1
+            tally.voted_at.append(voted_at)
+        return tally
+
+    def discard_round(self, round_id: int) -> None:
+        """Forget a round without tallying it (e.g. the game was ended)."""
+        self._close(round_id)
+
+    def _close(self, round_id: int) -> Optional[Dict[int, Tuple[int, datetime.datetime]]]:
+        """Close the ballot and persist all of its votes, wherever they were cast."""
+        stored = self._backend.close_ballot(round_id)
+        self._forget(round_id)
+        if stored is None:
+            return None
+
+        votes = {voter_id: (target_id, from_timestamp(voted_at)) for voter_id, (target_id, voted_at) in stored.items()}
+        with self._lock:
+            for voter_id in votes:
+                self._dirty.pop((round_id, voter_id), None)
+        self._persist({(round_id, voter_id): vote for voter_id, vote in votes.items()})
+        return votes
+
+    def flush(self) -> None:
+        """Persist every vote cast here since the last flush."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        # With sharded storage, each shard file gets its own transaction
+        shards: Dict[Optional[int], Dict[Tuple[int, int], Tuple[int, datetime.datetime]]] = {}
+        for (round_id, voter_id), vote in dirty.items():
+            shards.setdefault(row_shard(round_id), {})[(round_id, voter_id)] = vote
+        for votes in shards.values():
+            self._persist(votes)
+
+    def _persist(self, votes: Dict[Tuple[int, int], Tuple[int, datetime.datetime]]) -> None:
+        """Upsert votes that all live in the same shard."""
+        rows = [{"round_id": round_id, "voter_id": voter_id, "target_id": target_id, "voted_at": voted_at}
+                for (round_id, voter_id), (target_id, voted_at) in votes.items()]
+        if not rows:
+            return
+
+        with self._flush_lock:
+            session = get_session(shard=row_shard(rows[0]["round_id"]))
+            try:
+                # Any process may persist a voter's first or changed vote, and a late
+                # flush of an older vote must not overwrite a newer one
+                upsert(session, Vote, rows, key=['round_id', 'voter_id'],
+                       update_columns=['target_id', 'voted_at'], newer_column='voted_at')
+                session.commit()
+                metrics.counter('votes.persisted').inc(len(rows))
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Error persisting votes: {e}")
+                # Keep them for the next flush, unless a newer vote replaced them meanwhile
+                with self._lock:
+                    for key, vote in votes.items():
+                        self._dirty.setdefault(key, vote)
+            finally:
+                session.close()
+
+# Process-wide ledger shared by the voting handlers
+vote_ledger = VoteLedger(state_backend)
+store.add_flush_hook(vote_ledger.flush)
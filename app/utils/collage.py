@@ -0,0 +1,104 @@
+"""
+Contact-sheet rendering of round drawings.
+
+This module only depends on Pillow and the standard library because it is
+imported by the rendering worker processes.
+"""
+import io
+import math
+import mmap
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple, Union
+
+from PIL import Image, ImageDraw, ImageFont
+
+BACKGROUND = (255, 255, 255)
+PLACEHOLDER = (230, 230, 230)
+LABEL_COLOR = (20, 20, 20)
+JPEG_QUALITY = 85
+
+def _draw_label(canvas: Image.Image, text: str, box: Tuple[int, int, int, int]) -> None:
+    """Draw `text` centered in `box`, scaling Pillow's built-in bitmap font up to the box height."""
+    font = ImageFont.load_default()
+    left, top, right, bottom = ImageDraw.Draw(canvas).textbbox((0, 0), text, font=font)
+    width, height = right - left, bottom - top
+    scale = max(1, (box[3] - box[1]) * 2 // 3 // max(height, 1))
+
+    mask = Image.new('L', (width, height), 0)
+    ImageDraw.Draw(mask).text((-left, -top), text, fill=255, font=font)
+    mask = mask.resize((width * scale, height * scale), Image.NEAREST)
+
+    x = box[0] + (box[2] - box[0] - mask.width) // 2
+    y = box[1] + (box[3] - box[1] - mask.height) // 2
+    canvas.paste(LABEL_COLOR, (x, y), mask)
+
+@contextmanager
+def _open_image(data: Union[bytes, str]) -> Iterator[Image.Image]:
+    """Open encoded image bytes, or a file path through a read-only memory map."""
+    if isinstance(data, bytes):
+        yield Image.open(io.BytesIO(data))
+        return
+    with open(data, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        yield Image.open(view)
+
+def render_collage(drawings: List[Tuple[str, Optional[Union[bytes, str]]]],
+                   tile_size: int = 320) -> Tuple[bytes, float, int]:
+    """
+    Composite drawings into one labeled grid image.
+
+    Args:
+        drawings: (label, encoded image or path of an image file) pairs in
+            reveal order; missing or undecodable images get a blank tile
+        tile_size: Edge of the square each drawing is fitted into, in pixels
+
+    Returns:
+        Tuple of (JPEG bytes, render seconds, peak memory in bytes). Peak memory
+        is the tracemalloc peak plus the canvas and the largest decoded drawing,
+        which Pillow allocates outside the Python heap.
+    """
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    try:
+        columns = max(1, math.ceil(math.sqrt(len(drawings))))
+        rows = max(1, math.ceil(len(drawings) / columns))
+        padding = max(2, tile_size // 32)
+        label_height = max(16, tile_size // 8)
+        cell_width = tile_size + padding
+        cell_height = tile_size + label_height + padding
+
+        canvas = Image.new('RGB', (columns * cell_width + padding, rows * cell_height + padding), BACKGROUND)
+        largest_decode = 0
+
+        for index, (label, data) in enumerate(drawings):
+            x = padding + (index % columns) * cell_width
+            y = padding + (index // columns) * cell_height
+
+            tile = None
+            if data:
+                try:
+                    with _open_image(data) as image:
+                        # Let the JPEG decoder downscale while decoding
+                        image.draft('RGB', (tile_size, tile_size))
+                        tile = image.convert('RGB')
+                    largest_decode = max(largest_decode, tile.width * tile.height * 3)
+                    tile.thumbnail((tile_size, tile_size))
+                except Exception:
+                    tile = None
+
+            if tile is None:
+                canvas.paste(PLACEHOLDER, (x, y, x + tile_size, y + tile_size))
+            else:
+                canvas.paste(tile, (x + (tile_size - tile.width) // 2, y + (tile_size - tile.height) // 2))
+
+            _draw_label(canvas, label, (x, y + tile_size, x + tile_size, y + tile_size + label_height))
+
+        output = io.BytesIO()
+        canvas.save(output, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+
+        _, traced_peak = tracemalloc.get_traced_memory()
+        peak_memory = traced_peak + canvas.width * canvas.height * 3 + largest_decode
+        return output.getvalue(), time.perf_counter() - started_at, peak_memory
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,92 @@
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, List
+
+from telegram import Bot
+
+from app.utils.outbound import outbound, PRIORITY_DM, PRIORITY_GROUP
+
+logger = logging.getLogger(__name__)
+
+class FanOut:
+    """
+    A batch of direct messages delivered concurrently.
+
+    Messages are queued on the shared outbound scheduler, whose worker pool sends
+    them in parallel (bounded by OUTBOUND_WORKERS and the global rate limit).
+    Once every message has settled, the callback registered with `on_complete`
+    receives the labels of the recipients that could not be reached.
+    """
+
+    def __init__(self, bot: Bot, priority: int = PRIORITY_DM):
+        self._bot = bot
+        self._priority = priority
+        self._failed: List[str] = []
+        self._remaining = 0
+        self._sealed = False
+        self._callback = None
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id: int, label: str, **kwargs) -> None:
+        """Queue a message to `chat_id`; `label` names the recipient in failure reports."""
+        with self._lock:
+            self._remaining += 1
+        future = outbound.send_message(self._bot, chat_id=chat_id, priority=self._priority, **kwargs)
+        future.add_done_callback(lambda f: self._settled(f, label))
+
+    def on_complete(self, callback: Callable[[List[str]], None]) -> None:
+        """
+        Register the completion callback; no more messages may be added afterwards.
+
+        Args:
+            callback: Called once with the labels of failed recipients (in any order)
+        """
+        with self._lock:
+            self._callback = callback
+            self._sealed = True
+            done = self._remaining == 0
+        if done:
+            self._complete()
+
+    def _settled(self, future: Future, label: str) -> None:
+        with self._lock:
+            if future.exception() is not None:
+                self._failed.append(label)
+            self._remaining -= 1
+            done = self._sealed and self._remaining == 0
+        if done:
+            self._complete()
+
+    def _complete(self) -> None:
+        try:
+            self._callback(list(self._failed))
+        except Exception as e:
+            logger.error(f"Error in fan-out completion callback: {e}")
+
+def report_undelivered(bot: Bot, chat_id: int, what: str) -> Callable[[List[str]], None]:
+    """
+    Build a fan-out completion callback posting one aggregated warning to the group.
+
+    Args:
+        bot: Bot used to send the warning
+        chat_id: Group chat of the game
+        what: What could not be delivered, e.g. "роли"
+
+    Returns:
+        Callback for FanOut.on_complete
+    """
+    def report(failed: List[str]) -> None:
+        if not failed:
+            return
+        outbound.send_message(
+            bot,
+            chat_id=chat_id,
+            priority=PRIORITY_GROUP,
+            text=(
+                f"⚠️ Не удалось отправить {what} игрокам: {', '.join(failed)}.\n"
+                "Убедитесь, что бот не заблокирован и вы начали с ним диалог."
+            )
+        )
+
+    return report
@@ -143,4 +143,22 @@ def check_game_end(player_roles: Dict[int, str]) -> Tuple[bool, str]:
         return True, "spy"
     
     # Game continues
-    return False, None 
\ No newline at end of file
+    return False, None 
+
+def format_duration(seconds: float) -> str:
+    """
+    Format a phase duration for announcements.
+    
+    Args:
+        seconds: Duration in seconds
+        
+    Returns:
+        Text like "1 мин 30 сек"
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    parts = []
+    if minutes:
+        parts.append(f"{minutes} мин")
+    if seconds or not minutes:
+        parts.append(f"{seconds} сек")
+    return " ".join(parts)
@@ -0,0 +1,235 @@
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from telegram.ext import CallbackContext
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Update classes, each run by its own pool of lanes
+CALLBACKS = 'callbacks'  # inline button presses (votes)
+COMMANDS = 'commands'  # commands and other group chat updates
+SUBMISSIONS = 'submissions'  # private messages answering tasks
+JOBS = 'jobs'  # phase transitions
+
+def update_class(update: object) -> str:
+    """Pool an update belongs to: CALLBACKS, COMMANDS or SUBMISSIONS."""
+    if getattr(update, 'callback_query', None) is not None:
+        return CALLBACKS
+    chat = getattr(update, 'effective_chat', None)
+    message = getattr(update, 'effective_message', None)
+    text = getattr(message, 'text', None) or ''
+    if chat is not None and chat.type == 'private' and not text.startswith('/'):
+        return SUBMISSIONS
+    return COMMANDS
+
+class LaneGroup:
+    """
+    Lanes shared by several LaneExecutors.
+
+    A key has one queue in the group whichever executor its tasks were
+    submitted to, so tasks of the same key run one at a time in submission
+    order across all of them, each on its own executor's threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lanes: Dict[Hashable, Deque[Tuple['LaneExecutor', Callable, tuple, dict, Future, float]]] = {}
+
+class LaneExecutor:
+    """
+    Actor-style executor: tasks submitted under the same key (a lane) run one at
+    a time in submission order, tasks of different lanes run in parallel.
+
+    Lanes share one thread pool. An idle lane holds no thread; a busy lane holds
+    one until its queue is empty or it has run `batch` tasks in a row, then
+    yields the thread so a single busy chat can't starve the others. A task
+    that hands its work off by returning a Future (a coroutine scheduled on the
+    asyncio runtime) keeps the lane until the Future completes, but not the thread. Executors
+    built on the same `group` share their lanes: when the next task of a lane
+    belongs to another executor, the lane moves over to that executor's pool.
+    Metrics are reported as `lanes.<name>.*`.
+    """
+
+    def __init__(self, name: str, workers: int = 8, batch: int = 16, group: Optional[LaneGroup] = None):
+        group = group or LaneGroup()
+        self._name = name
+        self._workers = workers
+        self._batch = batch
+        self._lanes = group.lanes
+        self._lock = group.lock
+        self._executor = None
+        self._handed_off = 0
+        self._settled = threading.Condition(group.lock)
+
+        self._wait = metrics.latency(f'lanes.{name}.wait')
+        self._tasks = metrics.counter(f'lanes.{name}.tasks')
+        metrics.gauge(f'lanes.{name}.active', lambda: len(self.backlog()))
+        metrics.gauge(f'lanes.{name}.backlog', lambda: sum(self.backlog().values()))
+        metrics.gauge(f'lanes.{name}.max_backlog', lambda: max(self.backlog().values(), default=0))
+
+    def submit(self, key: Hashable, func: Callable, *args, **kwargs) -> Future:
+        """
+        Queue `func(*args, **kwargs)` on the lane `key`.
+
+        Returns:
+            Future with the result (or exception) of the call
+        """
+        future = Future()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix=f'lane-{self._name}')
+            lane = self._lanes.get(key)
+            idle = lane is None
+            if idle:
+                lane = self._lanes[key] = deque()
+            lane.append((self, func, args, kwargs, future, time.monotonic()))
+            executor = self._executor
+
+        if idle:
+            executor.submit(self._drain, key)
+        return future
+
+    def backlog(self) -> Dict[Hashable, int]:
+        """Tasks of this executor waiting per busy lane (not counting the running one)."""
+        with self._lock:
+            backlog = {}
+            for key, lane in self._lanes.items():
+                waiting = sum(1 for task in lane if task[0] is self)
+                if waiting:
+                    backlog[key] = waiting
+            return backlog
+
+    def busiest(self, limit: int = 10) -> List[Tuple[Hashable, int]]:
+        """The `limit` lanes with the longest backlog, for inspection."""
+        return sorted(self.backlog().items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def stop(self) -> None:
+        """Run everything already queued, then release the threads."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        # Lanes waiting on handed-off work finish on the threads completing it
+        with self._settled:
+            self._settled.wait_for(lambda: not self._handed_off)
+
+    def _resume(self, key: Hashable) -> bool:
+        """Queue the lane for one of this executor's threads; False once it is shut down."""
+        with self._lock:
+            executor = self._executor
+        try:
+            if executor is not None:
+                executor.submit(self._drain, key)
+                return True
+        except RuntimeError:
+            pass
+        return False
+
+    def _drain(self, key: Hashable) -> None:
+        while True:
+            owner = self
+            for _ in range(self._batch):
+                with self._lock:
+                    lane = self._lanes[key]
+                    if not lane:
+                        # An empty lane is dropped, the next submit starts a new drain
+                        del self._lanes[key]
+                        return
+                    if lane[0][0] is not self:
+                        owner = lane[0][0]
+                        break
+                    _, func, args, kwargs, future, queued_at = lane.popleft()
+                if self._run(key, func, args, kwargs, future, queued_at):
+                    # Handed off: the lane resumes once the work completes
+                    return
+
+            # Requeue behind the other lanes waiting for a thread, or hand the lane
+            # to the executor its next task belongs to
+            if owner._resume(key):
+                return
+            if owner is not self:
+                owner._drain(key)
+                return
+            # Shutting down: finish the lane on this thread
+
+    def _run(self, key: Hashable, func: Callable, args: tuple, kwargs: dict, future: Future,
+             queued_at: float) -> bool:
+        """Run one task; True if it handed its work off and the lane now waits for it."""
+        self._wait.observe(time.monotonic() - queued_at)
+        self._tasks.inc()
+        if not future.set_running_or_notify_cancel():
+            return False
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Error in lane task {getattr(func, '__name__', func)}: {e}")
+            future.set_exception(e)
+            return False
+
+        if isinstance(result, Future):
+            with self._lock:
+                self._handed_off += 1
+            result.add_done_callback(functools.partial(self._handed_back, key, func, future))
+            return True
+        future.set_result(result)
+        return False
+
+    def _handed_back(self, key: Hashable, func: Callable, future: Future, result: Future) -> None:
+        try:
+            future.set_result(result.result())
+        except (Exception, CancelledError) as e:
+            logger.error(f"Error in lane task {getattr(func, '__name__', func)}: {e}")
+            future.set_exception(e)
+
+        # The next task of the lane, if any, goes back to a lane thread
+        if not self._resume(key):
+            self._drain(key)
+        with self._settled:
+            self._handed_off -= 1
+            self._settled.notify_all()
+
+class LaneDispatcher:
+    """
+    Compatibility shim so `register_handlers(dispatcher)` keeps working with lanes.
+
+    Wraps a python-telegram-bot Dispatcher: every handler added through
+    `add_handler` has its callback replaced by one that queues it on the lane
+    `key(update)` returns, in the pool of the update's class, and frees the
+    Dispatcher thread at once. Separate pools keep quick vote callbacks from
+    waiting behind a slow command; pools sharing a LaneGroup still run a
+    chat's updates one at a time in arrival order, whatever their class.
+    Updates with no lane (None) run directly. All other attributes are
+    forwarded untouched.
+    """
+
+    def __init__(self, dispatcher, pools: Dict[str, LaneExecutor], key: Callable[[object], Optional[Hashable]],
+                 classify: Callable[[object], str] = update_class):
+        self._dispatcher = dispatcher
+        self._pools = pools
+        self._key = key
+        self._classify = classify
+
+    def add_handler(self, handler, group: int = 0) -> None:
+        handler.callback = self._schedule(handler.callback)
+        self._dispatcher.add_handler(handler, group)
+
+    def _schedule(self, callback: Callable) -> Callable:
+
+        @functools.wraps(callback)
+        def dispatch(update: object, context: CallbackContext) -> Any:
+            key = self._key(update)
+            if key is None:
+                return callback(update, context)
+            self._pools[self._classify(update)].submit(key, callback, update, context)
+
+        return dispatch
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._dispatcher, name)
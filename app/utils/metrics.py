@@ -0,0 +1,123 @@
+import threading
+from collections import deque
+from typing import Callable, Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+class LatencyStats:
+    """
+    Rolling window of latency samples (in seconds) with percentile summaries.
+    """
+
+    def __init__(self, window: int = 2048):
+        self._samples = deque(maxlen=window)
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        """Record a single latency sample."""
+        with self._lock:
+            self._samples.append(seconds)
+            self._count += 1
+            self._total += seconds
+            if seconds > self._max:
+                self._max = seconds
+
+    def snapshot(self) -> Dict[str, float]:
+        """
+        Summarize the recorded samples.
+
+        Returns:
+            Dictionary with count, mean, p50, p95, p99 and max (percentiles over the window)
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total, maximum = self._count, self._total, self._max
+
+        if not samples:
+            return {"count": count, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": maximum}
+
+        def percentile(p: float) -> float:
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+        return {
+            "count": count,
+            "mean": total / count if count else 0.0,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": maximum,
+        }
+
+class Counter:
+    """
+    Thread-safe monotonically increasing counter.
+    """
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+# Registries of named metrics, shared by the whole process
+_latencies: Dict[str, LatencyStats] = {}
+_counters: Dict[str, Counter] = {}
+_gauges: Dict[str, Callable[[], float]] = {}
+_registry_lock = threading.Lock()
+
+def latency(name: str) -> LatencyStats:
+    """Get (or create) the latency summary registered under `name`."""
+    with _registry_lock:
+        if name not in _latencies:
+            _latencies[name] = LatencyStats()
+        return _latencies[name]
+
+def counter(name: str) -> Counter:
+    """Get (or create) the counter registered under `name`."""
+    with _registry_lock:
+        if name not in _counters:
+            _counters[name] = Counter()
+        return _counters[name]
+
+def gauge(name: str, read: Callable[[], float]) -> None:
+    """Register a callable that reports the current value of `name`."""
+    with _registry_lock:
+        _gauges[name] = read
+
+def snapshot() -> Dict[str, object]:
+    """
+    Collect the current value of every registered metric.
+
+    Returns:
+        Dictionary keyed by metric name
+    """
+    with _registry_lock:
+        latencies = dict(_latencies)
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    result: Dict[str, object] = {}
+    for name, stats in latencies.items():
+        result[name] = stats.snapshot()
+    for name, value in counters.items():
+        result[name] = value.value
+    for name, read in gauges.items():
+        try:
+            result[name] = read()
+        except Exception as e:
+            logger.error(f"Error reading gauge {name}: {e}")
+    return result
+
+def log_metrics(context: Optional[object] = None) -> None:
+    """Write a snapshot of all metrics to the log (usable as a repeating job)."""
+    logger.info(f"Metrics: {snapshot()}")
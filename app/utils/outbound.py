@@ -0,0 +1,310 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram import Bot
+from telegram.error import RetryAfter
+
+from app.config.config import OUTBOUND_GLOBAL_RATE, OUTBOUND_GROUP_RATE, OUTBOUND_GROUP_BURST
+from app.config.config import OUTBOUND_PRIVATE_RATE, OUTBOUND_PRIVATE_BURST, OUTBOUND_WORKERS
+from app.config.config import OUTBOUND_MAX_RETRIES
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, lower is sent first
+PRIORITY_GROUP = 0  # Announcements in the game chat
+PRIORITY_DM = 1  # Roles, tasks and ballots sent to players
+PRIORITY_REMINDER = 2  # Nudges that can wait
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second, holding at most `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        """Consume one token; call only after `delay` returned 0."""
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float) -> None:
+        """Hand out no tokens for `seconds` (used for Telegram's retry_after)."""
+        self.paused_until = max(self.paused_until, now + seconds)
+        # One token is available as soon as the pause ends
+        self.tokens = 1
+        self.updated_at = self.paused_until
+
+class OutboundMessage:
+    """A queued Bot API call."""
+
+    __slots__ = ('priority', 'seq', 'bot', 'chat_id', 'method', 'kwargs', 'future', 'enqueued_at', 'attempts')
+
+    def __init__(self, priority: int, seq: int, bot: Bot, chat_id: int, method: str, kwargs: Dict[str, Any]):
+        self.priority = priority
+        self.seq = seq
+        self.bot = bot
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+    def __lt__(self, other: 'OutboundMessage') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class OutboundScheduler:
+    """
+    Single rate-limited queue for every outgoing Bot API call.
+
+    Messages are ordered by priority class, then by submission order. A global
+    token bucket enforces Telegram's overall limit and a per-chat bucket enforces
+    the per-group and per-user limits. Each chat has at most one request in
+    flight so messages to the same chat keep their order. `retry_after` from a
+    429 response pauses the chat's bucket and re-queues the message.
+    """
+
+    def __init__(self, global_rate: float = 30, group_rate: float = 20 / 60, group_burst: float = 10,
+                 private_rate: float = 1, private_burst: float = 3, workers: int = 8, max_retries: int = 5):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._group_rate = group_rate
+        self._group_burst = group_burst
+        self._private_rate = private_rate
+        self._private_burst = private_burst
+        self._max_retries = max_retries
+        self._workers = workers
+
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._queues: Dict[int, List[OutboundMessage]] = {}  # chat_id -> heap of messages
+        self._ready: List[Tuple[int, int, int, int]] = []  # heap of (priority, seq, generation, chat_id)
+        self._ready_chats: Dict[int, int] = {}  # chat_id -> generation of its live ready entry
+        self._generations = itertools.count()
+        self._sleeping: List[Tuple[float, int]] = []  # heap of (wake_at, chat_id)
+        self._sleeping_chats = set()
+        self._in_flight = set()
+        self._depth = 0
+        self._seq = itertools.count()
+
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._running = False
+
+        metrics.gauge('outbound.queue_depth', lambda: self._depth)
+        metrics.gauge('outbound.in_flight', lambda: len(self._in_flight))
+
+    def start(self) -> None:
+        """Start the scheduling thread (idempotent)."""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='outbound')
+            self._thread = threading.Thread(target=self._run, name='outbound-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Wait up to `timeout` seconds for the queue to drain, then stop."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._depth or self._in_flight) and time.monotonic() < deadline:
+                self._cond.wait(min(0.5, deadline - time.monotonic()))
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._executor.shutdown(wait=True)
+            self._thread = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._depth
+
+    def submit(self, bot: Bot, method: str, chat_id: int, priority: int = PRIORITY_GROUP, **kwargs) -> Future:
+        """
+        Queue a Bot API call.
+
+        Args:
+            bot: Bot used to perform the request
+            method: Bot method name, e.g. 'send_message'
+            chat_id: Destination chat
+            priority: One of the PRIORITY_* classes
+            **kwargs: Arguments for the Bot method (without chat_id)
+
+        Returns:
+            Future resolved with the API result or the final error
+        """
+        if not self._running:
+            self.start()
+
+        message = OutboundMessage(priority, next(self._seq), bot, chat_id, method, kwargs)
+        with self._cond:
+            heapq.heappush(self._queues.setdefault(chat_id, []), message)
+            self._depth += 1
+            self._schedule_chat(chat_id, time.monotonic())
+            self._cond.notify()
+        return message.future
+
+    def send_message(self, bot: Bot, chat_id: int, priority: int = PRIORITY_GROUP, **kwargs) -> Future:
+        return self.submit(bot, 'send_message', chat_id, priority, **kwargs)
+
+    def send_photo(self, bot: Bot, chat_id: int, priority: int = PRIORITY_GROUP, **kwargs) -> Future:
+        return self.submit(bot, 'send_photo', chat_id, priority, **kwargs)
+
+    def send_media_group(self, bot: Bot, chat_id: int, priority: int = PRIORITY_GROUP, **kwargs) -> Future:
+        return self.submit(bot, 'send_media_group', chat_id, priority, **kwargs)
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # Group and supergroup ids are negative, private chats use the user id
+            if chat_id < 0:
+                bucket = TokenBucket(self._group_rate, self._group_burst)
+            else:
+                bucket = TokenBucket(self._private_rate, self._private_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _schedule_chat(self, chat_id: int, now: float) -> None:
+        """Put a chat with queued messages into the ready or sleeping set. Caller holds the lock."""
+        queue = self._queues.get(chat_id)
+        if not queue or chat_id in self._in_flight or chat_id in self._sleeping_chats:
+            return
+
+        delay = self._bucket(chat_id).delay(now)
+        if delay > 0:
+            self._ready_chats.pop(chat_id, None)
+            self._sleeping_chats.add(chat_id)
+            heapq.heappush(self._sleeping, (now + delay, chat_id))
+        else:
+            # Only the newest entry of a chat is live; older ones are skipped when they surface
+            generation = next(self._generations)
+            self._ready_chats[chat_id] = generation
+            head = queue[0]
+            heapq.heappush(self._ready, (head.priority, head.seq, generation, chat_id))
+
+    def _next_message(self, now: float) -> Tuple[Optional[OutboundMessage], float]:
+        """Pick the next sendable message, or how long to wait for one. Caller holds the lock."""
+        while self._sleeping and self._sleeping[0][0] <= now:
+            _, chat_id = heapq.heappop(self._sleeping)
+            self._sleeping_chats.discard(chat_id)
+            self._schedule_chat(chat_id, now)
+
+        wait = self._sleeping[0][0] - now if self._sleeping else 1.0
+
+        while self._ready:
+            _, _, generation, chat_id = self._ready[0]
+            if self._ready_chats.get(chat_id) != generation:
+                heapq.heappop(self._ready)
+                continue
+
+            global_delay = self._global.delay(now)
+            if global_delay > 0:
+                return None, min(wait, global_delay)
+
+            heapq.heappop(self._ready)
+            del self._ready_chats[chat_id]
+            self._global.take(now)
+            self._bucket(chat_id).take(now)
+            message = heapq.heappop(self._queues[chat_id])
+            if not self._queues[chat_id]:
+                del self._queues[chat_id]
+            self._depth -= 1
+            self._in_flight.add(chat_id)
+            return message, 0.0
+
+        return None, wait
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                message, wait = self._next_message(time.monotonic())
+                if message is None:
+                    self._cond.wait(wait)
+                    continue
+            try:
+                self._executor.submit(self._send, message)
+            except RuntimeError:
+                # Interpreter is shutting down without stop() having been called
+                return
+
+    def _send(self, message: OutboundMessage) -> None:
+        message.attempts += 1
+        started_at = time.monotonic()
+        try:
+            result = getattr(message.bot, message.method)(chat_id=message.chat_id, **message.kwargs)
+        except RetryAfter as e:
+            metrics.counter('outbound.retries').inc()
+            self._finish(message, retry_after=float(e.retry_after), error=e)
+            return
+        except Exception as e:
+            metrics.counter('outbound.failed').inc()
+            logger.error(f"Error in {message.method} to chat {message.chat_id}: {e}")
+            self._finish(message)
+            message.future.set_exception(e)
+            return
+
+        now = time.monotonic()
+        metrics.latency('outbound.api_latency').observe(now - started_at)
+        metrics.latency('outbound.send_latency').observe(now - message.enqueued_at)
+        self._finish(message)
+        message.future.set_result(result)
+
+    def _finish(self, message: OutboundMessage, retry_after: Optional[float] = None,
+                error: Optional[Exception] = None) -> None:
+        """Release the chat after a request and re-queue the message on flood control."""
+        give_up = False
+        with self._cond:
+            now = time.monotonic()
+            self._in_flight.discard(message.chat_id)
+            if retry_after is not None:
+                self._bucket(message.chat_id).pause(now, retry_after)
+                if message.attempts <= self._max_retries:
+                    heapq.heappush(self._queues.setdefault(message.chat_id, []), message)
+                    self._depth += 1
+                else:
+                    give_up = True
+            self._schedule_chat(message.chat_id, now)
+            self._cond.notify_all()
+
+        if give_up:
+            metrics.counter('outbound.failed').inc()
+            logger.error(f"Giving up on {message.method} to chat {message.chat_id} after {message.attempts} attempts")
+            message.future.set_exception(error)
+
+# Process-wide scheduler shared by all handlers
+outbound = OutboundScheduler(
+    global_rate=OUTBOUND_GLOBAL_RATE,
+    group_rate=OUTBOUND_GROUP_RATE,
+    group_burst=OUTBOUND_GROUP_BURST,
+    private_rate=OUTBOUND_PRIVATE_RATE,
+    private_burst=OUTBOUND_PRIVATE_BURST,
+    workers=OUTBOUND_WORKERS,
+    max_retries=OUTBOUND_MAX_RETRIES
+)
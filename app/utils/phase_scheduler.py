@@ -0,0 +1,252 @@
+import logging
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from telegram import Bot
+
+from app.config.config import PHASE_TICK, PHASE_JITTER, PHASE_WORKERS
+from app.utils import metrics
+from app.utils.lanes import LaneExecutor
+from app.utils.timing_wheel import TimingWheel, WheelTimer
+
+logger = logging.getLogger(__name__)
+
+class PhaseTimer:
+    """
+    A scheduled phase transition.
+
+    Exposes `context` like a PTB Job, so callbacks keep reading `context.job.context`.
+    """
+
+    __slots__ = ('callback', 'context', 'game_id', 'due', 'bot', '_wheel_timer')
+
+    def __init__(self, bot: Bot, callback: Callable, context: Any, game_id: Optional[int], due: float):
+        self.bot = bot
+        self.callback = callback
+        self.context = context
+        self.game_id = game_id
+        self.due = due  # time.monotonic() the callback should run at
+        self._wheel_timer: Optional[WheelTimer] = None
+
+    @property
+    def name(self) -> str:
+        return getattr(self.callback, '__name__', repr(self.callback))
+
+class PhaseContext:
+    """What a phase callback receives in place of a CallbackContext: `bot` and `job`."""
+
+    __slots__ = ('bot', 'job')
+
+    def __init__(self, bot: Bot, job: PhaseTimer):
+        self.bot = bot
+        self.job = job
+
+class PhaseScheduler:
+    """
+    Game phase timers on a hierarchical timing wheel.
+
+    Scheduling and cancelling are O(1), all timers of a game can be cancelled at
+    once, and an optional random delay (`jitter`, seconds) spreads transitions of
+    games started together. A single thread advances the wheel every `tick`
+    seconds and hands due callbacks to a small worker pool; how late each one
+    starts is recorded in the `phases.lateness` metric.
+    """
+
+    def __init__(self, tick: float = 0.1, jitter: float = 0.0, workers: int = 4):
+        self._tick = tick
+        self._jitter = jitter
+        self._workers = workers
+        self._origin = time.monotonic()
+        self._wheel = TimingWheel()
+        self._by_game: Dict[int, Set[PhaseTimer]] = {}
+        self._schedule_hooks: List[Callable[[PhaseTimer], None]] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._executor = None
+        self._lanes = None
+        self._running = False
+
+        metrics.gauge('phases.scheduled', lambda: len(self._wheel))
+
+    def start(self) -> None:
+        """Start the wheel thread (idempotent)."""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._wakeup.clear()
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='phase')
+            self._thread = threading.Thread(target=self._run, name='phase-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the wheel thread and wait for running callbacks; pending timers are dropped."""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+        self._wakeup.set()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        self._thread = None
+
+    def run_in_lanes(self, lanes: LaneExecutor) -> None:
+        """
+        Run callbacks on their chat's lane instead of the worker pool, so they
+        are serialized with the chat's updates. Timers without a `chat_id` in
+        their context use the lane of their game.
+        """
+        self._lanes = lanes
+
+    def add_schedule_hook(self, hook: Callable[[PhaseTimer], None]) -> None:
+        """Call `hook` with every newly scheduled timer (used to persist deadlines)."""
+        self._schedule_hooks.append(hook)
+
+    def run_once(self, bot: Bot, callback: Callable[[PhaseContext], None], delay: float,
+                 context: Any = None, game_id: Optional[int] = None) -> PhaseTimer:
+        """
+        Run `callback` once after `delay` seconds (plus jitter).
+
+        Args:
+            bot: Bot passed to the callback as `context.bot`
+            callback: Called with a PhaseContext
+            delay: Seconds from now
+            context: Data available to the callback as `context.job.context`
+            game_id: Game the timer belongs to, for `cancel_game`
+
+        Returns:
+            The scheduled timer
+        """
+        if self._jitter:
+            delay += random.uniform(0, self._jitter)
+        due = time.monotonic() + delay
+        timer = PhaseTimer(bot, callback, context, game_id, due)
+        timer._wheel_timer = WheelTimer(self._tick_at(due, math.ceil), timer)
+
+        with self._lock:
+            self._wheel.add(timer._wheel_timer)
+            if game_id is not None:
+                self._by_game.setdefault(game_id, set()).add(timer)
+
+        for hook in self._schedule_hooks:
+            try:
+                hook(timer)
+            except Exception as e:
+                logger.error(f"Error in schedule hook: {e}")
+
+        self.start()
+        return timer
+
+    def cancel(self, timer: PhaseTimer) -> bool:
+        """Cancel a timer; returns False if it already fired or was cancelled."""
+        with self._lock:
+            return self._cancel(timer)
+
+    def cancel_game(self, game_id: int) -> int:
+        """
+        Cancel every pending timer of a game.
+
+        Returns:
+            Number of timers cancelled
+        """
+        with self._lock:
+            timers = self._by_game.pop(game_id, set())
+            return sum(1 for timer in timers if self._cancel(timer))
+
+    def expedite(self, game_id: int, callback: Callable[[PhaseContext], None]) -> bool:
+        """
+        Run a game's pending `callback` timer now instead of at its deadline.
+
+        The timer is taken off the wheel under the scheduler lock, so its
+        callback runs exactly once even if the deadline or another expedite
+        races with this call.
+
+        Returns:
+            False if no such timer is pending (it already fired or was cancelled)
+        """
+        with self._lock:
+            for timer in self._by_game.get(game_id, ()):
+                if timer.callback is callback and self._wheel.cancel(timer._wheel_timer):
+                    self._unindex(timer)
+                    break
+            else:
+                return False
+            executor = self._executor
+
+        metrics.counter('phases.expedited').inc()
+        self._dispatch(executor, timer, True)
+        return True
+
+    def scheduled(self, game_id: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        Pending timers of a game (or all games), for inspection.
+
+        Returns:
+            (callback name, seconds until due) pairs, soonest first
+        """
+        now = time.monotonic()
+        with self._lock:
+            if game_id is not None:
+                timers = list(self._by_game.get(game_id, ()))
+            else:
+                timers = [timer for game_timers in self._by_game.values() for timer in game_timers]
+        return sorted((timer.name, timer.due - now) for timer in timers)
+
+    def _cancel(self, timer: PhaseTimer) -> bool:
+        if not self._wheel.cancel(timer._wheel_timer):
+            return False
+        self._unindex(timer)
+        metrics.counter('phases.cancelled').inc()
+        return True
+
+    def _unindex(self, timer: PhaseTimer) -> None:
+        game_timers = self._by_game.get(timer.game_id)
+        if game_timers is not None:
+            game_timers.discard(timer)
+            if not game_timers:
+                del self._by_game[timer.game_id]
+
+    def _tick_at(self, moment: float, rounding: Callable[[float], int]) -> int:
+        return rounding((moment - self._origin) / self._tick)
+
+    def _run(self) -> None:
+        while self._running:
+            now = time.monotonic()
+            with self._lock:
+                expired = self._wheel.advance(self._tick_at(now, math.floor))
+                for wheel_timer in expired:
+                    self._unindex(wheel_timer.payload)
+
+            for wheel_timer in expired:
+                try:
+                    self._dispatch(self._executor, wheel_timer.payload)
+                except RuntimeError:
+                    # Interpreter is shutting down without stop() having been called
+                    return
+
+            next_tick = self._origin + (self._tick_at(now, math.floor) + 1) * self._tick
+            self._wakeup.wait(max(0.0, next_tick - time.monotonic()))
+
+    def _dispatch(self, executor: ThreadPoolExecutor, timer: PhaseTimer, early: bool = False) -> None:
+        if self._lanes is None:
+            executor.submit(self._fire, timer, early)
+            return
+        context = timer.context if isinstance(timer.context, dict) else {}
+        self._lanes.submit(context.get('chat_id', ('game', timer.game_id)), self._fire, timer, early)
+
+    def _fire(self, timer: PhaseTimer, early: bool = False) -> None:
+        if not early:
+            metrics.latency('phases.lateness').observe(max(0.0, time.monotonic() - timer.due))
+        metrics.counter('phases.fired').inc()
+        try:
+            timer.callback(PhaseContext(timer.bot, timer))
+        except Exception as e:
+            logger.error(f"Error in phase callback {timer.name}: {e}")
+
+# Process-wide scheduler for game phase transitions
+phase_scheduler = PhaseScheduler(tick=PHASE_TICK, jitter=PHASE_JITTER, workers=PHASE_WORKERS)
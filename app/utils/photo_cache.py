@@ -0,0 +1,209 @@
+import logging
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+
+from telegram import Bot
+
+from app.config.config import PHOTO_CACHE_DIR, PHOTO_CACHE_MAX_BYTES, PHOTO_PREFETCH_WORKERS
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+class PhotoCache:
+    """
+    Size-bounded, content-addressed on-disk cache of Telegram photos.
+
+    Files are keyed by `file_unique_id`, which Telegram keeps stable for the
+    same content across bots and re-sends, and stored as <dir>/<2 chars>/<id>.
+    The least recently used files are evicted once the cache grows past
+    `max_bytes`. Reads are memory-mapped, so the page cache is shared with
+    anything else (e.g. collage workers) reading the same path.
+
+    The index lives in the process, so each process needs its own directory
+    (shard workers get a subdirectory each); a file removed from under it is
+    downloaded again on the next fetch.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, workers: int = 4):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._workers = workers
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()  # unique id -> size, oldest first
+        self._size = 0
+        self._downloads: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._loaded = False
+
+        self._hits = metrics.counter('photo_cache.hits')
+        self._misses = metrics.counter('photo_cache.misses')
+        self._bytes_served = metrics.counter('photo_cache.bytes_served')
+        metrics.gauge('photo_cache.hit_rate', self.hit_rate)
+        metrics.gauge('photo_cache.size_bytes', lambda: self._size)
+        metrics.gauge('photo_cache.files', lambda: len(self._entries))
+
+    def hit_rate(self) -> float:
+        lookups = self._hits.value + self._misses.value
+        return self._hits.value / lookups if lookups else 0.0
+
+    def path(self, unique_id: str) -> str:
+        return os.path.join(self._directory, unique_id[:2], unique_id)
+
+    def _load(self) -> None:
+        """Index files left by a previous run, least recently used first. Caller holds the lock."""
+        if self._loaded:
+            return
+        self._loaded = True
+        files = []
+        for root, _, names in os.walk(self._directory):
+            for name in names:
+                if name.startswith('.'):
+                    # Unfinished download of a previous run
+                    os.remove(os.path.join(root, name))
+                    continue
+                if os.path.join(root, name) != self.path(name):
+                    # Not laid out by this cache, e.g. in a shard worker's subdirectory
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._size += size
+        self._evict()
+
+    def _evict(self) -> None:
+        """Drop least recently used files until the cache fits. Caller holds the lock."""
+        while self._size > self._max_bytes and len(self._entries) > 1:
+            unique_id, size = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(self.path(unique_id))
+            except FileNotFoundError:
+                pass
+            metrics.counter('photo_cache.evictions').inc()
+
+    def _touch(self, unique_id: str) -> bool:
+        """Mark a file as just used; False if it isn't cached."""
+        with self._lock:
+            self._load()
+            if unique_id not in self._entries:
+                return False
+            self._entries.move_to_end(unique_id)
+        # The modification time carries the LRU order over restarts
+        try:
+            os.utime(self.path(unique_id))
+        except FileNotFoundError:
+            # Removed behind the cache's back: forget it, so the caller downloads it again
+            with self._lock:
+                size = self._entries.pop(unique_id, None)
+                if size is not None:
+                    self._size -= size
+            return False
+        return True
+
+    def put(self, unique_id: str, data: bytes) -> str:
+        """Store `data` under `unique_id` and return its path."""
+        path = self.path(unique_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a temporary name so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self._load()
+            self._size += len(data) - self._entries.pop(unique_id, 0)
+            self._entries[unique_id] = len(data)
+            self._evict()
+        return path
+
+    def read(self, unique_id: str) -> Optional[bytes]:
+        """Return the cached bytes, or None on a miss."""
+        if not self._touch(unique_id):
+            self._misses.inc()
+            return None
+        try:
+            with open(self.path(unique_id), 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                data = view[:]
+        except (FileNotFoundError, ValueError):
+            # Evicted meanwhile, or an empty file (which can't be mapped)
+            self._misses.inc()
+            return None
+        self._hits.inc()
+        self._bytes_served.inc(len(data))
+        return data
+
+    def fetch(self, bot: Bot, file_id: str, unique_id: str, count: bool = True) -> str:
+        """
+        Return the path of a cached photo, downloading it first on a miss.
+
+        Concurrent fetches of the same photo share one download.
+
+        Args:
+            bot: Bot used to download the file
+            file_id: Telegram file_id to download
+            unique_id: Telegram file_unique_id, the cache key
+            count: Whether the lookup counts towards the hit rate
+
+        Returns:
+            Path of the cached file
+        """
+        if self._touch(unique_id):
+            if count:
+                self._hits.inc()
+                self._bytes_served.inc(self._entries.get(unique_id, 0))
+            return self.path(unique_id)
+
+        with self._lock:
+            download = self._downloads.get(unique_id)
+            owner = download is None
+            if owner:
+                download = self._downloads[unique_id] = Future()
+
+        if not owner:
+            return download.result()
+
+        if count:
+            self._misses.inc()
+        try:
+            data = bytes(bot.get_file(file_id).download_as_bytearray())
+            path = self.put(unique_id, data)
+            download.set_result(path)
+            return path
+        except Exception as e:
+            download.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._downloads.pop(unique_id, None)
+
+    def prefetch(self, bot: Bot, file_id: str, unique_id: str) -> Future:
+        """Download a photo into the cache in the background."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='photo-prefetch')
+        # Prefetches warm the cache, they don't count towards its hit rate
+        future = self._executor.submit(self.fetch, bot, file_id, unique_id, False)
+
+        def log_failure(done: Future) -> None:
+            if done.exception() is not None:
+                logger.error(f"Error prefetching photo {unique_id}: {done.exception()}")
+
+        future.add_done_callback(log_failure)
+        return future
+
+    def stop(self) -> None:
+        """Wait for running prefetches."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+# Process-wide cache of submitted photos
+photo_cache = PhotoCache(PHOTO_CACHE_DIR, PHOTO_CACHE_MAX_BYTES, workers=PHOTO_PREFETCH_WORKERS)
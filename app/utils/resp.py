@@ -0,0 +1,218 @@
+"""
+Minimal client for the Redis serialization protocol (RESP2).
+
+Only what the state backend needs: commands, pipelines, MULTI/EXEC
+transactions and WATCH-based check-and-set over a small pool of blocking
+sockets.
+"""
+import socket
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple, Union
+from urllib.parse import urlparse
+
+from app.utils import metrics
+
+Reply = Union[None, int, bytes, str, list, 'RespError']
+
+class RespError(Exception):
+    """Error reply from the server."""
+
+class RespConnection:
+    """One socket to the server with a buffered reader."""
+
+    def __init__(self, host: str, port: int, timeout: float):
+        self._socket = socket.create_connection((host, port), timeout=timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._socket.makefile('rb')
+
+    def send(self, commands: Sequence[Sequence]) -> None:
+        self._socket.sendall(b''.join(encode(command) for command in commands))
+
+    def read(self) -> Reply:
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, body = line[:1], line[1:-2]
+        if kind == b'+':
+            return body.decode()
+        if kind == b'-':
+            return RespError(body.decode())
+        if kind == b':':
+            return int(body)
+        if kind == b'$':
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(body)
+            if length < 0:
+                return None
+            return [self.read() for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply type {kind!r}")
+
+    def close(self) -> None:
+        self._reader.close()
+        self._socket.close()
+
+def encode(command: Sequence) -> bytes:
+    """Encode a command as a RESP array of bulk strings."""
+    parts = [b'*%d\r\n' % len(command)]
+    for argument in command:
+        if isinstance(argument, bytes):
+            data = argument
+        elif isinstance(argument, str):
+            data = argument.encode()
+        else:
+            data = str(argument).encode()
+        parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+    return b''.join(parts)
+
+class RespClient:
+    """
+    Thread-safe client over a pool of up to `pool_size` connections.
+
+    `pipeline` sends a batch of commands in one write and reads all replies,
+    so a batch costs one network round trip; with `transaction=True` the batch
+    is wrapped in MULTI/EXEC and runs atomically on the server. Writes that
+    depend on a read go through `check_and_set` (WATCH, then MULTI/EXEC).
+    """
+
+    def __init__(self, url: str, pool_size: int = 8, timeout: float = 5.0):
+        parsed = urlparse(url)
+        self._host = parsed.hostname or 'localhost'
+        self._port = parsed.port or 6379
+        self._password = parsed.password
+        self._db = int(parsed.path.lstrip('/') or 0)
+        self._timeout = timeout
+        self._idle: List[RespConnection] = []
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self._round_trips = metrics.counter('resp.round_trips')
+
+    @contextmanager
+    def _connection(self) -> Iterator[RespConnection]:
+        with self._slots:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                connection = self._connect()
+            try:
+                yield connection
+            except BaseException:
+                # The stream may hold unread replies; never reuse it
+                connection.close()
+                raise
+            with self._lock:
+                self._idle.append(connection)
+
+    def _connect(self) -> RespConnection:
+        connection = RespConnection(self._host, self._port, self._timeout)
+        setup = []
+        if self._password:
+            setup.append(('AUTH', self._password))
+        if self._db:
+            setup.append(('SELECT', self._db))
+        if setup:
+            connection.send(setup)
+            for _ in setup:
+                reply = connection.read()
+                if isinstance(reply, RespError):
+                    connection.close()
+                    raise reply
+        return connection
+
+    def execute(self, *command) -> Reply:
+        """Run one command and return its reply (error replies are raised)."""
+        return self.pipeline([command])[0]
+
+    def pipeline(self, commands: Sequence[Sequence], transaction: bool = False) -> List[Reply]:
+        """
+        Run several commands in one round trip.
+
+        Args:
+            commands: Commands as sequences of arguments
+            transaction: Run them atomically inside MULTI/EXEC
+
+        Returns:
+            One reply per command; error replies are raised
+        """
+        if transaction:
+            commands = [('MULTI',)] + list(commands) + [('EXEC',)]
+        with self._connection() as connection:
+            replies = self._exchange(connection, commands)
+
+        if transaction:
+            replies = self._exec_replies(replies)
+            if replies is None:
+                raise RespError("Transaction aborted")
+        return self._raise_errors(replies)
+
+    def check_and_set(self, watch: Sequence, reads: Sequence[Sequence],
+                      build: Callable[[List[Reply]], Optional[Sequence[Sequence]]],
+                      attempts: int = 16) -> Tuple[List[Reply], Optional[List[Reply]]]:
+        """
+        Optimistic transaction: read, decide, then write only if nothing changed.
+
+        WATCHes the `watch` keys and runs `reads` in one round trip, then runs
+        the commands `build` makes of their replies in MULTI/EXEC. If another
+        client changed a watched key in between, the server drops the
+        transaction and the whole step starts over.
+
+        Args:
+            watch: Keys the decision depends on
+            reads: Commands whose replies `build` decides on
+            build: Returns the commands to run atomically, or None to write nothing
+            attempts: Tries before giving up
+
+        Returns:
+            Tuple of (replies of `reads`, replies of the written commands or None if none were built)
+        """
+        for _ in range(attempts):
+            with self._connection() as connection:
+                replies = self._raise_errors(self._exchange(connection, [('WATCH', *watch)] + list(reads)))[1:]
+                commands = build(replies)
+                if commands is None:
+                    self._raise_errors(self._exchange(connection, [('UNWATCH',)]))
+                    return replies, None
+                written = self._exec_replies(
+                    self._exchange(connection, [('MULTI',)] + list(commands) + [('EXEC',)])
+                )
+            if written is not None:
+                return replies, self._raise_errors(written)
+            metrics.counter('resp.retries').inc()
+        raise RespError(f"Transaction aborted {attempts} times")
+
+    def _exchange(self, connection: RespConnection, commands: Sequence[Sequence]) -> List[Reply]:
+        """Send commands in one write and read one reply per command."""
+        connection.send(commands)
+        replies = [connection.read() for _ in commands]
+        self._round_trips.inc()
+        return replies
+
+    @staticmethod
+    def _exec_replies(replies: List[Reply]) -> Optional[List[Reply]]:
+        """Results of a MULTI ... EXEC exchange, or None if the server aborted it."""
+        # MULTI's OK and the QUEUED acknowledgements precede EXEC's array of results
+        for reply in replies[:-1]:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies[-1]
+
+    @staticmethod
+    def _raise_errors(replies: List[Reply]) -> List[Reply]:
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+def decode(reply: Optional[bytes]) -> Optional[str]:
+    return reply.decode() if isinstance(reply, bytes) else reply
@@ -0,0 +1,235 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+
+from telegram import Bot, InputMediaPhoto
+from telegram.constants import MAX_CAPTION_LENGTH, MAX_MESSAGE_LENGTH
+from telegram.utils.helpers import escape_markdown
+
+from app.config.config import COLLAGE_WORKERS, COLLAGE_TILE_SIZE, COLLAGE_TIMEOUT
+from app.models.database import CreativeSubmission
+from app.utils import metrics
+from app.utils.collage import render_collage
+from app.utils.outbound import outbound
+from app.utils.photo_cache import photo_cache
+
+logger = logging.getLogger(__name__)
+
+# sendMediaGroup takes 2-10 items
+MAX_ALBUM_SIZE = 10
+
+def _truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+def _bold(text: str) -> str:
+    """Markdown bold `text`; a '*' can't be escaped inside the entity, so it is closed around it."""
+    return "*" + text.replace("*", "*\\**") + "*"
+
+def drawing_caption(number: int, submission: CreativeSubmission) -> str:
+    prefix = f"🖼 Рисунок #A{number}: "
+    return prefix + _bold(_truncate(submission.task, MAX_CAPTION_LENGTH - len(prefix) - 2))
+
+def text_entry(number: int, submission: CreativeSubmission) -> str:
+    # Truncated before escaping, so a cut never splits an escape; the limits count the text without markup
+    task = _truncate(submission.task, MAX_MESSAGE_LENGTH // 4)
+    prefix = f"📝 Описание #A{number}:\nЗадание: {task}\n\nОтвет: \""
+    content = _truncate(submission.content, MAX_MESSAGE_LENGTH - len(prefix) - 1)
+    return (
+        f"📝 Описание #A{number}:\n"
+        f"Задание: {_bold(task)}\n\n"
+        f"Ответ: \"{escape_markdown(content)}\""
+    )
+
+def split_evenly(items: List, size: int) -> List[List]:
+    """Split `items` into the fewest chunks of at most `size`, balanced so no album is left with one photo."""
+    if not items:
+        return []
+    count = -(-len(items) // size)
+    base, extra = divmod(len(items), count)
+    chunks, start = [], 0
+    for i in range(count):
+        end = start + base + (1 if i < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+def photo_albums(drawings: Iterable[Tuple[int, CreativeSubmission]]) -> List[List[InputMediaPhoto]]:
+    """
+    Pack numbered drawings into media group albums with per-photo captions.
+
+    Args:
+        drawings: (anonymous number, submission) pairs in reveal order
+
+    Returns:
+        Albums of at most MAX_ALBUM_SIZE photos; a single drawing gives a one-item album
+    """
+    media = [
+        InputMediaPhoto(media=submission.content, caption=drawing_caption(number, submission), parse_mode='Markdown')
+        for number, submission in drawings
+    ]
+    return split_evenly(media, MAX_ALBUM_SIZE)
+
+def text_digests(answers: Iterable[Tuple[int, CreativeSubmission]]) -> List[str]:
+    """
+    Merge numbered text answers into as few messages as the message length limit allows.
+
+    Args:
+        answers: (anonymous number, submission) pairs in reveal order
+
+    Returns:
+        Message texts, each at most MAX_MESSAGE_LENGTH characters
+    """
+    separator = "\n\n"
+    digests, current = [], ""
+    for number, submission in answers:
+        entry = text_entry(number, submission)
+        if current and len(current) + len(separator) + len(entry) > MAX_MESSAGE_LENGTH:
+            digests.append(current)
+            current = ""
+        current = current + separator + entry if current else entry
+    if current:
+        digests.append(current)
+    return digests
+
+def send_albums(bot: Bot, chat_id: int, drawings: Iterable[Tuple[int, CreativeSubmission]]) -> None:
+    """Queue numbered drawings to the chat as captioned albums."""
+    for album in photo_albums(drawings):
+        if len(album) == 1:
+            outbound.send_photo(
+                bot,
+                chat_id=chat_id,
+                photo=album[0].media,
+                caption=album[0].caption,
+                parse_mode='Markdown'
+            )
+        else:
+            outbound.send_media_group(bot, chat_id=chat_id, media=album)
+
+def send_text_digests(bot: Bot, chat_id: int, answers: Iterable[Tuple[int, CreativeSubmission]]) -> None:
+    """Queue numbered text answers to the chat as merged messages."""
+    for digest in text_digests(answers):
+        outbound.send_message(
+            bot,
+            chat_id=chat_id,
+            text=digest,
+            parse_mode='Markdown'
+        )
+
+def download_file(bot: Bot, file_id: str) -> bytes:
+    """Download a file through the Bot API (TELEGRAM_FILE_URL can point this at a local fake)."""
+    return bytes(bot.get_file(file_id).download_as_bytearray())
+
+def fetch_drawing(bot: Bot, submission: CreativeSubmission) -> Union[bytes, str]:
+    """Path of a drawing in the photo cache, or its bytes if the submission has no cache key."""
+    if submission.file_unique_id:
+        return photo_cache.fetch(bot, submission.content, submission.file_unique_id)
+    return download_file(bot, submission.content)
+
+class CollageRenderer:
+    """
+    Reveals a round's drawings as one rendered contact sheet.
+
+    Drawings are taken from the photo cache, downloaded on a thread pool if
+    they weren't prefetched, and composited in worker processes. The caller
+    waits at most `timeout` seconds for the collage, so the messages it
+    queues next follow it in the chat; if rendering fails or runs late the
+    drawings are sent as albums instead.
+    """
+
+    def __init__(self, workers: int = 2, tile_size: int = 320, timeout: float = 15.0, download_workers: int = 8,
+                 fetch: Optional[Callable[[Bot, CreativeSubmission], Union[bytes, str]]] = None):
+        self._workers = workers
+        self._tile_size = tile_size
+        self._timeout = timeout
+        self._download_workers = download_workers
+        self._fetch = fetch or fetch_drawing
+        self._processes = None
+        self._reveals = None
+        self._downloads = None
+        self._lock = threading.Lock()
+        self.last_render_time = 0.0
+        self.last_peak_memory = 0
+        metrics.gauge('collage.last_peak_memory', lambda: self.last_peak_memory)
+
+    def start(self) -> None:
+        """Create the worker pools (idempotent)."""
+        with self._lock:
+            if self._processes is not None:
+                return
+            # Spawned workers don't inherit the parent's threads and locks
+            self._processes = ProcessPoolExecutor(max_workers=self._workers,
+                                                  mp_context=multiprocessing.get_context('spawn'))
+            self._reveals = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='collage')
+            self._downloads = ThreadPoolExecutor(max_workers=self._download_workers,
+                                                 thread_name_prefix='collage-download')
+
+    def stop(self) -> None:
+        """Finish queued collages and shut the pools down."""
+        with self._lock:
+            pools = (self._reveals, self._downloads, self._processes)
+            self._processes = self._reveals = self._downloads = None
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+    def render(self, bot: Bot, drawings: List[Tuple[int, CreativeSubmission]]) -> bytes:
+        """
+        Fetch numbered drawings and render them into one JPEG (blocking).
+
+        Args:
+            bot: Bot used to download the files
+            drawings: (anonymous number, submission) pairs in reveal order
+
+        Returns:
+            Encoded collage
+        """
+        self.start()
+        downloads = [self._downloads.submit(self._fetch, bot, submission) for _, submission in drawings]
+
+        images = []
+        for (number, _), download in zip(drawings, downloads):
+            try:
+                images.append((f"A{number}", download.result()))
+            except Exception as e:
+                logger.error(f"Error downloading drawing #A{number}: {e}")
+                images.append((f"A{number}", None))
+
+        image, render_time, peak_memory = self._processes.submit(render_collage, images, self._tile_size).result()
+        metrics.latency('collage.render_time').observe(render_time)
+        self.last_render_time = render_time
+        self.last_peak_memory = peak_memory
+        logger.info(
+            f"Rendered collage of {len(images)} drawings in {render_time:.3f}s, "
+            f"peak memory {peak_memory / 2 ** 20:.1f} MiB"
+        )
+        return image
+
+    def reveal(self, bot: Bot, chat_id: int, drawings: Iterable[Tuple[int, CreativeSubmission]]) -> None:
+        """Queue the drawings as a collage, or as albums if it can't be rendered in time (blocking)."""
+        self.start()
+        drawings = list(drawings)
+        rendering = self._reveals.submit(self.render, bot, drawings)
+        try:
+            image = rendering.result(self._timeout)
+        except TimeoutError:
+            # A late collage would land after the discussion messages; its result is dropped
+            metrics.counter('collage.timed_out').inc()
+            logger.error(f"Collage for chat {chat_id} not rendered in {self._timeout:g}s, sending albums")
+            send_albums(bot, chat_id, drawings)
+            return
+        except Exception as e:
+            metrics.counter('collage.failed').inc()
+            logger.error(f"Error rendering collage for chat {chat_id}: {e}")
+            send_albums(bot, chat_id, drawings)
+            return
+
+        metrics.counter('collage.rendered').inc()
+        caption = "🖼 Рисунки раунда:\n" + "\n".join(
+            f"#A{number}: {submission.task}" for number, submission in drawings
+        )
+        outbound.send_photo(bot, chat_id=chat_id, photo=image, caption=_truncate(caption, MAX_CAPTION_LENGTH))
+
+# Process-wide renderer for REVEAL_MODE=collage
+collage_renderer = CollageRenderer(workers=COLLAGE_WORKERS, tile_size=COLLAGE_TILE_SIZE, timeout=COLLAGE_TIMEOUT)
@@ -0,0 +1,180 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable
+
+from telegram.ext import CallbackContext
+
+from app.config.config import ASYNC_IO_WORKERS
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+class AsyncRuntime:
+    """
+    Asyncio event loop running in a background thread.
+
+    In asyncio mode handlers run as coroutines on this loop, so a handler waiting
+    on I/O holds no thread. python-telegram-bot 13, SQLAlchemy and the state
+    backend client are blocking, so handlers await their calls through
+    `run_blocking`, which runs them on a separately sized executor; Bot API sends
+    go through the outbound scheduler and are not awaited at all.
+    """
+
+    def __init__(self, io_workers: int = 32):
+        self._io_workers = io_workers
+        self._loop = None
+        self._executor = None
+        self._thread = None
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        metrics.gauge('runtime.pending_tasks', lambda: self._pending)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        """Start the event loop thread."""
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self._io_workers, thread_name_prefix='async-io')
+        self._loop.set_default_executor(self._executor)
+        self._thread = threading.Thread(target=self._loop.run_forever, name='async-runtime', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop the loop after letting in-flight handlers finish for up to `timeout` seconds."""
+        if not self._thread:
+            return
+
+        async def drain() -> None:
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            if tasks:
+                await asyncio.wait(tasks, timeout=timeout)
+
+        asyncio.run_coroutine_threadsafe(drain(), self._loop).result(timeout + 1)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        self._loop.close()
+        self._thread = None
+
+    def submit(self, coro: Awaitable) -> Future:
+        """Schedule a coroutine on the loop from any thread."""
+        with self._pending_lock:
+            self._pending += 1
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        future.add_done_callback(self._task_done)
+        return future
+
+    def _task_done(self, future: Future) -> None:
+        with self._pending_lock:
+            self._pending -= 1
+
+    async def run_blocking(self, func: Callable, *args, **kwargs) -> Any:
+        """Await a blocking call on the I/O executor, from whichever loop is running."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+runtime = AsyncRuntime(io_workers=ASYNC_IO_WORKERS)
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """
+    Await a blocking call (database session, state backend, Bot API request).
+
+    In asyncio mode the call runs on the runtime's I/O executor and the loop keeps
+    serving other handlers meanwhile. In threaded mode the handler already owns
+    its thread, so the call simply runs inline.
+    """
+    if runtime.running:
+        return await runtime.run_blocking(func, *args, **kwargs)
+    return func(*args, **kwargs)
+
+# Event loop of each thread running coroutine handlers synchronously
+_thread_loops = threading.local()
+
+def _thread_loop() -> asyncio.AbstractEventLoop:
+    loop = getattr(_thread_loops, 'loop', None)
+    if loop is None:
+        loop = _thread_loops.loop = asyncio.new_event_loop()
+    return loop
+
+def coroutine_handler(func: Callable[[object, CallbackContext], Awaitable]) -> Callable:
+    """
+    Make an `async def` handler registrable on any dispatcher.
+
+    Called directly (the threaded Dispatcher, lanes), the returned callback runs
+    the coroutine to completion on the calling thread's own event loop.
+    AsyncDispatcher finds the coroutine function under `coroutine` and schedules
+    it on the runtime's loop instead.
+    """
+
+    @functools.wraps(func)
+    def run(update: object, context: CallbackContext) -> Any:
+        return _thread_loop().run_until_complete(func(update, context))
+
+    run.coroutine = func
+    return run
+
+def as_coroutine(runtime: AsyncRuntime, callback: Callable) -> Callable[..., Awaitable]:
+    """
+    Adapt a handler callback to a coroutine function.
+
+    Coroutine handlers are returned unwrapped; synchronous handlers are awaited
+    through the runtime's blocking executor.
+    """
+    coroutine = getattr(callback, 'coroutine', None)
+    if coroutine is not None:
+        return coroutine
+    if asyncio.iscoroutinefunction(callback):
+        return callback
+
+    @functools.wraps(callback)
+    async def run(update: object, context: CallbackContext) -> Any:
+        return await runtime.run_blocking(callback, update, context)
+
+    return run
+
+class AsyncDispatcher:
+    """
+    Compatibility shim so `register_handlers(dispatcher)` keeps working in asyncio mode.
+
+    Wraps a python-telegram-bot Dispatcher (or a LaneDispatcher): every handler
+    added through `add_handler` has its callback replaced by one that schedules
+    the handler as a coroutine on the runtime and returns its Future at once.
+    Lanes keep the chat's lane held until that Future completes, without holding
+    a thread. Wrap the other shims with this one, so that it sees the handlers
+    themselves. All other attributes are forwarded untouched.
+    """
+
+    def __init__(self, dispatcher, runtime: AsyncRuntime):
+        self._dispatcher = dispatcher
+        self._runtime = runtime
+
+    def add_handler(self, handler, group: int = 0) -> None:
+        handler.callback = self._schedule(handler.callback)
+        self._dispatcher.add_handler(handler, group)
+
+    def _schedule(self, callback: Callable) -> Callable:
+        coroutine_function = as_coroutine(self._runtime, callback)
+
+        @functools.wraps(callback)
+        def dispatch(update: object, context: CallbackContext) -> Future:
+            future = self._runtime.submit(coroutine_function(update, context))
+            future.add_done_callback(functools.partial(_log_failure, callback))
+            return future
+
+        return dispatch
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._dispatcher, name)
+
+def _log_failure(callback: Callable, future: Future) -> None:
+    """Report exceptions raised by a handler scheduled on the runtime."""
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logger.error(f"Error in async handler {callback.__name__}: {error}")
@@ -0,0 +1,208 @@
+import logging
+import multiprocessing
+import os
+import threading
+import zlib
+from multiprocessing.connection import Connection, wait
+from queue import Queue
+from typing import Callable, Dict, List, Optional, Tuple
+
+from telegram import Bot, Update
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Update fields holding a message, whose chat decides the owning shard
+MESSAGE_FIELDS = ('message', 'edited_message', 'channel_post', 'edited_channel_post')
+# Update fields holding a chat directly
+CHAT_FIELDS = ('my_chat_member', 'chat_member', 'chat_join_request')
+
+def shard_of(chat_id: int, shards: int) -> int:
+    """Shard owning a chat: a hash of its ID that is stable across processes and restarts."""
+    return zlib.crc32(str(chat_id).encode()) % shards
+
+def update_route(data: dict) -> Tuple[Optional[int], Optional[str], Optional[int]]:
+    """
+    Read where a raw update belongs without building an Update object.
+
+    Args:
+        data: Update as sent by the Bot API
+
+    Returns:
+        Tuple of (chat ID, chat type, sender ID); each is None if the update has none
+    """
+    for field in MESSAGE_FIELDS + CHAT_FIELDS:
+        if field in data:
+            body = data[field]
+            chat = body.get('chat') or {}
+            return chat.get('id'), chat.get('type'), (body.get('from') or {}).get('id')
+
+    if 'callback_query' in data:
+        query = data['callback_query']
+        chat = (query.get('message') or {}).get('chat') or {}
+        return chat.get('id'), chat.get('type'), (query.get('from') or {}).get('id')
+
+    # Inline queries, polls and the like: keyed by whoever sent them
+    for body in data.values():
+        if isinstance(body, dict) and 'from' in body:
+            return None, None, body['from'].get('id')
+    return None, None, None
+
+class ShardRouter:
+    """
+    Front process of a sharded bot.
+
+    Starts one worker process per shard and routes every incoming update to the
+    worker owning its chat (`shard_of`). Private messages have no game chat of
+    their own: workers report which chat's game each player is answering tasks
+    for (`claim_player`), and the player's DMs follow it to that worker. Other
+    private updates go to the shard of the private chat.
+
+    Also accepts `put(update)`, so it can stand in for a dispatcher's update queue.
+    """
+
+    def __init__(self, shards: int, target: Callable[[int, int, Connection], None],
+                 environ: Optional[Callable[[int], Dict[str, str]]] = None):
+        """
+        Args:
+            shards: Number of worker processes
+            target: Worker entry point, called as target(shard, shards, connection)
+                in a fresh (spawned) process
+            environ: Extra environment variables for each shard's process
+        """
+        self._shards = shards
+        self._target = target
+        self._environ = environ
+        self._processes: List[multiprocessing.Process] = []
+        self._connections: List[Connection] = []
+        self._send_locks = [threading.Lock() for _ in range(shards)]
+        self._players: Dict[int, int] = {}  # telegram user id -> chat of their current game
+        self._thread = None
+
+        self._routed = [metrics.counter(f'shards.{shard}.routed') for shard in range(shards)]
+        metrics.gauge('shards.players', lambda: len(self._players))
+
+    def start(self) -> None:
+        """Start the worker processes."""
+        context = multiprocessing.get_context('spawn')
+        for shard in range(self._shards):
+            front_end, worker_end = context.Pipe()
+            environ = self._environ(shard) if self._environ else {}
+            saved = {name: os.environ.get(name) for name in environ}
+            # Spawned processes inherit the environment at start()
+            os.environ.update(environ)
+            try:
+                process = context.Process(target=self._target, args=(shard, self._shards, worker_end),
+                                          name=f'shard-{shard}')
+                process.start()
+            finally:
+                for name, value in saved.items():
+                    if value is None:
+                        os.environ.pop(name, None)
+                    else:
+                        os.environ[name] = value
+            worker_end.close()
+            self._processes.append(process)
+            self._connections.append(front_end)
+
+        self._thread = threading.Thread(target=self._collect_claims, name='shard-claims', daemon=True)
+        self._thread.start()
+
+    def route(self, data: dict) -> int:
+        """
+        Send a raw update to the worker owning it.
+
+        Returns:
+            The shard it was sent to
+        """
+        chat_id, chat_type, user_id = update_route(data)
+        if chat_type in (None, 'private') and user_id is not None:
+            chat_id = self._players.get(user_id, chat_id if chat_id is not None else user_id)
+        shard = shard_of(chat_id, self._shards) if chat_id is not None else 0
+
+        with self._send_locks[shard]:
+            self._connections[shard].send(data)
+        self._routed[shard].inc()
+        return shard
+
+    def put(self, update: Update) -> None:
+        self.route(update.to_dict())
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Ask every worker to finish (they drain and persist their state), then wait for them."""
+        for shard, connection in enumerate(self._connections):
+            try:
+                with self._send_locks[shard]:
+                    connection.send(None)
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.error(f"Shard worker {process.name} did not stop in {timeout}s, terminating it")
+                process.terminate()
+        for connection in self._connections:
+            connection.close()
+
+    def _collect_claims(self) -> None:
+        connections = list(self._connections)
+        while connections:
+            for connection in wait(connections):
+                try:
+                    user_id, chat_id = connection.recv()
+                except (EOFError, OSError):
+                    connections.remove(connection)
+                    continue
+                if chat_id is None:
+                    self._players.pop(user_id, None)
+                else:
+                    self._players[user_id] = chat_id
+
+class ShardLink:
+    """Worker end of the front's pipe: routed updates come in, player claims go out."""
+
+    def __init__(self, shard: int, shards: int, connection: Connection):
+        self.shard = shard
+        self.shards = shards
+        self._connection = connection
+        self._lock = threading.Lock()
+
+    def owns(self, chat_id: int) -> bool:
+        """Whether a chat belongs to this worker."""
+        return shard_of(chat_id, self.shards) == self.shard
+
+    def claim(self, user_id: int, chat_id: Optional[int]) -> None:
+        """Route a player's private messages to the worker of `chat_id` (None releases the claim)."""
+        try:
+            with self._lock:
+                self._connection.send((user_id, chat_id))
+        except OSError as e:
+            logger.error(f"Error claiming player {user_id} for chat {chat_id}: {e}")
+
+    def receive(self, bot: Bot, update_queue: Queue) -> None:
+        """Feed routed updates into the dispatcher queue until the front stops this worker."""
+        while True:
+            try:
+                data = self._connection.recv()
+            except (EOFError, OSError):
+                return
+            if data is None:
+                return
+            update = Update.de_json(data, bot)
+            if update is not None:
+                update_queue.put(update)
+                metrics.counter('shards.received').inc()
+
+# Link of this process when it runs as a shard worker
+_worker_link: Optional[ShardLink] = None
+
+def join_shard(link: ShardLink) -> None:
+    """Mark this process as the worker behind `link`."""
+    global _worker_link
+    _worker_link = link
+
+def claim_player(user_id: int, chat_id: Optional[int]) -> None:
+    """Have the front route a player's DMs to this process, or release them with None (no-op unless sharded)."""
+    if _worker_link is not None:
+        _worker_link.claim(user_id, chat_id)
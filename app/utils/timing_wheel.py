@@ -0,0 +1,121 @@
+from typing import Any, Dict, List, Optional, Sequence
+
+class WheelTimer:
+    """A timer stored in a TimingWheel, expiring at tick `expires`."""
+
+    __slots__ = ('expires', 'payload', '_bucket')
+
+    def __init__(self, expires: int, payload: Any = None):
+        self.expires = expires
+        self.payload = payload
+        self._bucket: Optional[Dict[int, 'WheelTimer']] = None
+
+    @property
+    def pending(self) -> bool:
+        return self._bucket is not None
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel (as in the Linux kernel's classic timer wheel).
+
+    Level 0 has one slot per tick; every higher level has slots spanning a whole
+    revolution of the level below. Insert and cancel are O(1) dictionary
+    operations; advancing one tick expires a single slot and, once per revolution,
+    cascades one slot of the next level down. Not thread-safe: the owner locks.
+    """
+
+    def __init__(self, level_bits: Sequence[int] = (8, 6, 6, 6)):
+        self._bits = list(level_bits)
+        self._shifts = []
+        shift = 0
+        for bits in self._bits:
+            self._shifts.append(shift)
+            shift += bits
+        self._span = 1 << shift  # ticks covered by all levels together
+        self._wheels: List[List[Dict[int, WheelTimer]]] = [
+            [{} for _ in range(1 << bits)] for bits in self._bits
+        ]
+        self._now = 0
+        self._count = 0
+
+    @property
+    def now(self) -> int:
+        """Current tick."""
+        return self._now
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, timer: WheelTimer) -> WheelTimer:
+        """Schedule `timer`; timers already due expire on the next tick."""
+        self._place(timer, self._now + 1)
+        self._count += 1
+        return timer
+
+    def cancel(self, timer: WheelTimer) -> bool:
+        """Remove a pending timer; returns False if it already expired or was cancelled."""
+        if timer._bucket is None:
+            return False
+        del timer._bucket[id(timer)]
+        timer._bucket = None
+        self._count -= 1
+        return True
+
+    def advance(self, tick: int) -> List[WheelTimer]:
+        """
+        Move the wheel forward to `tick`.
+
+        Returns:
+            Timers that expired on the way, in expiry order
+        """
+        expired: List[WheelTimer] = []
+        while self._now < tick:
+            if not self._count:
+                # Nothing scheduled, skip straight to the target tick
+                self._now = tick
+                break
+            self._step(expired)
+        return expired
+
+    def _place(self, timer: WheelTimer, earliest: int) -> None:
+        expires = max(timer.expires, earliest)
+        delta = min(expires - self._now, self._span - 1)
+        for level, bits in enumerate(self._bits):
+            if delta < 1 << (self._shifts[level] + bits):
+                break
+        else:
+            level = len(self._bits) - 1
+        # Timers beyond the last level sit in its farthest slot and are re-placed on cascade
+        position = self._now + delta if expires - self._now > delta else expires
+        slot = (position >> self._shifts[level]) & ((1 << self._bits[level]) - 1)
+        bucket = self._wheels[level][slot]
+        bucket[id(timer)] = timer
+        timer._bucket = bucket
+
+    def _step(self, expired: List[WheelTimer]) -> None:
+        self._now += 1
+        now = self._now
+        if now & ((1 << self._bits[0]) - 1) == 0:
+            for level in range(1, len(self._bits)):
+                slot = (now >> self._shifts[level]) & ((1 << self._bits[level]) - 1)
+                self._cascade(level, slot)
+                if slot:
+                    break
+
+        slot = now & ((1 << self._bits[0]) - 1)
+        bucket = self._wheels[0][slot]
+        if bucket:
+            self._wheels[0][slot] = {}
+            for timer in bucket.values():
+                timer._bucket = None
+                expired.append(timer)
+            self._count -= len(bucket)
+
+    def _cascade(self, level: int, slot: int) -> None:
+        bucket = self._wheels[level][slot]
+        if not bucket:
+            return
+        self._wheels[level][slot] = {}
+        # Cascading happens before the current tick's slot expires, so timers due now still fire
+        for timer in bucket.values():
+            self._place(timer, self._now)
@@ -0,0 +1,199 @@
+import functools
+import hmac
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue
+from typing import Any, Callable, Optional
+
+from telegram import Bot, Update
+from telegram.ext import CallbackContext
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# Upper bound on ingest timestamps kept for updates no handler has finished yet
+MAX_TRACKED_UPDATES = 10000
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    """
+    Accepts Bot API webhook POSTs and hands the decoded updates to the dispatcher queue.
+    """
+
+    server: 'WebhookServer'
+
+    def do_POST(self) -> None:
+        if self.path != self.server.path:
+            self._respond(404)
+            return
+
+        if self.server.secret is not None:
+            token = self.headers.get(SECRET_HEADER, '')
+            if not hmac.compare_digest(token, self.server.secret):
+                metrics.counter('webhook.rejected').inc()
+                self._respond(403)
+                return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(length).decode('utf-8'))
+            update = Update.de_json(data, self.server.bot)
+        except (ValueError, UnicodeDecodeError) as e:
+            logger.error(f"Invalid webhook payload: {e}")
+            self._respond(400)
+            return
+
+        if update is None:
+            self._respond(400)
+            return
+
+        self.server.track_ingest(update.update_id)
+        self.server.update_queue.put(update)
+        metrics.counter('webhook.updates').inc()
+        self._respond(200)
+
+    def do_GET(self) -> None:
+        if self.path == '/healthz':
+            self._respond(200, b'ok', 'text/plain')
+        elif self.path == '/metrics':
+            body = json.dumps(metrics.snapshot(), default=str).encode('utf-8')
+            self._respond(200, body, 'application/json')
+        else:
+            self._respond(404)
+
+    def _respond(self, status: int, body: bytes = b'', content_type: str = 'text/plain') -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format % args)
+
+class WebhookServer(ThreadingHTTPServer):
+    """
+    Minimal webhook listener feeding updates straight into a dispatcher's update queue.
+
+    Unlike Updater.start_webhook in python-telegram-bot 13, this server validates the
+    secret token sent by Telegram and, once attached to the dispatcher, records
+    ingest-to-handler latency.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, bot: Bot, update_queue: Queue, listen: str, port: int,
+                 path: str, secret: Optional[str] = None):
+        super().__init__((listen, port), WebhookRequestHandler)
+        self.bot = bot
+        self.update_queue = update_queue
+        self.path = path if path.startswith('/') else f'/{path}'
+        self.secret = secret
+        self._ingest_times = OrderedDict()
+        self._ingest_lock = threading.Lock()
+        self._probed = False
+        self._thread = None
+
+    def track_ingest(self, update_id: int) -> None:
+        """Remember when an update arrived so handler latency can be measured."""
+        if not self._probed:
+            return
+        with self._ingest_lock:
+            self._ingest_times[update_id] = time.monotonic()
+            while len(self._ingest_times) > MAX_TRACKED_UPDATES:
+                self._ingest_times.popitem(last=False)
+
+    def observe_handled(self, update: object) -> None:
+        """
+        Record how long an update took from ingestion until its first handler returned.
+
+        Called by ProbedDispatcher after each handler; later handlers of the same update
+        find nothing left to record.
+        """
+        if not isinstance(update, Update):
+            return
+
+        with self._ingest_lock:
+            ingested_at = self._ingest_times.pop(update.update_id, None)
+
+        if ingested_at is not None:
+            metrics.latency('webhook.ingest_to_handler').observe(time.monotonic() - ingested_at)
+
+    def attach(self, dispatcher) -> 'ProbedDispatcher':
+        """
+        Time the handlers registered from now on.
+
+        Args:
+            dispatcher: Dispatcher (or LaneDispatcher) the handlers are added to
+
+        Returns:
+            Dispatcher to register the handlers through
+        """
+        self._probed = True
+        return ProbedDispatcher(dispatcher, self.observe_handled)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> None:
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name='webhook', daemon=True)
+        self._thread.start()
+        logger.info(f"Webhook listener on {self.server_address[0]}:{self.port}{self.path}")
+
+    def stop(self) -> None:
+        """Stop serving and release the socket."""
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+
+class ProbedDispatcher:
+    """
+    Dispatcher shim reporting to `observe(update)` when a handler returns.
+
+    Every handler added through `add_handler` has its callback wrapped before it is
+    passed on, so wrapping a LaneDispatcher times the handler where it runs on its
+    lane: the latency includes the time the update waited for the lane, not only
+    the dispatcher's pickup. A callback returning a Future (an AsyncDispatcher
+    wrapping this one) is timed until the Future completes. All other attributes
+    are forwarded untouched.
+    """
+
+    def __init__(self, dispatcher, observe: Callable[[object], None]):
+        self._dispatcher = dispatcher
+        self._observe = observe
+
+    def add_handler(self, handler, group: int = 0) -> None:
+        handler.callback = self._probe(handler.callback)
+        self._dispatcher.add_handler(handler, group)
+
+    def _probe(self, callback: Callable) -> Callable:
+
+        @functools.wraps(callback)
+        def probed(update: object, context: CallbackContext) -> Any:
+            try:
+                result = callback(update, context)
+            except Exception:
+                self._observe(update)
+                raise
+            if isinstance(result, Future):
+                # Handed off to the asyncio runtime: the handler returns when its coroutine does
+                result.add_done_callback(lambda done: self._observe(update))
+            else:
+                self._observe(update)
+            return result
+
+        return probed
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._dispatcher, name)
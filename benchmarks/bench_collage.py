@@ -0,0 +1,148 @@
+"""
+Render drawing collages end to end against a fake Bot API file endpoint.
+
+Drawings are local image fixtures, either files from --fixtures or generated
+sketches, served by an in-process HTTP server that answers getFile and file
+downloads the way api.telegram.org does. A real telegram.Bot pointed at it
+downloads them through CollageRenderer, which renders in its process pool.
+Reports render time, end-to-end time, peak memory and output size.
+
+Usage:
+    python -m benchmarks.bench_collage --drawings 4 10 20 --rounds 5
+    python -m benchmarks.bench_collage --fixtures path/to/images --out collage.jpg
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+os.environ.setdefault('TELEGRAM_TOKEN', 'benchmark')
+
+from PIL import Image, ImageDraw
+from telegram import Bot
+
+from app.utils.photo_cache import PhotoCache
+from app.utils.reveal import CollageRenderer, download_file
+
+TOKEN = '123:benchmark'
+
+def sketch(seed: int, size=(1280, 960)) -> bytes:
+    """A phone-photo-sized JPEG of random strokes."""
+    rng = random.Random(seed)
+    image = Image.new('RGB', size, (250, 248, 240))
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        points = [(rng.randrange(size[0]), rng.randrange(size[1])) for _ in range(4)]
+        draw.line(points, fill=(rng.randrange(200), rng.randrange(200), rng.randrange(200)), width=rng.randint(3, 12))
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+def load_fixtures(directory: str) -> list:
+    names = sorted(name for name in os.listdir(directory) if not name.startswith('.'))
+    fixtures = []
+    for name in names:
+        with open(os.path.join(directory, name), 'rb') as f:
+            fixtures.append(f.read())
+    return fixtures
+
+def serve_files(files: dict) -> ThreadingHTTPServer:
+    """Start a fake Bot API serving getFile for `files` (file_id -> bytes) and their downloads."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body: bytes, content_type: str) -> None:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            file_id = json.loads(body or b'{}').get('file_id')
+            if not self.path.endswith('/getFile') or file_id not in files:
+                self._send(400, b'{"ok": false, "error_code": 400, "description": "Bad Request"}', 'application/json')
+                return
+            result = {'file_id': file_id, 'file_unique_id': file_id, 'file_size': len(files[file_id]),
+                      'file_path': f'photos/{file_id}.jpg'}
+            self._send(200, json.dumps({'ok': True, 'result': result}).encode(), 'application/json')
+
+        def do_GET(self):
+            file_id = self.path.rsplit('/', 1)[-1][:-len('.jpg')]
+            if file_id not in files:
+                self._send(404, b'', 'text/plain')
+                return
+            self._send(200, files[file_id], 'image/jpeg')
+
+    class Server(ThreadingHTTPServer):
+        # The default listen backlog of 5 drops concurrent connects, which then retry after a second
+        request_queue_size = 64
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--drawings', type=int, nargs='+', default=[4, 10, 20])
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--tile-size', type=int, default=320)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--fixtures', help='directory of images to use instead of generated sketches')
+    parser.add_argument('--out', help='write the last collage to this file')
+    parser.add_argument('--cache', help='photo cache directory; drawings are read through it after the first round')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else [sketch(seed) for seed in range(max(args.drawings))]
+    files = {f'drawing{i}': fixtures[i % len(fixtures)] for i in range(max(args.drawings))}
+    server = serve_files(files)
+    host, port = server.server_address
+    bot = Bot(TOKEN, base_url=f'http://{host}:{port}/bot', base_file_url=f'http://{host}:{port}/file/bot')
+
+    cache = PhotoCache(args.cache, 1 << 30) if args.cache else None
+    renderer = CollageRenderer(
+        workers=args.workers,
+        tile_size=args.tile_size,
+        fetch=(lambda bot, submission: cache.fetch(bot, submission.content, submission.file_unique_id)) if cache else
+              (lambda bot, submission: download_file(bot, submission.content))
+    )
+    # Warm up the worker processes
+    renderer.render(bot, [(1, SimpleNamespace(content='drawing0', file_unique_id='drawing0', task=''))])
+
+    print(f"{'drawings':>8} {'render p50':>11} {'end-to-end p50':>15} {'peak MiB':>9} {'KiB':>6}")
+    image = b''
+    for count in args.drawings:
+        drawings = [(i + 1, SimpleNamespace(content=f'drawing{i}', file_unique_id=f'drawing{i}', task=''))
+                    for i in range(count)]
+        render_times, totals, peaks = [], [], []
+        for _ in range(args.rounds):
+            started_at = time.perf_counter()
+            image = renderer.render(bot, drawings)
+            totals.append(time.perf_counter() - started_at)
+            render_times.append(renderer.last_render_time)
+            peaks.append(renderer.last_peak_memory)
+        print(f"{count:>8} {statistics.median(render_times) * 1000:>9.1f}ms "
+              f"{statistics.median(totals) * 1000:>13.1f}ms {max(peaks) / 2 ** 20:>9.1f} {len(image) // 1024:>6}")
+
+    if cache:
+        print(f"cache hit rate {cache.hit_rate():.0%}")
+
+    renderer.stop()
+    server.shutdown()
+
+    if args.out:
+        with open(args.out, 'wb') as f:
+            f.write(image)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Benchmark the hot game queries before and after the index migration.
+
+Builds a SQLite database with the pre-migration schema (no secondary indexes)
+holding `--games` historical games, times the queries the bot runs on every
+update, applies the migrations and times them again.
+
+Usage:
+    python -m benchmarks.bench_indexes --games 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('TELEGRAM_TOKEN', 'benchmark')
+
+from sqlalchemy import create_engine, text
+
+from app.models.database import Base
+from app.models.migrations import migrate
+from app.utils.metrics import LatencyStats
+
+INDEXES = [
+    'ix_games_chat_id_finished_at',
+    'ix_game_players_game_id_is_active',
+    'ix_game_players_user_id',
+    'ix_game_rounds_game_id',
+    'ix_creative_submissions_round_id',
+    'ux_votes_round_id_voter_id',
+]
+
+# name -> (SQL, function building parameters from the generated ids)
+QUERIES = {
+    'live game of chat': (
+        "SELECT id FROM games WHERE chat_id = :chat_id AND finished_at IS NULL",
+        lambda ids: {"chat_id": random.randrange(ids["chats"])},
+    ),
+    'active players of game': (
+        "SELECT id FROM game_players WHERE game_id = :game_id AND is_active = 1",
+        lambda ids: {"game_id": random.randint(1, ids["games"])},
+    ),
+    'games of user': (
+        "SELECT game_id FROM game_players WHERE user_id = :user_id",
+        lambda ids: {"user_id": random.randint(1, ids["users"])},
+    ),
+    'vote of player in round': (
+        "SELECT id FROM votes WHERE round_id = :round_id AND voter_id = :voter_id",
+        lambda ids: {"round_id": random.randint(1, ids["games"]),
+                     "voter_id": random.randint(1, ids["players"])},
+    ),
+    'submissions of round': (
+        "SELECT id FROM creative_submissions WHERE round_id = :round_id",
+        lambda ids: {"round_id": random.randint(1, ids["games"])},
+    ),
+}
+
+def populate(engine, games: int, players_per_game: int, chats: int, users: int) -> dict:
+    """Fill the database with finished games (one round each) and return id ranges."""
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.executemany(
+            "INSERT INTO users (id, user_id, first_name, games_played, wins) VALUES (?, ?, ?, 0, 0)",
+            ((i, 10_000_000 + i, f"user{i}") for i in range(1, users + 1))
+        )
+
+        batch = 50_000
+        player_id = 0
+        for start in range(1, games + 1, batch):
+            game_ids = range(start, min(start + batch, games + 1))
+            # The most recent game of every chat is still running
+            live_from = games - chats
+            cursor.executemany(
+                "INSERT INTO games (id, chat_id, state, current_round, max_rounds, finished_at) "
+                "VALUES (?, ?, 5, 1, 3, ?)",
+                ((g, g % chats, None if g > live_from else '2024-01-01 00:00:00') for g in game_ids)
+            )
+            cursor.executemany(
+                "INSERT INTO game_rounds (id, game_id, round_number, state) VALUES (?, ?, 1, 5)",
+                ((g, g) for g in game_ids)
+            )
+
+            players, submissions, votes = [], [], []
+            for g in game_ids:
+                first = player_id + 1
+                for _ in range(players_per_game):
+                    player_id += 1
+                    players.append((player_id, g, random.randint(1, users)))
+                    submissions.append((g, player_id))
+                for voter in range(first, player_id + 1):
+                    votes.append((g, voter, first if voter != first else first + 1))
+            cursor.executemany(
+                "INSERT INTO game_players (id, game_id, user_id, role, is_active, score) "
+                "VALUES (?, ?, ?, 'Лояльный агент', 1, 0)",
+                players
+            )
+            cursor.executemany(
+                "INSERT INTO creative_submissions (round_id, player_id, submission_type, content) "
+                "VALUES (?, ?, 'TEXT', 'answer')",
+                submissions
+            )
+            cursor.executemany(
+                "INSERT INTO votes (round_id, voter_id, target_id) VALUES (?, ?, ?)",
+                votes
+            )
+            connection.commit()
+            print(f"  {min(start + batch - 1, games):>9} games", end='\r', file=sys.stderr)
+        print(file=sys.stderr)
+    finally:
+        connection.close()
+
+    return {"games": games, "chats": chats, "users": users, "players": player_id}
+
+def run_queries(engine, ids: dict, repeat: int) -> dict:
+    """Time every hot query `repeat` times and return their latency summaries."""
+    results = {}
+    with engine.connect() as connection:
+        for name, (sql, params) in QUERIES.items():
+            statement = text(sql)
+            stats = LatencyStats(window=repeat)
+            for _ in range(repeat):
+                started = time.perf_counter()
+                connection.execute(statement, params(ids)).fetchall()
+                stats.observe(time.perf_counter() - started)
+            results[name] = stats.snapshot()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--games', type=int, default=1_000_000)
+    parser.add_argument('--players', type=int, default=4, help="players per game")
+    parser.add_argument('--chats', type=int, default=20_000)
+    parser.add_argument('--users', type=int, default=200_000)
+    parser.add_argument('--repeat', type=int, default=20, help="executions per query")
+    parser.add_argument('--db', help="database file (default: a temporary file)")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix='spy-bench-'), 'bench.db')
+    engine = create_engine(f"sqlite:///{path}")
+    random.seed(1)
+
+    # Recreate the schema as it was before versioned migrations existed
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for index in INDEXES:
+            connection.execute(text(f"DROP INDEX IF EXISTS {index}"))
+        connection.execute(text("DROP TABLE IF EXISTS schema_version"))
+
+    print(f"Populating {path} with {args.games} games...", file=sys.stderr)
+    started = time.perf_counter()
+    ids = populate(engine, args.games, args.players, min(args.chats, args.games), args.users)
+    print(f"Populated in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    before = run_queries(engine, ids, args.repeat)
+
+    started = time.perf_counter()
+    version = migrate(engine)
+    migration_time = time.perf_counter() - started
+
+    after = run_queries(engine, ids, args.repeat)
+
+    print(f"\nMigrated to schema version {version} in {migration_time:.1f}s\n")
+    print(f"{'query':<26}{'before p50':>14}{'after p50':>14}{'speedup':>10}")
+    for name in QUERIES:
+        old, new = before[name]["p50"], after[name]["p50"]
+        print(f"{name:<26}{old * 1000:>12.3f}ms{new * 1000:>12.3f}ms{old / new if new else 0:>9.0f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Compare write throughput of the single-file and the sharded SQLite layouts.
+
+Every layout gets fresh database files and its own process (DB_SHARDS is read
+at import). One game per chat is created through the normal session routing,
+then writer threads, each serving its own chats, commit game writes the way
+the bot does: a vote upsert, a submitted answer or a state change per
+transaction, through get_session(chat_id). Reports commits per second, commit
+latency and lock errors; with one file all writers queue on a single SQLite
+write lock, with N shards only writers of chats in the same shard do. The
+gain grows with the time a commit holds the lock (disk syncs, see --profile)
+and with the cores available.
+
+Usage:
+    python -m benchmarks.bench_sharded_storage --shards 0 4 8 --threads 8 --seconds 5
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+def run_layout(shards: int, args: argparse.Namespace, results) -> None:
+    """Benchmark one layout; runs in a fresh process so the app picks up its DB_SHARDS."""
+    workdir = tempfile.mkdtemp(prefix='spy-shards-')
+    os.environ.setdefault('TELEGRAM_TOKEN', 'benchmark')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['DB_SHARDS'] = str(shards)
+    os.environ['DB_POOL_SIZE'] = str(args.threads + 2)
+    os.environ['DB_PROFILE'] = args.profile
+
+    from sqlalchemy import insert, update
+    from sqlalchemy.exc import OperationalError
+    from telegram import User as TelegramUser
+
+    from app.models.database import init_db, get_session, CreativeSubmission, Game, GameRound, Vote
+    from app.models.repository import create_game_players, upsert
+    from app.utils.metrics import LatencyStats
+
+    init_db()
+
+    # One game per chat with its players, a round and their tasks
+    chats = {}
+    for i in range(args.chats):
+        chat_id = -1000 - i
+        session = get_session(chat_id)
+        try:
+            game = Game(chat_id=chat_id, state=3)
+            session.add(game)
+            session.flush()
+            users = [TelegramUser(id=i * 100 + p, first_name=f'P{p}', is_bot=False) for p in range(args.players)]
+            player_ids = [player_id for player_id, _ in create_game_players(session, game.id, users, ['LOYAL'] * len(users))]
+            game_round = GameRound(game_id=game.id, round_number=1, state=3)
+            session.add(game_round)
+            session.flush()
+            submission_ids = [row[0] for row in session.execute(
+                insert(CreativeSubmission).returning(CreativeSubmission.id),
+                [{"round_id": game_round.id, "player_id": player_id, "task": "Task", "submission_type": "TEXT"}
+                 for player_id in player_ids]
+            )]
+            session.commit()
+            chats[chat_id] = (game.id, game_round.id, player_ids, submission_ids)
+        finally:
+            session.close()
+
+    latency = LatencyStats(window=1_000_000)
+    errors = [0]
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def write(session, chat_id: int, rng: random.Random) -> None:
+        game_id, round_id, player_ids, submission_ids = chats[chat_id]
+        kind = rng.random()
+        if kind < 0.5:
+            upsert(session, Vote, [{"round_id": round_id, "voter_id": rng.choice(player_ids),
+                                    "target_id": rng.choice(player_ids), "voted_at": datetime.datetime.utcnow()}],
+                   key=['round_id', 'voter_id'], update_columns=['target_id', 'voted_at'])
+        elif kind < 0.8:
+            session.execute(update(CreativeSubmission).where(CreativeSubmission.id == rng.choice(submission_ids))
+                            .values(content='answer'))
+        else:
+            session.execute(update(Game).where(Game.id == game_id).values(state=rng.choice((3, 4, 5))))
+
+    def writer(own_chats) -> None:
+        rng = random.Random(own_chats[0])
+        while not stop.is_set():
+            chat_id = rng.choice(own_chats)
+            session = get_session(chat_id)
+            started = time.perf_counter()
+            try:
+                write(session, chat_id, rng)
+                session.commit()
+                latency.observe(time.perf_counter() - started)
+            except OperationalError:
+                session.rollback()
+                with lock:
+                    errors[0] += 1
+            finally:
+                session.close()
+
+    chat_ids = list(chats)
+    threads = [threading.Thread(target=writer, args=(chat_ids[i::args.threads],)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    results.put(json.dumps({"shards": shards, "writes": latency.snapshot(), "errors": errors[0]}))
+    shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, nargs='+', default=[0, 4, 8], help="0 is the single-file layout")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--chats', type=int, default=64)
+    parser.add_argument('--players', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--profile', default='production', choices=('production', 'default'),
+                        help="Storage profile; 'default' syncs every commit to disk")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    print(f"{os.cpu_count()} CPUs, {args.threads} writer threads over {args.chats} chats, {args.profile} profile")
+    print(f"{'layout':<10}{'commits/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'lock errors':>13}{'speedup':>9}")
+    baseline = None
+    for shards in args.shards:
+        results = context.Queue()
+        process = context.Process(target=run_layout, args=(shards, args, results))
+        process.start()
+        result = json.loads(results.get())
+        process.join()
+
+        writes = result["writes"]
+        rate = writes["count"] / args.seconds
+        baseline = baseline or rate
+        layout = f"{shards} shards" if shards else "1 file"
+        print(
+            f"{layout:<10}{rate:>10.0f}"
+            f"{writes['p50'] * 1000:>8.2f}ms{writes['p95'] * 1000:>8.2f}ms{writes['p99'] * 1000:>8.2f}ms"
+            f"{result['errors']:>13}{rate / baseline:>8.2f}x"
+        )
+
+if __name__ == '__main__':
+    main()
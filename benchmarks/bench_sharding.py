@@ -0,0 +1,150 @@
+"""
+Measure update throughput of the sharded bot for increasing worker counts.
+
+Each run starts the real shard workers (app.main.run_shard) behind a
+ShardRouter, every worker talking to its own fake Bot API process, so the
+fake API doesn't become the shared bottleneck. A stream of command updates
+(/help, /rules, /stats, /leaderboard) spread over many group chats is routed
+through the front, and the run ends when every command has been answered
+with a sendMessage. Reports updates per second and the speedup over one
+worker; scaling is bounded by the cores available (shown in the header).
+
+Usage:
+    python -m benchmarks.bench_sharding --shards 1 2 4 --updates 4000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault('TELEGRAM_TOKEN', '123:benchmark')
+# Set before the app is imported: the database engine is created on import
+WORKDIR = tempfile.mkdtemp(prefix='bench-shards-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}"
+os.environ['PHOTO_CACHE_DIR'] = os.path.join(WORKDIR, 'photos')
+
+from app.main import run_shard
+from app.models.database import init_db
+from app.utils.sharding import ShardRouter, shard_of
+
+COMMANDS = ('/help', '/rules', '/stats', '/leaderboard')
+
+def serve_bot_api(port, answered) -> None:
+    """Fake Bot API answering every method, counting sendMessage calls in `answered`."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            method = self.path.rsplit('/', 1)[-1]
+            params = json.loads(body or b'{}') if self.headers.get('Content-Type', '').startswith('application/json') else {}
+            if method == 'getMe':
+                result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+            else:
+                chat_id = int(params.get('chat_id', 0))
+                result = {'message_id': 1, 'date': int(time.time()),
+                          'chat': {'id': chat_id, 'type': 'group' if chat_id < 0 else 'private'}}
+            payload = json.dumps({'ok': True, 'result': result}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            if method == 'sendMessage':
+                with answered.get_lock():
+                    answered.value += 1
+
+    class Server(ThreadingHTTPServer):
+        request_queue_size = 64
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    port.value = server.server_address[1]
+    server.serve_forever()
+
+def command_update(update_id: int, chat_id: int, user_id: int, text: str) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'group', 'title': f'Chat {chat_id}'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'P{user_id}'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}],
+        },
+    }
+
+def wait_for(answered, target: int, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while sum(counter.value for counter in answered) < target:
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+def run(shards: int, updates: int, chats: int) -> float:
+    """Route `updates` commands through `shards` workers; returns updates per second."""
+    context = multiprocessing.get_context('spawn')
+    ports = [context.Value('i', 0) for _ in range(shards)]
+    answered = [context.Value('i', 0) for _ in range(shards)]
+    servers = [context.Process(target=serve_bot_api, args=(ports[i], answered[i]), daemon=True)
+               for i in range(shards)]
+    for server in servers:
+        server.start()
+    while not all(port.value for port in ports):
+        time.sleep(0.01)
+
+    router = ShardRouter(shards, run_shard, environ=lambda shard: {
+        'TELEGRAM_API_URL': f'http://127.0.0.1:{ports[shard].value}/bot',
+    })
+    router.start()
+
+    # One warm-up command per shard, answered once its worker is up
+    warm_up = {}
+    chat_id = -1
+    while len(warm_up) < shards:
+        warm_up.setdefault(shard_of(chat_id, shards), chat_id)
+        chat_id -= 1
+    for update_id, chat_id in enumerate(warm_up.values(), 1):
+        router.route(command_update(update_id, chat_id, 1, '/help'))
+    if not wait_for(answered, shards, 120):
+        raise RuntimeError("Shard workers did not start")
+
+    started_at = time.perf_counter()
+    for i in range(updates):
+        router.route(command_update(1000 + i, -1000 - i % chats, 1 + i % 500, COMMANDS[i % len(COMMANDS)]))
+    if not wait_for(answered, shards + updates, 300):
+        raise RuntimeError("Not every command was answered")
+    elapsed = time.perf_counter() - started_at
+
+    router.stop()
+    for server in servers:
+        server.terminate()
+    return updates / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--updates', type=int, default=4000)
+    parser.add_argument('--chats', type=int, default=200)
+    args = parser.parse_args()
+
+    init_db()
+    print(f"{os.cpu_count()} CPUs, {args.updates} updates over {args.chats} chats")
+    print(f"{'shards':>6} {'updates/s':>10} {'speedup':>8}")
+    baseline = None
+    for shards in args.shards:
+        throughput = run(shards, args.updates, args.chats)
+        baseline = baseline or throughput
+        print(f"{shards:>6} {throughput:>10.0f} {throughput / baseline:>7.2f}x")
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
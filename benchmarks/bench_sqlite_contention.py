@@ -0,0 +1,125 @@
+"""
+Compare SQLite storage profiles under concurrent readers and writers.
+
+Writer threads commit single votes (like the vote ledger and the state flusher)
+while reader threads run stats-style aggregate queries (like /stats and
+/leaderboard). Each profile gets a fresh database file.
+
+Usage:
+    python -m benchmarks.bench_sqlite_contention --writers 4 --readers 4 --seconds 5
+"""
+import argparse
+import itertools
+import os
+import random
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('TELEGRAM_TOKEN', 'benchmark')
+
+from sqlalchemy import func, insert, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app.models.database import Base, GamePlayer, User, Vote, create_db_engine
+from app.utils.metrics import LatencyStats
+
+def populate(engine, users: int, players: int) -> None:
+    with engine.begin() as connection:
+        connection.execute(insert(User), [
+            {"id": i, "user_id": i, "first_name": f"user{i}", "games_played": i % 50, "wins": i % 17}
+            for i in range(1, users + 1)
+        ])
+        connection.execute(insert(GamePlayer), [
+            {"game_id": i // 5 + 1, "user_id": random.randint(1, users), "role": "Шпион" if i % 4 == 0 else "Лояльный агент",
+             "is_active": True, "score": i % 7}
+            for i in range(players)
+        ])
+
+def run_profile(profile: str, args) -> dict:
+    path = os.path.join(tempfile.mkdtemp(prefix='spy-bench-'), 'bench.db')
+    engine = create_db_engine(f"sqlite:///{path}", profile)
+    Base.metadata.create_all(engine)
+    populate(engine, args.users, args.players)
+    Session = sessionmaker(bind=engine)
+
+    voter_ids = itertools.count(1)
+    write_latency, read_latency = LatencyStats(window=100_000), LatencyStats(window=100_000)
+    errors = {"write": 0, "read": 0}
+    stop = threading.Event()
+    lock = threading.Lock()
+
+    def writer():
+        while not stop.is_set():
+            session = Session()
+            started = time.perf_counter()
+            try:
+                session.add(Vote(round_id=1, voter_id=next(voter_ids), target_id=1))
+                session.commit()
+                write_latency.observe(time.perf_counter() - started)
+            except OperationalError:
+                session.rollback()
+                with lock:
+                    errors["write"] += 1
+            finally:
+                session.close()
+
+    def reader():
+        while not stop.is_set():
+            session = Session()
+            started = time.perf_counter()
+            try:
+                session.query(User).order_by(User.wins.desc()).limit(10).all()
+                session.query(GamePlayer.role, func.count(), func.sum(GamePlayer.score)) \
+                    .group_by(GamePlayer.role).all()
+                read_latency.observe(time.perf_counter() - started)
+            except OperationalError:
+                with lock:
+                    errors["read"] += 1
+            finally:
+                session.close()
+
+    threads = [threading.Thread(target=writer) for _ in range(args.writers)]
+    threads += [threading.Thread(target=reader) for _ in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    with engine.connect() as connection:
+        journal_mode = connection.execute(text("PRAGMA journal_mode")).scalar()
+    engine.dispose()
+
+    return {
+        "journal": journal_mode,
+        "writes": write_latency.snapshot(),
+        "reads": read_latency.snapshot(),
+        "errors": errors,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--players', type=int, default=200_000)
+    args = parser.parse_args()
+
+    random.seed(1)
+    print(f"{'profile':<12}{'journal':<9}{'writes/s':>10}{'write p95':>12}{'reads/s':>10}{'read p95':>12}{'lock errors':>13}")
+    for profile in ('default', 'production'):
+        result = run_profile(profile, args)
+        writes, reads = result["writes"], result["reads"]
+        print(
+            f"{profile:<12}{result['journal']:<9}"
+            f"{writes['count'] / args.seconds:>10.0f}{writes['p95'] * 1000:>10.1f}ms"
+            f"{reads['count'] / args.seconds:>10.0f}{reads['p95'] * 1000:>10.1f}ms"
+            f"{result['errors']['write'] + result['errors']['read']:>13}"
+        )
+
+if __name__ == '__main__':
+    main()
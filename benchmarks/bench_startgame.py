@@ -0,0 +1,109 @@
+"""
+Compare the per-player /startgame registration path with the bulk one.
+
+The legacy path is the former loop of startgame_command: one User lookup per
+player, a commit per new user and one GamePlayer insert each. The bulk path is
+repository.create_game_players plus a single commit. Half of every game's
+players already exist, as for regulars of a chat.
+
+Usage:
+    python -m benchmarks.bench_startgame --games 200 --players 6 12 20
+"""
+import argparse
+import itertools
+import os
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault('TELEGRAM_TOKEN', 'benchmark')
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from app.models.database import Base, Game, GamePlayer, User, create_db_engine
+from app.models.repository import create_game_players
+
+def legacy_register(session, game, telegram_users, roles):
+    for telegram_user, role in zip(telegram_users, roles):
+        user = session.query(User).filter(User.user_id == telegram_user.id).first()
+        if not user:
+            user = User(
+                user_id=telegram_user.id,
+                username=telegram_user.username,
+                first_name=telegram_user.first_name,
+                last_name=telegram_user.last_name
+            )
+            session.add(user)
+            session.commit()
+        session.add(GamePlayer(game_id=game.id, user_id=user.id, role=role))
+    session.commit()
+
+def bulk_register(session, game, telegram_users, roles):
+    create_game_players(session, game.id, telegram_users, roles)
+    session.commit()
+
+def run(register, engine, games: int, players: int, telegram_ids) -> dict:
+    Session = sessionmaker(bind=engine)
+    statements = [0]
+    counter = lambda *args: statements.__setitem__(0, statements[0] + 1)
+    event.listen(engine, 'before_cursor_execute', counter)
+
+    timings = []
+    roles = ['Лояльный агент'] * players
+    for _ in range(games):
+        # Half returning players, half new ones
+        returning = [next(telegram_ids["old"]) for _ in range(players // 2)]
+        new = [next(telegram_ids["new"]) for _ in range(players - players // 2)]
+        telegram_users = [
+            SimpleNamespace(id=telegram_id, username=f"u{telegram_id}", first_name=f"P{telegram_id}", last_name=None)
+            for telegram_id in returning + new
+        ]
+
+        session = Session()
+        game = Game(chat_id=-1, state=1)
+        session.add(game)
+        session.flush()
+
+        started = time.perf_counter()
+        register(session, game, telegram_users, roles)
+        timings.append(time.perf_counter() - started)
+        session.close()
+
+    event.remove(engine, 'before_cursor_execute', counter)
+    return {
+        "p50": statistics.median(timings),
+        "p95": sorted(timings)[int(0.95 * len(timings))],
+        "statements": statements[0] / games,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--players', type=int, nargs='+', default=[6, 12, 20])
+    parser.add_argument('--profile', default='production', help="storage profile (see DB_PROFILE)")
+    args = parser.parse_args()
+
+    print(f"{'path':<8}{'players':>8}{'p50':>11}{'p95':>11}{'statements':>12}")
+    for players in args.players:
+        for path_name, register in (('legacy', legacy_register), ('bulk', bulk_register)):
+            path = os.path.join(tempfile.mkdtemp(prefix='spy-bench-'), 'bench.db')
+            engine = create_db_engine(f"sqlite:///{path}", args.profile)
+            Base.metadata.create_all(engine)
+
+            # Existing users that registrations draw returning players from
+            session = sessionmaker(bind=engine)()
+            session.add_all(User(user_id=i, first_name=f"P{i}", games_played=0, wins=0)
+                            for i in range(1, args.games * players + 1))
+            session.commit()
+            session.close()
+
+            telegram_ids = {"old": itertools.count(1), "new": itertools.count(10_000_000)}
+            result = run(register, engine, args.games, players, telegram_ids)
+            engine.dispose()
+            print(f"{path_name:<8}{players:>8}{result['p50'] * 1000:>9.2f}ms{result['p95'] * 1000:>9.2f}ms"
+                  f"{result['statements']:>12.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Check and measure the shared state backends.
+
+First runs one conformance scenario against MemoryBackend and RedisBackend
+(registrations, tasks, ballots, TTL expiry) and checks both give the same
+answers, including under concurrency: of many threads racing for the same
+registration, the last task of a round or a closed ballot, exactly one wins.
+Then measures operations per second and server round trips per operation of
+each game-state operation.
+
+RedisBackend talks to --redis-url, or by default to the in-process RESP
+stand-in server (benchmarks.resp_standin), so no Redis needs to be installed.
+
+Usage:
+    python -m benchmarks.bench_state_backend --ops 2000 --threads 8
+    python -m benchmarks.bench_state_backend --redis-url redis://localhost:6379/15
+"""
+import argparse
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('TELEGRAM_TOKEN', 'benchmark')
+
+from app.models.state_backend import MemoryBackend, RedisBackend, StateBackend
+from app.utils import metrics
+from app.utils.resp import RespClient
+from benchmarks import resp_standin
+
+def user(user_id: int) -> dict:
+    return {'id': user_id, 'first_name': f'P{user_id}', 'is_bot': False}
+
+def task(round_id: int, user_id: int) -> dict:
+    return {'submission_id': user_id, 'task_type': 'TEXT', 'task_text': 'Task',
+            'game_id': round_id, 'round_id': round_id}
+
+def race(threads: int, call) -> list:
+    """Run `call(i)` on `threads` threads at once; returns the results in order."""
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(call, range(threads)))
+
+def conformance(backend: StateBackend, short_lived: StateBackend, threads: int) -> list:
+    """Run the scenario, asserting its invariants; returns every answer for comparison."""
+    answers = []
+
+    # Registrations keep join order and refuse a second /join
+    answers += [backend.register(-1, user(u)) for u in (3, 1, 2)]
+    answers.append(backend.register(-1, user(1)))
+    answers.append([u['id'] for u in backend.registrations(-1)])
+    joined = race(threads, lambda i: backend.register(-2, user(7)))
+    assert sum(count is not None for count in joined) == 1, joined
+    backend.clear_registrations(-1)
+    answers.append(backend.registrations(-1))
+
+    # Tasks: one taker per task, one caller sees the round's last answer
+    backend.put_tasks(10, {u: task(10, u) for u in range(100, 100 + threads)})
+    answers.append(backend.task(100))
+    answers.append(sorted(backend.tasks()))
+    taken = race(threads, lambda i: backend.take_task(100 + i))
+    assert [remaining for _, remaining in taken].count(0) == 1, taken
+    assert all(t is not None for t, _ in taken)
+    answers.append(backend.take_task(100))
+    backend.put_tasks(11, {200: task(11, 200), 201: task(11, 201)})
+    backend.clear_round_tasks(11)
+    answers += [backend.task(200), backend.tasks()]
+    backend.put_tasks(12, {300: task(12, 300)})
+    doubled = race(threads, lambda i: backend.take_task(300))
+    assert sum(t is not None for t, _ in doubled) == 1, doubled
+
+    # Ballots: votes already cast survive reopening, closed ballots refuse votes
+    backend.open_ballot(20, {'voters': {'1': 1}}, {1: (2, 1.5)})
+    answers.append(backend.ballot(20))
+    answers.append(backend.cast_vote(20, 2, 1, 2.5))
+    answers.append(backend.cast_vote(20, 2, 3, 3.5))
+    backend.open_ballot(20, {'voters': {'1': 1}}, {1: (9, 0.5)})
+    answers.append(backend.close_ballot(20))
+    answers += [backend.close_ballot(20), backend.cast_vote(20, 1, 2, 4.0), backend.ballot(20)]
+    backend.open_ballot(21, {}, {})
+    race(threads, lambda i: backend.cast_vote(21, i, 0, float(i)))
+    closed = race(threads, lambda i: backend.close_ballot(21))
+    assert sum(votes is not None for votes in closed) == 1
+    answers.append(next(votes for votes in closed if votes is not None))
+
+    # Everything expires
+    short_lived.register(-3, user(1))
+    short_lived.put_tasks(30, {1: task(30, 1)})
+    short_lived.open_ballot(31, {}, {})
+    time.sleep(1.2)
+    answers += [short_lived.registrations(-3), short_lived.task(1), short_lived.tasks(),
+                short_lived.cast_vote(31, 1, 2, 1.0)]
+    return answers
+
+def throughput(backend: StateBackend, ops: int, threads: int) -> dict:
+    """Operations per second and round trips per operation of each game operation."""
+    round_trips = metrics.counter('resp.round_trips')
+    base = int(time.time() * 1000) % 10 ** 9
+    operations = {
+        'register': lambda i: backend.register(-base - i % 50, user(i)),
+        'put_tasks (10 players)': lambda i: backend.put_tasks(base + i, {
+            base * 10 + i * 10 + p: task(base + i, p) for p in range(10)
+        }),
+        'take_task': lambda i: backend.take_task(base * 10 + i * 10 + i % 10),
+        'cast_vote': lambda i: backend.cast_vote(base + i % 50, i, i % 7, time.time()),
+        'close_ballot': lambda i: backend.close_ballot(base + i % 50),
+    }
+    for i in range(50):
+        backend.open_ballot(base + i, {'voters': {}}, {})
+
+    results = {}
+    for name, operation in operations.items():
+        before = round_trips.value
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(operation, range(ops)))
+        elapsed = time.perf_counter() - started_at
+        results[name] = (ops / elapsed, (round_trips.value - before) / ops)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--redis-url', help="Redis server to use instead of the in-process stand-in")
+    parser.add_argument('--ops', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    server = None
+    url = args.redis_url
+    if not url:
+        server = resp_standin.start()
+        url = server.url
+    client = RespClient(url, pool_size=args.threads)
+    prefix = f'bench:{uuid.uuid4().hex[:8]}:'
+
+    backends = {
+        'memory': (MemoryBackend(), MemoryBackend(ttl=1)),
+        'redis': (RedisBackend(client, prefix=prefix), RedisBackend(client, prefix=prefix + 'ttl:', ttl=1)),
+    }
+    answers = {name: conformance(backend, short_lived, args.threads)
+               for name, (backend, short_lived) in backends.items()}
+    if answers['memory'] != answers['redis']:
+        for i, (memory, redis) in enumerate(zip(answers['memory'], answers['redis'])):
+            if memory != redis:
+                print(f"step {i}: memory={memory!r} redis={redis!r}")
+        raise SystemExit("Backends disagree")
+    print(f"Conformance: {len(answers['memory'])} answers identical on both backends ({url})")
+
+    print(f"\n{args.ops} operations per row, {args.threads} threads")
+    print(f"{'operation':<24} {'backend':<8} {'ops/s':>10} {'round trips/op':>15}")
+    for name, (backend, _) in backends.items():
+        for operation, (rate, trips) in throughput(backend, args.ops, args.threads).items():
+            print(f"{operation:<24} {name:<8} {rate:>10.0f} {trips:>15.2f}")
+
+    client.close()
+    if server:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""
+Local stand-in for a Redis server, speaking RESP2 on a TCP port.
+
+Implements only the commands the state backend sends (strings with EX and
+NX, hashes, sets, EXPIRE, MULTI/EXEC with WATCH), with lazy key expiry. All
+commands run under one lock, so a MULTI/EXEC block is atomic as on a real
+server. Meant
+for benchmarks and for checking RedisBackend where no Redis is installed.
+
+Usage:
+    python -m benchmarks.resp_standin --port 6399
+"""
+import argparse
+import socket
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional
+
+class Error(Exception):
+    pass
+
+class Store:
+    """The keyspace: key -> value (bytes, dict or set) with optional expiry."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data: Dict[bytes, object] = {}
+        self.expires: Dict[bytes, float] = {}
+        # Change counter of each written key, for WATCH; FLUSHDB changes every key
+        self.clock = 0
+        self.changed: Dict[bytes, int] = {}
+        self.flushed_at = 0
+
+    def version(self, key: bytes) -> int:
+        """When the key last changed (expiring counts as a change)."""
+        self.get(key)
+        return max(self.changed.get(key, 0), self.flushed_at)
+
+    def touch(self, key: bytes) -> None:
+        self.clock += 1
+        self.changed[key] = self.clock
+
+    def get(self, key: bytes, kind: Optional[type] = None):
+        if key in self.expires and self.expires[key] <= time.monotonic():
+            self.delete(key)
+        value = self.data.get(key)
+        if value is not None and kind is not None and not isinstance(value, kind):
+            raise Error("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def create(self, key: bytes, kind: type):
+        value = self.get(key, kind)
+        if value is None:
+            value = self.data[key] = kind()
+        return value
+
+    def delete(self, key: bytes) -> bool:
+        self.expires.pop(key, None)
+        if key not in self.data:
+            return False
+        self.touch(key)
+        del self.data[key]
+        return True
+
+    def prune(self, key: bytes) -> None:
+        """Drop a hash or set left empty, as Redis does."""
+        if not self.data.get(key):
+            self.delete(key)
+
+    def execute(self, name: str, args: List[bytes]):
+        handler = COMMANDS.get(name)
+        if handler is None:
+            raise Error(f"ERR unknown command '{name}'")
+        if name in WRITES and args:
+            for key in (args if name == 'DEL' else args[:1]):
+                self.touch(key)
+        return handler(self, *args)
+
+    def flush(self) -> str:
+        self.data.clear()
+        self.expires.clear()
+        self.clock += 1
+        self.flushed_at = self.clock
+        return 'OK'
+
+def _set(store, key, value, *options):
+    options = [option.upper() for option in options]
+    if b'NX' in options and store.get(key) is not None:
+        return None
+    store.delete(key)
+    store.data[key] = value
+    if b'EX' in options:
+        store.expires[key] = time.monotonic() + int(options[options.index(b'EX') + 1])
+    return 'OK'
+
+def _getdel(store, key):
+    value = store.get(key, bytes)
+    store.delete(key)
+    return value
+
+def _expire(store, key, seconds):
+    if store.get(key) is None:
+        return 0
+    store.expires[key] = time.monotonic() + int(seconds)
+    return 1
+
+def _hset(store, key, *pairs):
+    values = store.create(key, dict)
+    added = sum(1 for field in pairs[::2] if field not in values)
+    values.update(zip(pairs[::2], pairs[1::2]))
+    return added
+
+def _hsetnx(store, key, field, value):
+    values = store.create(key, dict)
+    if field in values:
+        return 0
+    values[field] = value
+    return 1
+
+def _hgetall(store, key):
+    return [item for pair in (store.get(key, dict) or {}).items() for item in pair]
+
+def _hdel(store, key, *fields):
+    values = store.get(key, dict) or {}
+    removed = sum(1 for field in fields if values.pop(field, None) is not None)
+    store.prune(key)
+    return removed
+
+def _sadd(store, key, *members):
+    values = store.create(key, set)
+    added = len(set(members) - values)
+    values.update(members)
+    return added
+
+def _srem(store, key, *members):
+    values = store.get(key, set) or set()
+    removed = len(values & set(members))
+    values.difference_update(members)
+    store.prune(key)
+    return removed
+
+COMMANDS = {
+    'PING': lambda store, *args: args[0] if args else 'PONG',
+    'SELECT': lambda store, db: 'OK',
+    'FLUSHDB': lambda store: store.flush(),
+    'GET': lambda store, key: store.get(key, bytes),
+    'SET': _set,
+    'GETDEL': _getdel,
+    'MGET': lambda store, *keys: [store.get(key) if isinstance(store.get(key), bytes) else None for key in keys],
+    'DEL': lambda store, *keys: sum(store.delete(key) for key in keys if store.get(key) is not None),
+    'EXISTS': lambda store, *keys: sum(1 for key in keys if store.get(key) is not None),
+    'EXPIRE': _expire,
+    'HSET': _hset,
+    'HSETNX': _hsetnx,
+    'HGETALL': _hgetall,
+    'HLEN': lambda store, key: len(store.get(key, dict) or {}),
+    'HDEL': _hdel,
+    'SADD': _sadd,
+    'SREM': _srem,
+    'SCARD': lambda store, key: len(store.get(key, set) or ()),
+    'SMEMBERS': lambda store, key: sorted(store.get(key, set) or ()),
+}
+
+# Commands that may change their key (every key for DEL), which aborts transactions watching it
+WRITES = {'SET', 'GETDEL', 'DEL', 'EXPIRE', 'HSET', 'HSETNX', 'HDEL', 'SADD', 'SREM'}
+
+def reply(value) -> bytes:
+    if isinstance(value, Error):
+        return b'-%s\r\n' % str(value).encode()
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, str):
+        return b'+%s\r\n' % value.encode()
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    return b'*%d\r\n' % len(value) + b''.join(reply(item) for item in value)
+
+class Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def read_command(self) -> Optional[List[bytes]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.split()
+        command = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            command.append(self.rfile.read(length + 2)[:-2])
+        return command
+
+    def handle(self):
+        store = self.server.store
+        queued: Optional[List[List[bytes]]] = None
+        watched: Dict[bytes, int] = {}  # key -> version when watched
+        while True:
+            command = self.read_command()
+            if command is None:
+                return
+            if not command:
+                continue
+            name, args = command[0].decode().upper(), command[1:]
+
+            if name == 'WATCH' and queued is None:
+                with store.lock:
+                    watched.update((key, store.version(key)) for key in args)
+                response = 'OK'
+            elif name == 'UNWATCH' and queued is None:
+                watched, response = {}, 'OK'
+            elif name == 'MULTI':
+                queued, response = [], 'OK'
+            elif name == 'DISCARD':
+                queued, watched, response = None, {}, 'OK'
+            elif name == 'EXEC':
+                if queued is None:
+                    response = Error("ERR EXEC without MULTI")
+                else:
+                    with store.lock:
+                        if any(store.version(key) != version for key, version in watched.items()):
+                            # A watched key changed since WATCH: the transaction is dropped
+                            response = None
+                        else:
+                            response = []
+                            for queued_name, queued_args in queued:
+                                try:
+                                    response.append(store.execute(queued_name, queued_args))
+                                except Error as e:
+                                    response.append(e)
+                                except (TypeError, ValueError, IndexError):
+                                    response.append(Error(f"ERR wrong arguments for '{queued_name}'"))
+                    queued, watched = None, {}
+            elif queued is not None:
+                queued.append((name, args))
+                response = 'QUEUED'
+            else:
+                try:
+                    with store.lock:
+                        response = store.execute(name, args)
+                except Error as e:
+                    response = e
+                except (TypeError, ValueError, IndexError):
+                    response = Error(f"ERR wrong arguments for '{name}'")
+
+            self.wfile.write(reply(response))
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0)):
+        super().__init__(address, Handler)
+        self.store = Store()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'redis://{host}:{port}/0'
+
+def start(port: int = 0) -> Server:
+    """Serve on a background thread; the server's `url` points at it."""
+    server = Server(('127.0.0.1', port))
+    threading.Thread(target=server.serve_forever, name='resp-standin', daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=6399)
+    args = parser.parse_args()
+    server = Server(('127.0.0.1', args.port))
+    print(f"Listening on {server.url}")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
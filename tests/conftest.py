@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# The app reads its configuration at import: give it a token and a scratch database
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:test')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='spy-tests-'), 'test.db')}")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
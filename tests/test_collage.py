@@ -0,0 +1,115 @@
+import io
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from app.utils import reveal
+from app.utils.collage import render_collage, PLACEHOLDER
+from app.utils.reveal import CollageRenderer
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+def fixture_path(name: str) -> str:
+    return os.path.join(FIXTURES, name)
+
+def fixture_bytes(name: str) -> bytes:
+    with open(fixture_path(name), 'rb') as f:
+        return f.read()
+
+def tile_center(collage: Image.Image, index: int, columns: int, tile_size: int) -> tuple:
+    """Color at the middle of the `index`-th tile, using the layout render_collage computes."""
+    padding = max(2, tile_size // 32)
+    label_height = max(16, tile_size // 8)
+    x = padding + (index % columns) * (tile_size + padding) + tile_size // 2
+    y = padding + (index // columns) * (tile_size + label_height + padding) + tile_size // 2
+    return collage.getpixel((x, y))
+
+def assert_color(actual: tuple, expected: tuple, tolerance: int = 40) -> None:
+    assert all(abs(a - e) <= tolerance for a, e in zip(actual, expected)), (actual, expected)
+
+def test_grid_holds_every_drawing_with_its_label_row():
+    drawings = [('A1', fixture_bytes('drawing.jpg')), ('A2', fixture_bytes('drawing.png')), ('A3', None)]
+    data, seconds, peak_memory = render_collage(drawings, tile_size=64)
+
+    collage = Image.open(io.BytesIO(data))
+    assert collage.format == 'JPEG'
+    # Three drawings fit a 2x2 grid: 64px tiles, 2px padding, 16px label rows
+    assert collage.size == (2 * 66 + 2, 2 * 82 + 2)
+    assert seconds >= 0
+    assert peak_memory >= collage.width * collage.height * 3
+
+def test_tiles_show_their_drawing_or_a_placeholder():
+    drawings = [
+        ('jpeg', fixture_bytes('drawing.jpg')),
+        ('png file', fixture_path('drawing.png')),
+        ('missing', None),
+        ('broken', fixture_bytes('broken.jpg')),
+    ]
+    collage = Image.open(io.BytesIO(render_collage(drawings, tile_size=64)[0])).convert('RGB')
+
+    # The JPEG fixture is red around a yellow disc, the PNG one blue around a transparent bar
+    assert_color(tile_center(collage, 0, 2, 64), (250, 250, 0))
+    assert_color(tile_center(collage, 1, 2, 64), (30, 60, 200))
+    assert_color(tile_center(collage, 2, 2, 64), PLACEHOLDER)
+    assert_color(tile_center(collage, 3, 2, 64), PLACEHOLDER)
+
+def test_paths_and_bytes_render_the_same():
+    from_bytes = render_collage([('a', fixture_bytes('drawing.jpg'))], tile_size=32)[0]
+    from_path = render_collage([('a', fixture_path('drawing.jpg'))], tile_size=32)[0]
+    assert from_bytes == from_path
+
+@pytest.mark.parametrize('count, grid', [(1, (1, 1)), (4, (2, 2)), (5, (3, 2)), (10, (4, 3))])
+def test_grid_is_close_to_square(count, grid):
+    data = render_collage([(str(i), None) for i in range(count)], tile_size=32)[0]
+    columns, rows = grid
+    assert Image.open(io.BytesIO(data)).size == (columns * 34 + 2, rows * 50 + 2)
+
+class RecordingOutbound:
+    """Stands in for the outbound scheduler, recording what is queued."""
+
+    def __init__(self):
+        self.queued = []
+
+    def send_photo(self, bot, chat_id, **kwargs):
+        self.queued.append(('photo', kwargs.get('caption')))
+
+    def send_media_group(self, bot, chat_id, **kwargs):
+        self.queued.append(('album', len(kwargs['media'])))
+
+@pytest.fixture
+def queued(monkeypatch):
+    recorder = RecordingOutbound()
+    monkeypatch.setattr(reveal, 'outbound', recorder)
+    return recorder.queued
+
+def drawings(count: int) -> list:
+    return [(i, SimpleNamespace(content=f'F{i}', file_unique_id=None, task=f'Task {i}')) for i in range(1, count + 1)]
+
+def test_reveal_queues_the_collage_before_returning(queued):
+    renderer = CollageRenderer(workers=1, tile_size=32, timeout=30,
+                               fetch=lambda bot, submission: fixture_bytes('drawing.jpg'))
+    try:
+        renderer.reveal(None, -1, drawings(3))
+    finally:
+        renderer.stop()
+    assert queued == [('photo', '🖼 Рисунки раунда:\n#A1: Task 1\n#A2: Task 2\n#A3: Task 3')]
+
+def test_late_collage_falls_back_to_albums(queued):
+    released = threading.Event()
+
+    def slow_fetch(bot, submission):
+        released.wait(5)
+        return fixture_bytes('drawing.jpg')
+
+    renderer = CollageRenderer(workers=1, tile_size=32, timeout=0.2, fetch=slow_fetch)
+    try:
+        renderer.reveal(None, -1, drawings(3))
+        assert queued == [('album', 3)]
+    finally:
+        released.set()
+        renderer.stop()
+    # The collage finished after the fallback and was dropped
+    assert queued == [('album', 3)]
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.models.database import Base, engine, get_session, LeaderboardEntry, LeaderboardVersion
+from app.models.leaderboard import Leaderboard
+from app.utils import metrics
+
+@pytest.fixture
+def session():
+    Base.metadata.create_all(engine)
+    session = get_session()
+    session.query(LeaderboardEntry).delete()
+    session.query(LeaderboardVersion).delete()
+    session.commit()
+    yield session
+    session.close()
+
+def finish_game(leaderboard: Leaderboard, session, user_id: int, games: int, wins: int) -> None:
+    """Record a user's new totals the way the end of a game does."""
+    ranked, version = leaderboard.write(session, [SimpleNamespace(id=user_id, first_name=f'P{user_id}',
+                                                                  games_played=games, wins=wins)])
+    session.commit()
+    leaderboard.update(ranked, version)
+
+def top_ids(leaderboard: Leaderboard) -> list:
+    return [user.user_id for user in leaderboard.top()]
+
+def test_shared_leaderboard_reloads_after_another_process_writes(session):
+    ours, theirs = Leaderboard(shared=True), Leaderboard(shared=True)
+    finish_game(ours, session, 1, games=3, wins=1)
+    assert top_ids(ours) == [1]
+    assert top_ids(theirs) == [1]
+
+    # A game finished by the other process reaches this one's next read
+    finish_game(theirs, session, 2, games=3, wins=3)
+    assert top_ids(ours) == [2, 1]
+
+    # Its own games are applied in memory, without reloading
+    loads = metrics.counter('leaderboard.loads').value
+    finish_game(ours, session, 3, games=4, wins=2)
+    assert top_ids(ours) == [2, 3, 1]
+    assert metrics.counter('leaderboard.loads').value == loads
+
+def test_unshared_leaderboard_serves_from_memory(session):
+    leaderboard = Leaderboard()
+    finish_game(leaderboard, session, 1, games=3, wins=1)
+    assert top_ids(leaderboard) == [1]
+    assert session.get(LeaderboardVersion, 1) is None
+
+    loads = metrics.counter('leaderboard.loads').value
+    finish_game(leaderboard, session, 2, games=3, wins=3)
+    assert top_ids(leaderboard) == [2, 1]
+    assert metrics.counter('leaderboard.loads').value == loads
@@ -0,0 +1,48 @@
+from sqlalchemy import create_engine, text
+
+from app.models.database import Base, GAME_TABLES, create_migration_engine
+from app.models.migrations import migrate
+
+SPY, LOYAL = 'Шпион', 'Лояльный агент'
+
+def add_game(connection, game_id: int, state: int, players) -> None:
+    """A finished game with (user_id, role, is_active) players."""
+    connection.execute(text("INSERT INTO games (id, chat_id, state, finished_at) VALUES (:id, -1, :state, '2024-01-01')"),
+                       {"id": game_id, "state": state})
+    for user_id, role, is_active in players:
+        connection.execute(text("INSERT INTO game_players (game_id, user_id, role, is_active) "
+                                "VALUES (:game_id, :user_id, :role, :is_active)"),
+                           {"game_id": game_id, "user_id": user_id, "role": role, "is_active": is_active})
+
+def test_role_stats_backfill_reads_every_shard(tmp_path):
+    global_url = f"sqlite:///{tmp_path / 'global.db'}"
+    shard_urls = [f"sqlite:///{tmp_path / f'shard{shard}.db'}" for shard in range(2)]
+
+    setup = create_engine(global_url)
+    Base.metadata.create_all(setup)
+    with setup.begin() as connection:
+        connection.execute(text("CREATE TABLE schema_version (version INTEGER NOT NULL)"))
+        connection.execute(text("INSERT INTO schema_version (version) VALUES (3)"))
+        # An older game still in the global file, with the same ID as a game in shard 0
+        add_game(connection, 1, 6, [(1, SPY, False), (2, LOYAL, True)])
+    setup.dispose()
+    for shard, url in enumerate(shard_urls):
+        shard_engine = create_engine(url)
+        Base.metadata.create_all(shard_engine, tables=[Base.metadata.tables[name] for name in GAME_TABLES])
+        with shard_engine.begin() as connection:
+            add_game(connection, 1 + shard, 6, [(1, SPY, True), (2, LOYAL, False)])
+            add_game(connection, 10 + shard, 3, [(1, SPY, True)])  # stopped with /endgame
+        shard_engine.dispose()
+
+    migration_engine = create_migration_engine(global_url, shard_urls)
+    try:
+        migrate(migration_engine)
+        with migration_engine.connect() as connection:
+            stats = connection.execute(text(
+                "SELECT user_id, role, games, wins, eliminations FROM user_role_stats ORDER BY user_id"
+            )).all()
+    finally:
+        migration_engine.dispose()
+
+    # The spy lost the global game and won both shard games
+    assert stats == [(1, SPY, 3, 2, 1), (2, LOYAL, 3, 1, 2)]
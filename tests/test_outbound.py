@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import defaultdict
+
+import pytest
+from telegram import Bot
+from telegram.error import RetryAfter
+
+from app.utils.outbound import (
+    OutboundScheduler, TokenBucket, PRIORITY_GROUP, PRIORITY_DM, PRIORITY_REMINDER
+)
+
+class StubBot(Bot):
+    """Bot whose requests never leave the process: `_post` records them and answers like the Bot API."""
+
+    def __init__(self, delay: float = 0.0):
+        super().__init__('123456:test')
+        self.delay = delay
+        self.failures = {}  # text -> retry_after of each failed attempt, in order
+        self.sent = []  # (chat_id, text) in the order requests reached the API
+        self.in_flight = defaultdict(int)
+        self.max_in_flight = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def _post(self, endpoint, data=None, timeout=None, api_kwargs=None):
+        chat_id, text = data['chat_id'], data.get('text')
+        with self.lock:
+            self.in_flight[chat_id] += 1
+            self.max_in_flight[chat_id] = max(self.max_in_flight[chat_id], self.in_flight[chat_id])
+            retry_after = self.failures[text].pop(0) if self.failures.get(text) else None
+            if retry_after is None:
+                self.sent.append((chat_id, text))
+        try:
+            time.sleep(self.delay)
+            if retry_after is not None:
+                raise RetryAfter(retry_after)
+            return {'message_id': len(self.sent), 'date': 0, 'chat': {'id': chat_id, 'type': 'group'}, 'text': text}
+        finally:
+            with self.lock:
+                self.in_flight[chat_id] -= 1
+
+@pytest.fixture
+def scheduler():
+    scheduler = OutboundScheduler(global_rate=1000, group_rate=1000, group_burst=1000,
+                                  private_rate=1000, private_burst=1000, workers=4, max_retries=2)
+    yield scheduler
+    scheduler.stop(timeout=5)
+
+def wait_all(futures, timeout: float = 5.0):
+    return [future.result(timeout) for future in futures]
+
+def test_token_bucket_spends_burst_then_refills_at_rate():
+    bucket = TokenBucket(rate=2, capacity=3)
+    now = bucket.updated_at
+    for _ in range(3):
+        assert bucket.delay(now) == 0
+        bucket.take(now)
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.5) == 0
+    # Idle time never accumulates more than the capacity
+    assert bucket.delay(now + 60) == 0
+    assert bucket.tokens == 3
+
+def test_token_bucket_pause_holds_tokens_until_it_ends():
+    bucket = TokenBucket(rate=10, capacity=10)
+    now = bucket.updated_at
+    bucket.pause(now, 2)
+    assert bucket.delay(now) == pytest.approx(2)
+    assert bucket.delay(now + 2) == 0
+    bucket.take(now + 2)
+    # Only one token right after the pause, the rest refills at the normal rate
+    assert bucket.delay(now + 2) == pytest.approx(0.1)
+
+def test_group_burst_limits_sends_per_chat():
+    scheduler = OutboundScheduler(global_rate=1000, group_rate=5, group_burst=2, private_rate=1000,
+                                  private_burst=1000, workers=2)
+    bot = StubBot()
+    try:
+        started_at = time.monotonic()
+        wait_all([scheduler.send_message(bot, chat_id=-1, text=str(i)) for i in range(4)])
+        # Two messages go out on the burst, the other two wait 1/5 s each
+        assert time.monotonic() - started_at >= 0.35
+        assert [text for _, text in bot.sent] == ['0', '1', '2', '3']
+    finally:
+        scheduler.stop(timeout=5)
+
+def test_retry_after_pauses_the_chat_and_requeues_the_message(scheduler):
+    bot = StubBot()
+    bot.failures['first'] = [1]
+    started_at = time.monotonic()
+    first = scheduler.send_message(bot, chat_id=-1, text='first')
+    second = scheduler.send_message(bot, chat_id=-1, text='second')
+    other = scheduler.send_message(bot, chat_id=-2, text='other')
+
+    assert other.result(5).text == 'other'
+    assert time.monotonic() - started_at < 0.5  # other chats are not paused
+    assert first.result(5).text == 'first'
+    assert time.monotonic() - started_at >= 1
+    assert second.result(5).text == 'second'
+    # The retried message keeps its place ahead of later messages to the same chat
+    assert [text for chat_id, text in bot.sent if chat_id == -1] == ['first', 'second']
+
+def test_retry_after_gives_up_after_max_retries():
+    scheduler = OutboundScheduler(global_rate=1000, group_rate=1000, group_burst=1000, workers=1, max_retries=1)
+    bot = StubBot()
+    try:
+        bot.failures['flood'] = [0, 0]
+        future = scheduler.send_message(bot, chat_id=-1, text='flood')
+        with pytest.raises(RetryAfter):
+            future.result(5)
+        assert bot.sent == []
+    finally:
+        scheduler.stop(timeout=5)
+
+def test_one_request_in_flight_per_chat(scheduler):
+    bot = StubBot(delay=0.02)
+    futures = [
+        scheduler.send_message(bot, chat_id=chat_id, text=f'{chat_id}:{i}')
+        for i in range(5) for chat_id in (-1, -2, 3)
+    ]
+    wait_all(futures)
+
+    assert dict(bot.max_in_flight) == {-1: 1, -2: 1, 3: 1}
+    for chat_id in (-1, -2, 3):
+        assert [text for sent_to, text in bot.sent if sent_to == chat_id] == [f'{chat_id}:{i}' for i in range(5)]
+
+def test_ready_chats_are_served_by_priority_then_submission_order():
+    scheduler = OutboundScheduler(global_rate=5, group_rate=1000, group_burst=1000,
+                                  private_rate=1000, private_burst=1000, workers=1)
+    bot = StubBot()
+    try:
+        # Use up the global burst so the next messages queue up while tokens refill
+        wait_all([scheduler.send_message(bot, chat_id=100 + i, text='warm-up') for i in range(5)])
+        futures = [
+            scheduler.send_message(bot, chat_id=1, text='reminder', priority=PRIORITY_REMINDER),
+            scheduler.send_message(bot, chat_id=2, text='dm', priority=PRIORITY_DM),
+            scheduler.send_message(bot, chat_id=-3, text='group', priority=PRIORITY_GROUP),
+            scheduler.send_message(bot, chat_id=-4, text='group later', priority=PRIORITY_GROUP),
+        ]
+        wait_all(futures)
+        assert [text for _, text in bot.sent[5:]] == ['group', 'group later', 'dm', 'reminder']
+    finally:
+        scheduler.stop(timeout=5)
+
+def test_overtaken_ready_entries_do_not_resurface():
+    scheduler = OutboundScheduler(global_rate=5, group_rate=1000, group_burst=1000,
+                                  private_rate=1000, private_burst=1000, workers=1)
+    bot = StubBot()
+    try:
+        wait_all([scheduler.send_message(bot, chat_id=100 + i, text='warm-up') for i in range(5)])
+        # A group message overtakes a queued reminder to the same chat, leaving the reminder's first entry behind
+        wait_all([
+            scheduler.send_message(bot, chat_id=-1, text='reminder', priority=PRIORITY_REMINDER),
+            scheduler.send_message(bot, chat_id=-1, text='group', priority=PRIORITY_GROUP),
+        ])
+        # That entry must not put the chat's next reminder ahead of an older one to another chat
+        wait_all([
+            scheduler.send_message(bot, chat_id=-3, text='older', priority=PRIORITY_REMINDER),
+            scheduler.send_message(bot, chat_id=-1, text='newer', priority=PRIORITY_REMINDER),
+        ])
+        assert [text for _, text in bot.sent[5:]] == ['group', 'reminder', 'older', 'newer']
+    finally:
+        scheduler.stop(timeout=5)
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from telegram import Bot
+from telegram.error import NetworkError
+
+from app.utils import metrics
+from app.utils.photo_cache import PhotoCache
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+def fixture_bytes(name: str) -> bytes:
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+class StubRequest:
+    """Download side of the Bot API: serves `files` by path and counts downloads."""
+
+    def __init__(self, files):
+        self.files = files
+        self.downloads = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def retrieve(self, url, timeout=None):
+        self.gate.wait(5)
+        path = url.rsplit('/', 1)[-1]
+        self.downloads.append(path)
+        if path not in self.files:
+            raise NetworkError('File is unavailable')
+        return self.files[path]
+
+    def stop(self):
+        pass
+
+class StubBot(Bot):
+    """Bot answering getFile locally: file_id 'F<name>' points at the file `name`."""
+
+    def __init__(self, files):
+        super().__init__('123456:test', request=StubRequest(files))
+
+    def _post(self, endpoint, data=None, timeout=None, api_kwargs=None):
+        assert endpoint == 'getFile'
+        name = data['file_id'][1:]
+        return {'file_id': data['file_id'], 'file_unique_id': f'U{name}', 'file_path': f'photos/{name}'}
+
+@pytest.fixture
+def bot():
+    return StubBot({'drawing.jpg': fixture_bytes('drawing.jpg'), 'drawing.png': fixture_bytes('drawing.png')})
+
+def test_miss_downloads_once_then_serves_from_disk(tmp_path, bot):
+    cache = PhotoCache(str(tmp_path), max_bytes=1 << 20)
+
+    path = cache.fetch(bot, 'Fdrawing.jpg', 'Ujpg')
+    assert path == cache.path('Ujpg') == str(tmp_path / 'Uj' / 'Ujpg')
+    assert cache.fetch(bot, 'Fdrawing.jpg', 'Ujpg') == path
+    assert cache.read('Ujpg') == fixture_bytes('drawing.jpg')
+    assert bot.request.downloads == ['drawing.jpg']
+
+def test_concurrent_fetches_share_one_download(tmp_path, bot):
+    cache = PhotoCache(str(tmp_path), max_bytes=1 << 20)
+    bot.request.gate.clear()
+    with ThreadPoolExecutor(4) as pool:
+        fetches = [pool.submit(cache.fetch, bot, 'Fdrawing.png', 'Upng') for _ in range(4)]
+        time.sleep(0.1)
+        bot.request.gate.set()
+        paths = {fetch.result(5) for fetch in fetches}
+
+    assert paths == {cache.path('Upng')}
+    assert bot.request.downloads == ['drawing.png']
+
+def test_failed_download_is_not_cached(tmp_path, bot):
+    cache = PhotoCache(str(tmp_path), max_bytes=1 << 20)
+    with pytest.raises(NetworkError):
+        cache.fetch(bot, 'Fmissing.jpg', 'Umissing')
+    assert cache.read('Umissing') is None
+
+    # The next lookup tries again
+    bot.request.files['missing.jpg'] = b'late'
+    cache.fetch(bot, 'Fmissing.jpg', 'Umissing')
+    assert cache.read('Umissing') == b'late'
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    cache = PhotoCache(str(tmp_path), max_bytes=25)
+    cache.put('Ua', b'a' * 10)
+    cache.put('Ub', b'b' * 10)
+    assert cache.read('Ua') == b'a' * 10  # Ub is now the oldest
+    cache.put('Uc', b'c' * 10)
+
+    assert cache.read('Ub') is None
+    assert not os.path.exists(cache.path('Ub'))
+    assert cache.read('Ua') == b'a' * 10
+    assert cache.read('Uc') == b'c' * 10
+
+def test_restart_indexes_files_in_their_last_use_order(tmp_path):
+    cache = PhotoCache(str(tmp_path), max_bytes=100)
+    for unique_id in ('Ua', 'Ub', 'Uc'):
+        cache.put(unique_id, b'x' * 10)
+    # Last uses, oldest first: Ub, Uc, Ua
+    for age, unique_id in ((30, 'Ub'), (20, 'Uc'), (10, 'Ua')):
+        stamp = time.time() - age
+        os.utime(cache.path(unique_id), (stamp, stamp))
+    # A download interrupted by the previous shutdown
+    with open(os.path.join(tmp_path, 'Ua', '.partial'), 'wb') as f:
+        f.write(b'x')
+
+    restarted = PhotoCache(str(tmp_path), max_bytes=25)
+    assert restarted.read('Ub') is None
+    assert restarted.read('Uc') == b'x' * 10
+    assert restarted.read('Ua') == b'x' * 10
+    assert not os.path.exists(os.path.join(tmp_path, 'Ua', '.partial'))
+
+def test_prefetch_warms_the_cache(tmp_path, bot):
+    cache = PhotoCache(str(tmp_path), max_bytes=1 << 20, workers=2)
+    try:
+        assert cache.prefetch(bot, 'Fdrawing.jpg', 'Ujpg').result(5) == cache.path('Ujpg')
+    finally:
+        cache.stop()
+    assert cache.read('Ujpg') == fixture_bytes('drawing.jpg')
+    assert bot.request.downloads == ['drawing.jpg']
+
+def test_file_removed_behind_the_cache_is_downloaded_again(tmp_path, bot):
+    cache = PhotoCache(str(tmp_path), max_bytes=1 << 20)
+    path = cache.fetch(bot, 'Fdrawing.jpg', 'Ujpg')
+    os.remove(path)
+
+    assert cache.fetch(bot, 'Fdrawing.jpg', 'Ujpg') == path
+    assert cache.read('Ujpg') == fixture_bytes('drawing.jpg')
+    assert bot.request.downloads == ['drawing.jpg', 'drawing.jpg']
+
+def test_other_caches_files_below_the_directory_are_left_alone(tmp_path):
+    PhotoCache(str(tmp_path / 'shard0'), max_bytes=100).put('Ua', b'x' * 10)
+    evictions = metrics.counter('photo_cache.evictions').value
+    cache = PhotoCache(str(tmp_path), max_bytes=5)
+    cache.put('Ub', b'y' * 4)
+
+    # The shard's file neither counts towards this cache's size nor is served by it
+    assert metrics.counter('photo_cache.evictions').value == evictions
+    assert cache.read('Ua') is None
+    assert os.path.exists(tmp_path / 'shard0' / 'Ua' / 'Ua')
@@ -0,0 +1,28 @@
+from telegram.constants import MAX_MESSAGE_LENGTH
+
+from app.models.database import CreativeSubmission
+from app.utils.reveal import drawing_caption, text_digests, text_entry
+
+def submission(task: str, content: str) -> CreativeSubmission:
+    return CreativeSubmission(task=task, submission_type='TEXT', content=content)
+
+def test_user_text_is_escaped_for_markdown():
+    entry = text_entry(1, submission('Опишите *кота*', 'мой_кот [любит] `рыбу` *очень*'))
+    assert entry == (
+        '📝 Описание #A1:\n'
+        'Задание: *Опишите *\\**кота*\\***\n\n'
+        'Ответ: "мой\\_кот \\[любит] \\`рыбу\\` \\*очень\\*"'
+    )
+    assert drawing_caption(2, submission('Кот', 'file')) == '🖼 Рисунок #A2: *Кот*'
+
+def test_long_answers_are_cut_before_escaping():
+    entry = text_entry(1, submission('Задание', '_' * MAX_MESSAGE_LENGTH))
+    # Every underscore keeps its backslash, so the cut can't leave an open italic entity
+    assert entry.endswith('\\_…"')
+    assert entry.count('\\_') == entry.count('_')
+
+def test_digests_keep_every_answer_whole():
+    answers = [(i, submission('Задание', 'ответ ' * 200)) for i in range(1, 8)]
+    digests = text_digests(answers)
+    assert len(digests) > 1
+    assert '\n\n'.join(digests) == '\n\n'.join(text_entry(i, s) for i, s in answers)
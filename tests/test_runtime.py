@@ -0,0 +1,208 @@
+import threading
+import time
+from queue import Queue
+
+import pytest
+from telegram import Bot, Update
+from telegram.ext import Dispatcher
+
+from app.config.config import MIN_PLAYERS, MAX_PLAYERS
+from app.handlers import creative, registration, voting
+from app.models.database import Base, engine, get_session, CreativeSubmission, Registration
+from app.models.state_backend import MemoryBackend, state_backend
+from app.models.state_store import LivePlayer
+from app.models.vote_ledger import vote_ledger
+from app.utils.lanes import LaneDispatcher, LaneExecutor, COMMANDS
+from app.utils.runtime import AsyncDispatcher, runtime
+
+class StubBot(Bot):
+    """Bot answering the Bot API calls handlers make directly, recording them."""
+
+    def __init__(self):
+        super().__init__('123456:test')
+        self.calls = []
+
+    def _post(self, endpoint, data=None, timeout=None, api_kwargs=None):
+        data = data or {}
+        self.calls.append((endpoint, data.get('text')))
+        if endpoint == 'getMe':
+            return {'id': 123456, 'is_bot': True, 'first_name': 'Bot', 'username': 'spy_bot'}
+        if endpoint == 'answerCallbackQuery':
+            return True
+        return {'message_id': 1, 'date': 0, 'chat': {'id': data['chat_id'], 'type': 'private'}, 'text': data.get('text')}
+
+class RecordingOutbound:
+    """Stands in for the outbound scheduler, recording (chat_id, text) in queueing order."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, bot, chat_id, **kwargs):
+        self.sent.append((chat_id, kwargs['text']))
+
+@pytest.fixture
+def sent(monkeypatch):
+    recorder = RecordingOutbound()
+    monkeypatch.setattr(registration, 'outbound', recorder)
+    monkeypatch.setattr(creative, 'outbound', recorder)
+    return recorder.sent
+
+@pytest.fixture(params=['threaded', 'asyncio'])
+def mode(request):
+    if request.param == 'asyncio':
+        runtime.start()
+    yield request.param
+    runtime.stop()
+
+@pytest.fixture
+def bot():
+    return StubBot()
+
+@pytest.fixture
+def make_dispatcher(mode, bot):
+    """Factory of dispatchers wired the way main wires them in `mode`; `workers` threads run the lanes."""
+    pools = []
+
+    def make(workers: int = 4):
+        pool = LaneExecutor(f'runtime-test-{len(pools)}', workers=workers)
+        pools.append(pool)
+        dispatcher = Dispatcher(bot, Queue(), workers=0)
+        shim = LaneDispatcher(dispatcher, {COMMANDS: pool}, key=lambda update: update.effective_chat.id,
+                              classify=lambda update: COMMANDS)
+        if mode == 'asyncio':
+            shim = AsyncDispatcher(shim, runtime)
+        registration.register_handlers(shim)
+        creative.register_handlers(shim)
+        voting.register_handlers(shim)
+        return dispatcher, pool
+
+    yield make
+    for pool in pools:
+        pool.stop()
+
+def user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'P{user_id}'}
+
+def command(bot: Bot, update_id: int, chat_id: int, user_id: int, text: str) -> Update:
+    return Update.de_json({'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'text': text, 'from': user(user_id),
+        'chat': {'id': chat_id, 'type': 'group', 'title': 'Game'},
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+    }}, bot)
+
+def private_text(bot: Bot, update_id: int, user_id: int, text: str) -> Update:
+    return Update.de_json({'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'text': text, 'from': user(user_id),
+        'chat': {'id': user_id, 'type': 'private'}
+    }}, bot)
+
+def vote(bot: Bot, update_id: int, user_id: int, data: str) -> Update:
+    return Update.de_json({'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'from': user(user_id), 'chat_instance': 'ci', 'data': data,
+        'message': {'message_id': 1, 'date': 0, 'text': 'Ballot', 'chat': {'id': user_id, 'type': 'private'}}
+    }}, bot)
+
+def wait_until(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def clear_registrations(chat_id: int) -> None:
+    Base.metadata.create_all(engine)
+    state_backend.clear_registrations(chat_id)
+    session = get_session()
+    session.query(Registration).filter(Registration.chat_id == chat_id).delete()
+    session.commit()
+    session.close()
+
+def test_joins_of_a_chat_are_answered_in_order(make_dispatcher, sent):
+    clear_registrations(-101)
+    dispatcher, pool = make_dispatcher()
+    for update_id, user_id in enumerate((11, 12, 13, 11)):
+        dispatcher.process_update(command(dispatcher.bot, update_id, -101, user_id, '/join'))
+    pool.stop()
+
+    assert [text.split('\n')[0] for _, text in sent] == [
+        f'P11 присоединился к игре! Зарегистрировано игроков: 1/{MIN_PLAYERS} мин. | {MAX_PLAYERS} макс.',
+        f'P12 присоединился к игре! Зарегистрировано игроков: 2/{MIN_PLAYERS} мин. | {MAX_PLAYERS} макс.',
+        f'P13 присоединился к игре! Зарегистрировано игроков: 3/{MIN_PLAYERS} мин. | {MAX_PLAYERS} макс.',
+        'P11, вы уже зарегистрированы для игры!',
+    ]
+    session = get_session()
+    try:
+        assert sorted(r.user_id for r in session.query(Registration).filter(Registration.chat_id == -101)) == [11, 12, 13]
+    finally:
+        session.close()
+
+def test_text_answer_is_stored_and_the_task_taken(make_dispatcher, sent):
+    Base.metadata.create_all(engine)
+    session = get_session()
+    submission = CreativeSubmission(task='Опишите кота', submission_type='TEXT')
+    session.add(submission)
+    session.commit()
+    submission_id = submission.id
+    session.close()
+    state_backend.put_tasks(901, {21: {'submission_id': submission_id, 'task_type': 'TEXT',
+                                       'task_text': 'Опишите кота', 'game_id': 1, 'round_id': 901}})
+
+    dispatcher, pool = make_dispatcher()
+    dispatcher.process_update(private_text(dispatcher.bot, 1, 21, 'Пушистый'))
+    dispatcher.process_update(private_text(dispatcher.bot, 2, 21, 'Еще раз'))
+    pool.stop()
+
+    assert sent == [(21, '✅ Ваш ответ принят! Ожидайте начала обсуждения.'),
+                    (21, 'У вас нет активного задания или время вышло.')]
+    session = get_session()
+    try:
+        assert session.get(CreativeSubmission, submission_id).content == 'Пушистый'
+    finally:
+        session.close()
+
+def test_vote_is_recorded_and_answered(make_dispatcher, bot):
+    players = [LivePlayer(1, 1, 31, 'P31', 'Шпион'), LivePlayer(2, 2, 32, 'P32', 'Лояльный агент')]
+    vote_ledger.open_round(902, 1, players)
+    try:
+        dispatcher, pool = make_dispatcher()
+        dispatcher.process_update(vote(bot, 1, 31, 'vote_902_2'))
+        dispatcher.process_update(vote(bot, 2, 31, 'vote_902_1'))
+        pool.stop()
+
+        answers = [text for endpoint, text in bot.calls if endpoint == 'answerCallbackQuery']
+        assert answers == ['Ваш голос против P32 учтен!', 'Вы не можете голосовать за себя.']
+        assert [endpoint for endpoint, _ in bot.calls].count('editMessageText') == 1
+    finally:
+        vote_ledger.discard_round(902)
+
+class GatedBackend(MemoryBackend):
+    """Memory backend whose lookups for one chat wait until `gate` is set."""
+
+    def __init__(self, chat_id: int):
+        super().__init__()
+        self.chat_id = chat_id
+        self.gate = threading.Event()
+
+    def chat_game(self, chat_id):
+        if chat_id == self.chat_id:
+            self.gate.wait(5)
+        return super().chat_game(chat_id)
+
+def test_a_waiting_handler_holds_no_lane_thread(make_dispatcher, mode, sent, monkeypatch):
+    clear_registrations(-201)
+    clear_registrations(-202)
+    backend = GatedBackend(-201)
+    monkeypatch.setattr(registration, 'state_backend', backend)
+    dispatcher, pool = make_dispatcher(workers=1)
+    try:
+        dispatcher.process_update(command(dispatcher.bot, 1, -201, 41, '/join'))
+        dispatcher.process_update(command(dispatcher.bot, 2, -202, 42, '/join'))
+        answered = wait_until(lambda: any(chat_id == -202 for chat_id, _ in sent), timeout=1)
+    finally:
+        backend.gate.set()
+    pool.stop()
+
+    # Threaded, the only lane thread waits with the first chat; as a coroutine the handler lets it go
+    assert answered == (mode == 'asyncio')
+    assert sorted(chat_id for chat_id, _ in sent) == [-202, -201]
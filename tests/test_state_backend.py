@@ -0,0 +1,164 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.models.state_backend import MemoryBackend, RedisBackend, StateBackend
+from app.utils.resp import RespClient
+from benchmarks import resp_standin
+
+THREADS = 8
+
+@pytest.fixture(scope='module')
+def client():
+    server = resp_standin.start()
+    client = RespClient(server.url, pool_size=THREADS)
+    yield client
+    client.close()
+    server.shutdown()
+
+@pytest.fixture(params=['memory', 'redis'])
+def make_backend(request):
+    """Factory of empty backends of each kind; `ttl` in seconds."""
+    if request.param == 'memory':
+        return lambda ttl=60: MemoryBackend(ttl=ttl)
+    client = request.getfixturevalue('client')
+    return lambda ttl=60: RedisBackend(client, prefix=f'test:{uuid.uuid4().hex[:8]}:', ttl=ttl)
+
+def race(call, threads: int = THREADS) -> list:
+    """Run `call(i)` on `threads` threads at once; returns the results in order."""
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(call, range(threads)))
+
+def user(user_id: int) -> dict:
+    return {'id': user_id, 'first_name': f'P{user_id}', 'is_bot': False}
+
+def task(round_id: int, submission_id: int) -> dict:
+    return {'submission_id': submission_id, 'task_type': 'TEXT', 'task_text': 'Task',
+            'game_id': 1, 'round_id': round_id}
+
+def test_state_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+def test_transaction_replies_come_back_in_order_and_atomically(client):
+    key = f'test:{uuid.uuid4().hex[:8]}:hash'
+    replies = race(lambda i: client.pipeline([('HSETNX', key, i, 'x'), ('HLEN', key)], transaction=True))
+    assert all(added == 1 for added, _ in replies)
+    # No other client's write lands between a transaction's two commands
+    assert sorted(length for _, length in replies) == list(range(1, THREADS + 1))
+
+def test_registrations_keep_join_order_and_refuse_a_second_join(make_backend):
+    backend = make_backend()
+    assert [backend.register(-1, user(u)) for u in (3, 1, 2)] == [1, 2, 3]
+    assert backend.register(-1, user(1)) is None
+    assert [u['id'] for u in backend.registrations(-1)] == [3, 1, 2]
+
+    joined = race(lambda i: backend.register(-2, user(7)))
+    assert sum(count is not None for count in joined) == 1
+
+    backend.clear_registrations(-1)
+    assert backend.registrations(-1) == []
+
+def test_take_task_hands_each_task_out_once(make_backend):
+    backend = make_backend()
+    backend.put_tasks(10, {100 + i: task(10, i) for i in range(THREADS)})
+    assert sorted(backend.tasks()) == list(range(100, 100 + THREADS))
+
+    # Every player takes their own task; exactly one of them sees the round finished
+    taken = race(lambda i: backend.take_task(100 + i))
+    assert [t['submission_id'] for t, _ in taken] == list(range(THREADS))
+    assert [remaining for _, remaining in taken].count(0) == 1
+    assert backend.tasks() == {}
+
+    # Racing for the same task, one caller wins
+    backend.put_tasks(11, {200: task(11, 0)})
+    doubled = race(lambda i: backend.take_task(200))
+    assert sum(t is not None for t, _ in doubled) == 1
+    assert backend.take_task(200) == (None, 0)
+
+def test_clear_round_tasks_leaves_other_rounds(make_backend):
+    backend = make_backend()
+    backend.put_tasks(10, {100: task(10, 1), 101: task(10, 2)})
+    backend.put_tasks(11, {200: task(11, 3)})
+    backend.clear_round_tasks(10)
+
+    assert backend.task(100) is None
+    assert list(backend.tasks()) == [200]
+    assert backend.take_task(200) == (task(11, 3), 0)
+
+def test_votes_survive_reopening_and_close_once(make_backend):
+    backend = make_backend()
+    backend.open_ballot(20, {'voters': {'1': 1}}, {1: (2, 1.5)})
+    assert backend.ballot(20) == {'voters': {'1': 1}}
+    assert backend.cast_vote(20, 2, 1, 2.5) == 2
+    assert backend.cast_vote(20, 2, 3, 3.5) == 2  # a changed vote replaces the first
+
+    # Reopening after a restart doesn't overwrite votes cast meanwhile
+    backend.open_ballot(20, {'voters': {'1': 1}}, {1: (9, 0.5)})
+    assert backend.close_ballot(20) == {1: (2, 1.5), 2: (3, 3.5)}
+    assert backend.close_ballot(20) is None
+    assert backend.ballot(20) is None
+
+    backend.open_ballot(21, {}, {})
+    race(lambda i: backend.cast_vote(21, i, 0, float(i)))
+    closed = race(lambda i: backend.close_ballot(21))
+    assert [votes for votes in closed if votes is not None] == [{i: (0, float(i)) for i in range(THREADS)}]
+
+def test_closed_ballot_refuses_votes(make_backend):
+    backend = make_backend()
+    backend.open_ballot(30, {}, {})
+    backend.close_ballot(30)
+
+    assert backend.cast_vote(30, 1, 2, 1.0) is None
+    assert backend.cast_vote(31, 1, 2, 1.0) is None  # never opened
+    # The refused vote left nothing behind for a later ballot of the round
+    backend.open_ballot(30, {}, {})
+    assert backend.close_ballot(30) == {}
+
+def test_untouched_state_expires(make_backend):
+    backend = make_backend(ttl=1)
+    backend.register(-3, user(1))
+    backend.put_tasks(40, {1: task(40, 1)})
+    backend.open_ballot(41, {}, {})
+    time.sleep(1.2)
+
+    assert backend.registrations(-3) == []
+    assert backend.task(1) is None
+    assert backend.tasks() == {}
+    assert backend.cast_vote(41, 1, 2, 1.0) is None
+
+def test_check_and_set_retries_when_a_watched_key_changes(client):
+    key = f'test:{uuid.uuid4().hex[:8]}:counter'
+    client.execute('SET', key, 1)
+    seen = []
+
+    def increment(replies):
+        seen.append(int(replies[0]))
+        if len(seen) == 1:
+            client.execute('SET', key, 5)  # another client writes between the read and EXEC
+        return [('SET', key, int(replies[0]) + 1)]
+
+    client.check_and_set([key], [('GET', key)], increment)
+    assert seen == [1, 5]
+    assert client.execute('GET', key) == b'6'
+
+    # Nothing to write leaves the key alone and the connection reusable
+    assert client.check_and_set([key], [('GET', key)], lambda replies: None) == ([b'6'], None)
+    assert client.pipeline([('GET', key)], transaction=True) == [b'6']
+
+def test_a_chat_runs_one_game_at_a_time(make_backend):
+    backend = make_backend()
+    assert backend.chat_game(-1) is None
+    claimed = race(lambda i: backend.claim_chat(-1, 100 + i))
+    assert claimed.count(True) == 1
+    winner = 100 + claimed.index(True)
+    assert backend.chat_game(-1) == winner
+    assert backend.claim_chat(-1, winner)  # claiming again after a restart
+
+    backend.release_chat(-1, 999)  # another game's release leaves the chat alone
+    assert backend.chat_game(-1) == winner
+    backend.release_chat(-1, winner)
+    assert backend.chat_game(-1) is None
+    assert backend.claim_chat(-1, 200)
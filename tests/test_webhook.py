@@ -0,0 +1,93 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from queue import Queue
+
+import pytest
+from telegram import Bot
+from telegram.ext import Dispatcher, MessageHandler, Filters
+
+from app.utils import metrics
+from app.utils.lanes import LaneDispatcher, LaneExecutor
+from app.utils.webhook import WebhookServer, SECRET_HEADER
+
+SECRET = 'secret-token'
+
+@pytest.fixture
+def bot():
+    return Bot('123456:test')
+
+@pytest.fixture
+def server(bot):
+    server = WebhookServer(bot, Queue(), listen='127.0.0.1', port=0, path='hook', secret=SECRET)
+    server.start()
+    yield server
+    server.stop()
+
+def post(server: WebhookServer, body: bytes, secret: str = None) -> int:
+    """POST `body` to the webhook; returns the HTTP status."""
+    request = urllib.request.Request(f'http://127.0.0.1:{server.port}/hook', data=body, method='POST',
+                                     headers={'Content-Type': 'application/json'})
+    if secret is not None:
+        request.add_header(SECRET_HEADER, secret)
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def message_update(update_id: int, chat_id: int = -1) -> bytes:
+    return json.dumps({'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'text': 'hello',
+        'chat': {'id': chat_id, 'type': 'group'},
+        'from': {'id': 7, 'is_bot': False, 'first_name': 'P7'}
+    }}).encode('utf-8')
+
+def test_wrong_or_missing_secret_is_rejected(server):
+    rejected = metrics.counter('webhook.rejected').value
+    assert post(server, message_update(1), secret='wrong') == 403
+    assert post(server, message_update(2)) == 403
+
+    assert metrics.counter('webhook.rejected').value == rejected + 2
+    assert server.update_queue.empty()
+
+def test_malformed_payload_is_a_bad_request(server):
+    assert post(server, b'{not json', secret=SECRET) == 400
+    assert post(server, b'\xff\xfe', secret=SECRET) == 400
+    assert server.update_queue.empty()
+
+def test_valid_update_reaches_the_queue(server):
+    assert post(server, message_update(3), secret=SECRET) == 200
+    update = server.update_queue.get(timeout=5)
+    assert update.update_id == 3
+    assert update.effective_message.text == 'hello'
+
+def test_latency_runs_until_the_handler_returns_on_its_lane(server, bot):
+    dispatcher = Dispatcher(bot, server.update_queue, workers=0)
+    pool = LaneExecutor('webhook-test', workers=2)
+    handled = threading.Event()
+    probed = server.attach(LaneDispatcher(dispatcher, {'commands': pool}, key=lambda update: update.effective_chat.id,
+                                          classify=lambda update: 'commands'))
+    probed.add_handler(MessageHandler(Filters.text, lambda update, context: handled.set()))
+    thread = threading.Thread(target=dispatcher.start, daemon=True)
+    thread.start()
+    stats = metrics.latency('webhook.ingest_to_handler')
+    count = stats.snapshot()['count']
+    try:
+        # The chat's lane is busy: the update waits behind the task before its handler runs
+        pool.submit(-1, time.sleep, 0.3)
+        assert post(server, message_update(4), secret=SECRET) == 200
+        assert handled.wait(5)
+        deadline = time.monotonic() + 5
+        while stats.snapshot()['count'] == count and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        dispatcher.stop()
+        thread.join(5)
+        pool.stop()
+
+    snapshot = stats.snapshot()
+    assert snapshot['count'] == count + 1
+    assert snapshot['max'] >= 0.25